@@ -0,0 +1,120 @@
+"""
+Offline throughput benchmark of the CCXTAggregator download paths against a FakeExchange.
+
+    python -m benchmarks.bench_aggregator --latency 0.05 --client-rate 50 --n-symbols 20
+    python -m benchmarks.bench_aggregator --recording binance.json --server-rate-limit 20
+
+Run from the repository root, so that smartpy is importable without being installed.
+
+Every scenario runs on a fresh aggregator and reports the exchange requests per second and the end-to-end latency
+of the operation over --repeat runs.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from smartpy.ccxt.aggregator import CCXTAggregator
+from smartpy.ccxt.fake_exchange import FakeExchange, ExchangeRecording
+from smartpy.ccxt.rate_limiter import resetRateLimiters
+from smartpy.ccxt.trade_downloader import TradeDownloader
+
+
+def makeAggregator(recording, args):
+    # Rate limiters are process wide per exchange name, every run starts from a full bucket with fresh metrics
+    resetRateLimiters()
+    exchange = 'fake'
+    config = {exchange: {'recording': recording,
+                         'latency': (args.latency * 0.5, args.latency * 1.5),
+                         'server_rate_limit': args.server_rate_limit,
+                         'server_burst': args.server_burst}}
+    aggregator = CCXTAggregator(config,
+                                rate_limits={exchange: (args.client_rate,)},
+                                markets_cache_dir=tempfile.mkdtemp(),
+                                ticker_ttl=0,
+                                exchange_classes={exchange: FakeExchange})
+    aggregator.exchange_markets.preload()
+    return aggregator, exchange
+
+
+def getOHLCScenario(aggregator, exchange, symbols, start, end):
+    aggregator.get_ohlc(exchange, symbols[0], '1m', start, end)
+
+
+def getOHLCManyScenario(aggregator, exchange, symbols, start, end):
+    aggregator.get_ohlc_many([{'exchange': exchange, 'symbol': symbol, 'timeframe': '1m',
+                               'start_time': start, 'end_time': end} for symbol in symbols])
+
+
+def getMyTradesScenario(aggregator, exchange, symbols, start, end):
+    aggregator.getMyTrades(exchange, symbols)
+
+
+def getTradesScenario(aggregator, exchange, symbols, start, end):
+    TradeDownloader(aggregator, tempfile.mkdtemp()).download(exchange, symbols[0], start, end)
+
+
+def getSyntheticRatesScenario(aggregator, exchange, symbols, start, end):
+    aggregator.getSyntheticRates(exchange, symbols)
+
+
+def sendOrdersScenario(aggregator, exchange, symbols, start, end):
+    aggregator.sendAgressiveOrders(exchange, [(symbol, 'buy', 1.0) for symbol in symbols])
+
+
+SCENARIOS = {'get_ohlc': getOHLCScenario,
+             'get_ohlc_many': getOHLCManyScenario,
+             'get_my_trades': getMyTradesScenario,
+             'download_trades': getTradesScenario,
+             'synthetic_rates': getSyntheticRatesScenario,
+             'send_orders': sendOrdersScenario}
+
+
+def runScenario(name, recording, args, start, end):
+    symbols = list(recording.markets)
+    n_requests = []
+    latencies = []
+    for _ in range(args.repeat):
+        aggregator, exchange = makeAggregator(recording, args)
+        exchange_object = aggregator.ccxt_exchange_objects[exchange]
+        requests_before = sum(exchange_object.request_counts.values())
+        start_time = time.perf_counter()
+        SCENARIOS[name](aggregator, exchange, symbols, start, end)
+        latencies.append(time.perf_counter() - start_time)
+        n_requests.append(sum(exchange_object.request_counts.values()) - requests_before)
+    latencies = np.array(latencies)
+    return {'scenario': name,
+            'requests': int(np.mean(n_requests)),
+            'requests_per_s': np.sum(n_requests) / np.sum(latencies),
+            'latency_p50_s': np.percentile(latencies, 50),
+            'latency_p95_s': np.percentile(latencies, 95)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording', help='ExchangeRecording JSON file, a synthetic one is generated if omitted')
+    parser.add_argument('--n-symbols', type=int, default=10)
+    parser.add_argument('--n-bars', type=int, default=20000)
+    parser.add_argument('--n-trades', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.02, help='mean exchange latency in seconds')
+    parser.add_argument('--client-rate', type=float, default=50, help='aggregator rate limit in requests per second')
+    parser.add_argument('--server-rate-limit', type=float, default=None)
+    parser.add_argument('--server-burst', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = parser.parse_args()
+
+    if args.recording is not None:
+        recording = ExchangeRecording.load(args.recording)
+    else:
+        recording = ExchangeRecording.makeSynthetic([f"C{i}/USDT" for i in range(args.n_symbols)],
+                                                    n_bars=args.n_bars,
+                                                    n_trades=args.n_trades)
+    timestamps = [bar[0] for bars in recording.ohlcv.values() for rows in bars.values() for bar in rows]
+    start = pd.to_datetime(min(timestamps), unit='ms').to_pydatetime()
+    end = pd.to_datetime(max(timestamps), unit='ms').to_pydatetime()
+
+    results = pd.DataFrame([runScenario(name, recording, args, start, end) for name in args.scenarios])
+    print(results.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
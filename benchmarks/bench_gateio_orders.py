@@ -0,0 +1,76 @@
+"""
+Benchmark of processGateIOCCXTOrdersDF against the previous row-wise implementation.
+
+    python -m benchmarks.bench_gateio_orders --n-orders 1000000
+
+Run from the repository root, so that smartpy is importable without being installed.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from smartpy.ccxt.helpers import processGateIOCCXTOrdersDF, getFeeAttribute
+
+
+def processGateIOCCXTOrdersDFRowWise(trades_df):
+    to_process = trades_df.copy()
+    to_process['datetime'] = to_process['datetime'].apply(lambda x: str(x).replace('Z', '').replace('T', ' '))
+    to_process['datetime'] = pd.to_datetime(to_process['datetime'])
+    to_process['fee_currency'] = to_process['fees'].apply(lambda x: getFeeAttribute(x, 'currency'))
+    to_process['fee_amount'] = to_process['fees'].apply(lambda x: getFeeAttribute(x, 'cost'))
+    to_process['fee_USDT'] = np.where(to_process['fee_currency'] == 'USDT',
+                                      to_process['fee_amount'].astype(float),
+                                      to_process['fee_amount'].astype(float) * to_process['price'])
+    to_process.drop(['info', 'fee', 'fees', 'trades'], axis=1, inplace=True)
+    to_process['coin'] = to_process['coin'].apply(lambda x: x.split('/')[0])
+    return to_process
+
+
+def makeOrders(n_orders, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = 1640995200000 + np.sort(rng.integers(0, 365 * 24 * 3600 * 1000, n_orders))
+    coins = np.array(['BTC/USDT', 'ETH/USDT', 'GT/USDT', 'DOGE/USDT'])[rng.integers(0, 4, n_orders)]
+    prices = rng.uniform(0.1, 50000, n_orders)
+    fee_currencies = np.array(['USDT', 'BTC', 'ETH'])[rng.integers(0, 3, n_orders)]
+    fee_costs = rng.uniform(0, 1, n_orders)
+    has_gt = rng.random(n_orders) < 0.3
+    datetimes = pd.to_datetime(timestamps, unit='ms').strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z'
+    fees = [([{'currency': 'GT', 'cost': 0.0}] if gt else []) + [{'currency': currency, 'cost': cost}]
+            for gt, currency, cost in zip(has_gt, fee_currencies, fee_costs)]
+    return pd.DataFrame({'id': np.arange(n_orders).astype(str),
+                         'datetime': datetimes,
+                         'timestamp': timestamps,
+                         'coin': coins,
+                         'price': prices,
+                         'fees': fees,
+                         'info': None,
+                         'fee': None,
+                         'trades': None})
+
+
+def timeFunction(function, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-orders', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    orders_df = makeOrders(args.n_orders)
+    row_wise_time, expected = timeFunction(processGateIOCCXTOrdersDFRowWise, orders_df, args.repeat)
+    vectorized_time, result = timeFunction(processGateIOCCXTOrdersDF, orders_df, args.repeat)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    print(f"{args.n_orders} orders")
+    print(f"row-wise   : {row_wise_time:.3f}s")
+    print(f"vectorized : {vectorized_time:.3f}s")
+    print(f"speedup    : {row_wise_time / vectorized_time:.1f}x")
@@ -1,9 +1,20 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import ccxt
 import pandas as pd
 
-from smartpy.ccxt.helpers import CCXT_EXCEPTIONS
+from smartpy.ccxt.helpers import CCXT_EXCEPTIONS, processGateIOCCXTOrdersDF
+from smartpy.ccxt.live_market_data import LiveMarketData, CCXTProTransport, DEFAULT_CHANNELS, DEFAULT_MAX_AGE
+from smartpy.ccxt.markets_cache import ExchangeMarkets, DEFAULT_MARKETS_TTL, getMarketsCacheKey
+from smartpy.ccxt.ohlc_resampler import resampleOHLC, getTimeframeMs, getTimeframeOffsetMs
+from smartpy.ccxt.rate_graph import CurrencyGraph
+from smartpy.ccxt.rate_limiter import getRateLimiter, getEndpointWeight
+from smartpy.ccxt.ticker_cache import TickerCache, DEFAULT_TICKER_TTL
 from smartpy.utility.log_util import getLogger
 from smartpy.utility.py_util import keep_trying
+import smartpy.utility.os_util as os_util
 import smartpy.utility.dt_util as dt_util
 import datetime as dt
 
@@ -12,6 +23,7 @@ logger = getLogger(__name__)
 
 MINIMAL_ORDER_COLUMNS = ['timestamp', 'coin', 'filled', 'side', 'price', 'status']
 CCXT_OHLC_HEADERS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+BATCH_ORDER_COLUMNS = ['symbol', 'side', 'amount', 'mid', 'price', 'order', 'error', 'latency']
 
 minutes_add = {
     "1m": 1,
@@ -20,24 +32,97 @@ minutes_add = {
     "1d": 60 * 24
 }
 
+# Maximum number of candles returned by a single fetch_ohlcv call, used to size pagination windows
+OHLCV_PAGE_LIMITS = {
+    "binance": 1000,
+    "binanceusdm": 1500,
+    "bybit": 1000,
+    "gateio": 1000,
+    "kraken": 720,
+    "kucoin": 1500,
+    "okx": 300,
+    "coinbase": 300
+}
+DEFAULT_OHLCV_PAGE_LIMIT = 500
+
 
 class CCXTAggregator:
 
     def __init__(self,
-                 config):
+                 config,
+                 ohlc_cache_dir=None,
+                 ohlc_page_workers=4,
+                 rate_limits=None,
+                 ticker_ttl=DEFAULT_TICKER_TTL,
+                 markets_cache_dir=None,
+                 markets_ttl=DEFAULT_MARKETS_TTL,
+                 preload_markets=False,
+                 exchange_classes=None):
+        """
+        :param config: dict exchange -> ccxt constructor config
+        :param rate_limits: dict exchange -> (rate,) or (rate, capacity) of the process wide exchange token bucket,
+        1000 / ccxt rateLimit requests per second by default
+        :param exchange_classes: dict exchange -> class used instead of the ccxt one, e.g. a FakeExchange
+        """
         self.exchange_balances = {}
         self.exchange_orders = {}
 
+        self.config = config
         self.exchange_list = config.keys()
         self.exchange_live_market_data = {}
         self.ccxt_exchange_objects = {}
-        self.exchange_markets = {}
+        self.ohlc_cache = None
+        if ohlc_cache_dir is not None:
+            # The cache is stored as Parquet, pyarrow is only needed when it is enabled
+            from smartpy.ccxt.ohlc_cache import OHLCCache
+            self.ohlc_cache = OHLCCache(ohlc_cache_dir)
+        self.ohlc_page_workers = ohlc_page_workers
+        self.rate_limiters = {}
+        self.currency_graphs = {}
+        self.ticker_cache = TickerCache(lambda exchange: self.callEndpoint(exchange, 'fetch_tickers'), ttl=ticker_ttl)
+        rate_limits = rate_limits if rate_limits is not None else {}
+        exchange_classes = exchange_classes if exchange_classes is not None else {}
+
+        markets_cache_keys = {}
 
         # Initilizing various objects
         for exchange in self.exchange_list:
-            exchange_class = getattr(ccxt, exchange)
-            self.ccxt_exchange_objects[exchange] = exchange_class(config[exchange])
-            self.exchange_markets[exchange] = self.ccxt_exchange_objects[exchange].load_markets()
+            exchange_class = exchange_classes[exchange] if exchange in exchange_classes else getattr(ccxt, exchange)
+            markets_cache_keys[exchange] = getMarketsCacheKey(exchange, exchange_class, config[exchange])
+            # Throttling is done by the shared token buckets, ccxt's own sleep based limiter would serialize threads
+            self.ccxt_exchange_objects[exchange] = exchange_class({'enableRateLimit': False, **config[exchange]})
+            default_rate = 1000 / self.ccxt_exchange_objects[exchange].rateLimit
+            self.rate_limiters[exchange] = getRateLimiter(exchange, *rate_limits.get(exchange, ()),
+                                                          default_rate=default_rate)
+
+        # Markets are loaded on first use of each exchange, from the disk cache when it is fresh enough
+        self.exchange_markets = ExchangeMarkets(
+            self.ccxt_exchange_objects,
+            lambda exchange: self.callEndpoint(exchange, 'load_markets'),
+            cache_dir=markets_cache_dir if markets_cache_dir is not None else os_util.getTempDir('ccxt_markets',
+                                                                                                ensure_dir=False),
+            ttl=markets_ttl,
+            cache_keys=markets_cache_keys)
+        if preload_markets:
+            self.exchange_markets.preload()
+
+    def callEndpoint(self, exchange, endpoint, *args, **kwargs):
+        """
+        Call a ccxt endpoint once the exchange token bucket has capacity for it
+        """
+        if endpoint != 'load_markets':
+            # Make sure ccxt does not load the markets itself, bypassing the rate limiter and the disk cache
+            self.exchange_markets[exchange]
+        rate_limiter = self.rate_limiters[exchange]
+        rate_limiter.acquire(getEndpointWeight(exchange, endpoint))
+        try:
+            return getattr(self.ccxt_exchange_objects[exchange], endpoint)(*args, **kwargs)
+        except (ccxt.RateLimitExceeded, ccxt.DDoSProtection):
+            rate_limiter.penalize()
+            raise
+
+    def getRateLimitMetrics(self):
+        return {exchange: rate_limiter.getMetrics() for exchange, rate_limiter in self.rate_limiters.items()}
 
     @keep_trying(exceptions=CCXT_EXCEPTIONS)
     def getAvailableSymbols(self,
@@ -51,122 +136,359 @@ class CCXTAggregator:
                  symbol,
                  timeframe,
                  start_time,
-                 end_time=str(dt.datetime.now())):
+                 end_time=None):
 
-        # standardize to dateitme
-        start_time = dt_util.toDatetime(start_time)
-        end_time = dt_util.toDatetime(end_time)
-        # Put the right format so it doesn't bug
-        start_time = str(start_time.date()) + ' 00:00:00'
-        end_time = str(end_time)
+        if end_time is None:
+            end_time = dt.datetime.now()
+        if self.ohlc_cache is not None:
+            return self._getCachedOHLC(exchange, symbol, timeframe, start_time, end_time)
 
         exchange_object = self.ccxt_exchange_objects[exchange]
-        from_timestamp = exchange_object.parse8601(start_time)
-        msec = 1000
-        minute = 60 * msec
-        now = exchange_object.milliseconds()
+        start = exchange_object.parse8601(str(dt_util.toDatetime(start_time)))
+        end = exchange_object.parse8601(str(dt_util.toDatetime(end_time)))
+        data = self._fetchOHLCRange(exchange, symbol, timeframe, start, end + 1)
+        return self._toOHLCDataFrame(data, symbol)
+
+    def _getCachedOHLC(self,
+                       exchange,
+                       symbol,
+                       timeframe,
+                       start_time,
+                       end_time):
+        """
+        Serve get_ohlc from the local cache, downloading only the ranges that are not cached yet.
+        Bars that are not closed yet are returned but never marked as cached, so they get refreshed on the next call.
+        """
+        exchange_object = self.ccxt_exchange_objects[exchange]
+        start = exchange_object.parse8601(str(dt_util.toDatetime(start_time)))
+        end = exchange_object.parse8601(str(dt_util.toDatetime(end_time)))
+        timeframe_ms = exchange_object.parse_timeframe(timeframe) * 1000
+        last_closed_bar_end = exchange_object.milliseconds() // timeframe_ms * timeframe_ms
+
+        for missing_start, missing_end in self.ohlc_cache.getMissingRanges(exchange, symbol, timeframe,
+                                                                           start, end + 1):
+            bars = self._fetchOHLCRange(exchange, symbol, timeframe, missing_start, missing_end)
+            self.ohlc_cache.write(exchange, symbol, timeframe, bars,
+                                  covered_start=missing_start,
+                                  covered_end=min(missing_end, last_closed_bar_end))
+
+        df = self.ohlc_cache.read(exchange, symbol, timeframe, start, end)
+        return self._toOHLCDataFrame(df, symbol)
+
+    def _fetchOHLCRange(self,
+                        exchange,
+                        symbol,
+                        timeframe,
+                        since,
+                        until):
+        """
+        Raw ccxt ohlcv rows with since <= timestamp < until, timestamps in milliseconds.
+        The range is split in windows of one exchange page each, fetched concurrently then stitched and deduped.
+        """
+        exchange_object = self.ccxt_exchange_objects[exchange]
+        timeframe_ms = exchange_object.parse_timeframe(timeframe) * 1000
+        limit = OHLCV_PAGE_LIMITS.get(exchange, DEFAULT_OHLCV_PAGE_LIMIT)
+        windows = dt_util.getMillisecondPaginationIntervals(since, until, limit * timeframe_ms)
+        if len(windows) <= 1 or self.ohlc_page_workers <= 1:
+            pages = [self._fetchOHLCWindow(exchange, symbol, timeframe, limit, *window) for window in windows]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.ohlc_page_workers, len(windows)),
+                                    thread_name_prefix=f"ohlc_pages_{exchange}") as executor:
+                pages = list(executor.map(lambda window: self._fetchOHLCWindow(exchange, symbol, timeframe,
+                                                                               limit, *window),
+                                          windows))
+        data = {}
+        for page in pages:
+            for row in page:
+                data[row[0]] = row
+        return [data[timestamp] for timestamp in sorted(data)]
+
+    def _fetchOHLCWindow(self,
+                         exchange,
+                         symbol,
+                         timeframe,
+                         limit,
+                         window_start,
+                         window_end):
+        exchange_object = self.ccxt_exchange_objects[exchange]
+        timeframe_ms = exchange_object.parse_timeframe(timeframe) * 1000
         data = []
-        while from_timestamp < now:
-            ohlcvs = exchange_object.fetch_ohlcv(symbol, timeframe, from_timestamp)
-            if len(ohlcvs) > 0:
-                from_timestamp = ohlcvs[-1][0] + minute * minutes_add[timeframe]
-                data += ohlcvs
-                # Stop when you get to end time + 1 day
-                if from_timestamp > exchange_object.parse8601(str(end_time)) + 1000 * 3600 * 24:
-                    break
-            else:
-                from_timestamp += 1000 * 3600 * 24 * 7
+        cursor = window_start
+        # An exchange can return less than a full page (lower cap, missing bars), so keep paging inside the window
+        while cursor < window_end:
+            ohlcvs = self.callEndpoint(exchange, 'fetch_ohlcv', symbol, timeframe, cursor, limit)
+            rows = [i for i in ohlcvs if cursor <= i[0] < window_end]
+            if len(rows) == 0:
+                break
+            data += rows
+            cursor = rows[-1][0] + timeframe_ms
+        return data
 
+    @staticmethod
+    def _toOHLCDataFrame(data, symbol):
         df = pd.DataFrame(data, columns=CCXT_OHLC_HEADERS)
         df['timestamp'] = pd.to_datetime(df.timestamp, unit='ms')
         df['coin'] = symbol.split('/')[0]
         return df
 
+    @staticmethod
+    def _getOHLCRequestKey(request):
+        return request['exchange'], request['symbol'], request['timeframe'], request['start_time'], \
+            request.get('end_time')
+
+    def get_ohlc_many(self,
+                      requests,
+                      max_workers_per_exchange=4,
+                      concat=True):
+        """
+        Download OHLC bars for many exchanges/symbols concurrently, with one bounded worker pool per exchange
+        :param requests: list of dicts holding get_ohlc keyword arguments (exchange, symbol, timeframe, start_time
+        and optionally end_time)
+        :param max_workers_per_exchange: maximum number of concurrent downloads on a single exchange
+        :param concat: if True return one frame with an extra 'exchange' column, else a dict of frames keyed by
+        (exchange, symbol, timeframe, start_time, end_time)
+        :return: tuple (ohlc, failures) where failures maps (exchange, symbol, timeframe, start_time, end_time) to the
+        raised exception. Identical requests are downloaded once.
+        """
+        requests_by_exchange = {}
+        for request in requests:
+            requests_by_exchange.setdefault(request['exchange'], []).append(request)
+
+        failures = {}
+        futures = {}
+        executors = []
+        for exchange, exchange_requests in requests_by_exchange.items():
+            if exchange not in self.ccxt_exchange_objects:
+                for request in exchange_requests:
+                    failures[self._getOHLCRequestKey(request)] = KeyError(f"{exchange} is not configured in this aggregator")
+                continue
+            executor = ThreadPoolExecutor(max_workers=max_workers_per_exchange,
+                                          thread_name_prefix=f"ohlc_{exchange}")
+            executors.append(executor)
+            for request in exchange_requests:
+                key = self._getOHLCRequestKey(request)
+                if key not in futures:
+                    futures[key] = executor.submit(self.get_ohlc, **request)
+
+        frames = {}
+        for key, future in futures.items():
+            try:
+                frames[key] = future.result()
+            except Exception as e:
+                logger.warning(f"OHLC download failed for {key} : {type(e).__name__} {e}")
+                failures[key] = e
+        for executor in executors:
+            executor.shutdown()
+
+        if not concat:
+            return frames, failures
+        if len(frames) == 0:
+            return pd.DataFrame(columns=CCXT_OHLC_HEADERS + ['coin', 'exchange']), failures
+        ohlc = pd.concat([df.assign(exchange=key[0]) for key, df in frames.items()], ignore_index=True)
+        return ohlc, failures
+
+    def get_ohlc_multi(self,
+                       exchange,
+                       symbol,
+                       timeframes,
+                       start_time,
+                       end_time=None,
+                       base_timeframe='1m'):
+        """
+        Bars of several timeframes derived from a single (cache aware) download of base_timeframe bars
+        :param timeframes: list of timeframes that are multiples of base_timeframe, e.g. ['5m', '15m', '1h', '1d', '90m']
+        :return: dict timeframe -> DataFrame, the first and last bars are incomplete if the range does not cover them
+        """
+        start = dt_util.toDatetime(start_time)
+        # Start on a boundary of the largest timeframe so the first bar of every timeframe is complete
+        largest_timeframe = max(timeframes, key=getTimeframeMs)
+        timeframe_ms, offset = getTimeframeMs(largest_timeframe), getTimeframeOffsetMs(largest_timeframe)
+        start_ms = int(pd.Timestamp(start).value // 10 ** 6)
+        aligned_start = pd.to_datetime((start_ms - offset) // timeframe_ms * timeframe_ms + offset, unit='ms')
+        base_df = self.get_ohlc(exchange, symbol, base_timeframe, aligned_start.to_pydatetime(), end_time)
+        return {timeframe: resampleOHLC(base_df, timeframe) if timeframe != base_timeframe else base_df
+                for timeframe in timeframes}
+
     @keep_trying(exceptions=CCXT_EXCEPTIONS)
     def get_last(self,
                  exchange,
                  symbol,
-                 translator_ccy='BTC'):
-        if symbol in self.getAvailableSymbols(exchange):
-            return self.exchange_live_market_data[exchange].get_last(symbol)
+                 translator_ccy=None):
+        if symbol in self.exchange_markets[exchange]:
+            if exchange in self.exchange_live_market_data:
+                try:
+                    return self.exchange_live_market_data[exchange].get_last(symbol)
+                except KeyError:
+                    # Symbol not subscribed or no update received yet
+                    pass
+            return self.getTicker(exchange, symbol)['last']
         else:
-            logger.info(f"{symbol} not available on {exchange}, need to calculate syntethic through {translator_ccy}")
+            logger.info(f"{symbol} not available on {exchange}, need to calculate syntethic rate")
             return self.getSyntheticRate(exchange, symbol, translator_ccy)
 
+    def getTicker(self,
+                  exchange,
+                  symbol):
+        """
+        Ticker from the cached fetch_tickers snapshot, falling back to fetch_ticker for symbols the bulk call omits
+        """
+        tickers = self.ticker_cache.getTickers(exchange)
+        if symbol in tickers:
+            return tickers[symbol]
+        return self.callEndpoint(exchange, 'fetch_ticker', symbol=symbol)
+
+    def subscribeLiveMarketData(self,
+                                exchange,
+                                symbols,
+                                transport=None,
+                                channels=DEFAULT_CHANNELS,
+                                max_age=DEFAULT_MAX_AGE):
+        """
+        Start a push feed keeping exchange_live_market_data[exchange] up to date for symbols
+        :param transport: MarketDataTransport, defaults to the exchange ccxt.pro websockets
+        :param max_age: seconds after which live values are ignored and prices are fetched by REST again
+        """
+        self.unsubscribeLiveMarketData(exchange)
+        if transport is None:
+            transport = CCXTProTransport(exchange, self.config[exchange])
+        live_market_data = LiveMarketData(exchange, symbols, transport, channels=channels, max_age=max_age)
+        self.exchange_live_market_data[exchange] = live_market_data.start()
+        return live_market_data
+
+    def unsubscribeLiveMarketData(self,
+                                  exchange):
+        if exchange in self.exchange_live_market_data:
+            self.exchange_live_market_data.pop(exchange).stop()
+
+    def startTickerRefresh(self,
+                           exchange,
+                           interval=None):
+        """
+        Keep the ticker snapshot of an exchange warm from a background thread
+        """
+        self.ticker_cache.startBackgroundRefresh(exchange, interval)
+
+    def stopTickerRefresh(self,
+                          exchange=None):
+        self.ticker_cache.stopBackgroundRefresh(exchange)
+
+    def getCurrencyGraph(self, exchange):
+        if exchange not in self.currency_graphs:
+            self.currency_graphs[exchange] = CurrencyGraph(self.exchange_markets[exchange])
+        return self.currency_graphs[exchange]
+
     @keep_trying(exceptions=CCXT_EXCEPTIONS)
     def getSyntheticRate(self,
                          exchange,
                          symbol,
-                         translator_ccy):
+                         translator_ccy=None):
+        """
+        Rate of a symbol that is not necessarily listed on the exchange
+        :param translator_ccy: currency to route through, if None the shortest path in the exchange currency graph
+        is used
+        """
+        if translator_ccy is None:
+            return self.getSyntheticRates(exchange, [symbol])[symbol]
+
         split_symbol = symbol.split('/')
         symbol_base_ccy, symbol_quoted_ccy = split_symbol[0], split_symbol[1]
 
         symbol_base_vs_translator = f"{symbol_base_ccy}/{translator_ccy}"
-        symbol_base_vs_translator_live_rate = \
-            self.ccxt_exchange_objects[exchange].fetch_ticker(symbol=symbol_base_vs_translator)['last']
+        symbol_base_vs_translator_live_rate = self.getTicker(exchange, symbol_base_vs_translator)['last']
 
         translator_vs_symbol_quoted = f"{translator_ccy}/{symbol_quoted_ccy}"
-        translator_vs_symbol_quoted_live_rate = \
-            self.ccxt_exchange_objects[exchange].fetch_ticker(symbol=translator_vs_symbol_quoted)['last']
+        translator_vs_symbol_quoted_live_rate = self.getTicker(exchange, translator_vs_symbol_quoted)['last']
 
         symbol_live_rate = symbol_base_vs_translator_live_rate * translator_vs_symbol_quoted_live_rate
         return symbol_live_rate
 
+    @keep_trying(exceptions=CCXT_EXCEPTIONS)
+    def getSyntheticRates(self,
+                          exchange,
+                          symbols):
+        """
+        Rates of many symbols at once, routed through the exchange currency graph and priced from one ticker snapshot
+        :param symbols: list of BASE/QUOTE symbols, e.g. all holdings against USDT
+        :return: pd.Series of rates indexed by symbol
+        """
+        rates = self.getCurrencyGraph(exchange).computeRates(symbols, self.ticker_cache.getTickers(exchange))
+        return pd.Series(rates, index=symbols)
+
     @keep_trying(exceptions=CCXT_EXCEPTIONS)
     def getBalances(self, exchange):
-        return self.ccxt_exchange_objects[exchange].fetchBalance()
+        return self.callEndpoint(exchange, 'fetch_balance')
 
     @keep_trying(exceptions=CCXT_EXCEPTIONS)
     def getMyTrades(self,
                     exchange,
                     symbols):
         """
-        Get fills
+        Get the full fill history of symbols, fetched concurrently. Use TradeSync to only download new fills.
         :param exchange:
-        :param coin:
+        :param symbols:
         :return:
         """
         if isinstance(symbols, str):
             symbols = [symbols]
-        trades = pd.DataFrame()
-        for sym in symbols:
-            tmp = pd.DataFrame(self.ccxt_exchange_objects[exchange].fetchMyTrades(symbol=sym))
-            trades = trades.append(tmp)
-        return trades.reset_index(drop=True)
+        with ThreadPoolExecutor(max_workers=max(1, min(4, len(symbols))),
+                                thread_name_prefix=f"my_trades_{exchange}") as executor:
+            trades = list(executor.map(lambda sym: self.callEndpoint(exchange, 'fetch_my_trades', symbol=sym), symbols))
+        return pd.DataFrame([trade for symbol_trades in trades for trade in symbol_trades])
+
+    def iterClosedOrders(self,
+                         exchange,
+                         symbol,
+                         start_time,
+                         end_time,
+                         prefetch=4,
+                         limit=1000):
+        """
+        Yield processed DataFrame chunks of closed orders page by page, as they arrive.
+        The next pages are requested ahead while the current one is consumed, with at most prefetch pages in flight.
+        :param prefetch: number of pages requested concurrently
+        :param limit: orders per page
+        """
+        params = {
+            'title': int(self.ccxt_exchange_objects[exchange].parse8601(str(dt_util.toDatetime(start_time))) / 1000),
+            'to': int(self.ccxt_exchange_objects[exchange].parse8601(str(dt_util.toDatetime(end_time))) / 1000),
+            'limit': limit
+        }
+
+        @keep_trying(exceptions=CCXT_EXCEPTIONS)
+        def fetchPage(page):
+            return self.callEndpoint(exchange, 'fetch_closed_orders',
+                                     symbol=symbol,
+                                     since=None,
+                                     limit=limit,
+                                     params={**params, 'page': page})
+
+        executor = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix=f"closed_orders_{exchange}")
+        pending = deque(executor.submit(fetchPage, page) for page in range(1, prefetch + 1))
+        next_page = prefetch + 1
+        try:
+            while len(pending) > 0:
+                closed_orders = pending.popleft().result()
+                if len(closed_orders) == 0:
+                    break
+                pending.append(executor.submit(fetchPage, next_page))
+                next_page += 1
+                yield processGateIOCCXTOrdersDF(pd.DataFrame(closed_orders))
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def getClosedOrders(self,
                         exchange,
                         symbol,
                         start_time,
-                        end_time):
-
-        all_closed_orders = []
-        page = 1
-
-        while True:
-            since = None
-            limit = 1000
-            params = {
-                'title': int((self.ccxt_exchange_objects[exchange].parse8601(str(start_time))) / 1000),
-                'to': int((self.ccxt_exchange_objects[exchange].parse8601(str(end_time))) / 1000),
-                'page': page,
-                'limit': 1000
-            }
-            closed_orders = self.ccxt_exchange_objects[exchange].fetchClosedOrders(symbol=symbol,
-                                                                                   since=since,
-                                                                                   limit=limit,
-                                                                                   params=params)
-            all_closed_orders += closed_orders
-
-            if len(closed_orders):
-                page += 1
-            else:
-                break
-        closed_orders_df = pd.DataFrame(all_closed_orders)
-        if len(closed_orders_df)>0:
-            return processGateIOCCXTOrdersDF(closed_orders_df)
+                        end_time,
+                        prefetch=4):
+        chunks = list(self.iterClosedOrders(exchange, symbol, start_time, end_time, prefetch=prefetch))
+        if len(chunks) > 0:
+            return pd.concat(chunks, ignore_index=True)
         else:
-            closed_orders_df
+            return pd.DataFrame()
 
     @keep_trying(exceptions=CCXT_EXCEPTIONS)
     def getOpenOrders(self, exchange):
@@ -175,7 +497,7 @@ class CCXTAggregator:
         :param exchange:
         :return:
         """
-        df = pd.DataFrame(self.ccxt_exchange_objects[exchange].fetchOpenOrders())
+        df = pd.DataFrame(self.callEndpoint(exchange, 'fetch_open_orders'))
         if len(df) > 0:
             df['coin'] = df['coin'].apply(lambda x: x.split('/')[0])
             if len(df) > 0:
@@ -194,10 +516,10 @@ class CCXTAggregator:
         :return:
         """
         # TODO https://docs.ccxt.com/en/latest/manual.html#overriding-unified-api-params
-        exchange_object = self.ccxt_exchange_objects[exchange]
         since = round(dt_util.toDatetime(since).timestamp() * 1000)
-        orders = exchange_object.fetch_orders(symbol=symbol,
-                                              since=since)
+        orders = self.callEndpoint(exchange, 'fetch_orders',
+                                   symbol=symbol,
+                                   since=since)
         if len(orders) > 0:
             orders_df = pd.DataFrame(orders)
             orders_df['timestamp'] = pd.DatetimeIndex(orders_df['timestamp']).tz_localize('UTC').tz_convert('EST')
@@ -205,6 +527,49 @@ class CCXTAggregator:
         else:
             return None
 
+    def getMid(self,
+               exchange,
+               symbol):
+        return self.getMids(exchange, [symbol])[symbol]
+
+    def getMids(self,
+                exchange,
+                symbols,
+                refresh=False):
+        """
+        Mid prices of several symbols from one snapshot: the live top of book when subscribed, else a single
+        fetch_tickers snapshot (bid/ask mid, last price when the exchange does not report bid/ask)
+        :param refresh: fetch a new ticker snapshot instead of using the cached one
+        """
+        live_market_data = self.exchange_live_market_data.get(exchange)
+        mids = {}
+        if live_market_data is not None:
+            for symbol in symbols:
+                try:
+                    mids[symbol] = live_market_data.getMid(symbol)
+                except KeyError:
+                    # Symbol not subscribed, no bid/ask received yet or stale live data
+                    pass
+        missing_symbols = [symbol for symbol in symbols if symbol not in mids]
+        if len(missing_symbols) > 0:
+            tickers = self.ticker_cache.refresh(exchange) if refresh else self.ticker_cache.getTickers(exchange)
+            for symbol in missing_symbols:
+                ticker = tickers[symbol] if symbol in tickers else self.callEndpoint(exchange, 'fetch_ticker',
+                                                                                       symbol=symbol)
+                if ticker.get('bid') is not None and ticker.get('ask') is not None:
+                    mids[symbol] = 0.5 * (ticker['bid'] + ticker['ask'])
+                else:
+                    mids[symbol] = ticker['last']
+        return mids
+
+    @staticmethod
+    def getAgressivePrice(mid, side, aggressivity_bps):
+        if side == 'sell':
+            return mid * (1 - aggressivity_bps / 10000)
+        elif side == 'buy':
+            return mid * (1 + aggressivity_bps / 10000)
+        raise ValueError(f"Unknown order side {side}")
+
     def sendAgressiveOrder(self,
                            exchange,
                            symbol,
@@ -213,11 +578,6 @@ class CCXTAggregator:
                            usd_amount=None,
                            aggressivity_bps=500,
                            params={}):
-        if side == 'sell':
-            agressivity = (1 - aggressivity_bps / 10000)
-        elif side == 'buy':
-            agressivity = (1 + aggressivity_bps / 10000)
-
         mid = self.getMid(exchange=exchange,
                           symbol=symbol)
 
@@ -231,12 +591,56 @@ class CCXTAggregator:
         message = f"Agressive limit {side} of {round(usd_amount)} USD / {local_equivalent} {symbol.split('/')[0]}"
         logger.info(message)
 
-        entry_order = self.ccxt_exchange_objects[exchange].create_order(
+        entry_order = self.callEndpoint(
+            exchange, 'create_order',
             symbol=symbol,
             type='limit',
             side=side,
             amount=local_equivalent,
-            price=mid * agressivity,
+            price=self.getAgressivePrice(mid, side, aggressivity_bps),
             params=params)
 
-        return entry_order
\ No newline at end of file
+        return entry_order
+
+    def sendAgressiveOrders(self,
+                            exchange,
+                            orders,
+                            aggressivity_bps=500,
+                            max_workers=8,
+                            refresh_prices=True,
+                            params={}):
+        """
+        Send a batch of aggressive limit orders, all priced from one market snapshot and submitted concurrently through
+        the exchange rate limiter
+        :param orders: list of (symbol, side, base_amount) tuples
+        :param refresh_prices: price from a new ticker snapshot rather than the cached one
+        :return: DataFrame with one row per order: symbol, side, amount, mid, price, order (ccxt order dict or None),
+        error (exception or None) and latency (seconds spent in create_order, rate limiter wait included)
+        """
+        orders = [tuple(order) for order in orders]
+        if len(orders) == 0:
+            return pd.DataFrame(columns=BATCH_ORDER_COLUMNS)
+        mids = self.getMids(exchange, list(dict.fromkeys(order[0] for order in orders)), refresh=refresh_prices)
+
+        def submit(order):
+            symbol, side, amount = order
+            price = self.getAgressivePrice(mids[symbol], side, aggressivity_bps)
+            start = time.perf_counter()
+            try:
+                result, error = self.callEndpoint(exchange, 'create_order',
+                                                  symbol=symbol,
+                                                  type='limit',
+                                                  side=side,
+                                                  amount=amount,
+                                                  price=price,
+                                                  params=params), None
+            except Exception as e:
+                logger.warning(f"Agressive {side} of {amount} {symbol} on {exchange} failed : {type(e).__name__} {e}")
+                result, error = None, e
+            return symbol, side, amount, mids[symbol], price, result, error, time.perf_counter() - start
+
+        logger.info(f"Sending {len(orders)} agressive limit orders on {exchange}")
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(orders)),
+                                thread_name_prefix=f"orders_{exchange}") as executor:
+            results = list(executor.map(submit, orders))
+        return pd.DataFrame(results, columns=BATCH_ORDER_COLUMNS)
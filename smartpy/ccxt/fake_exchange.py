@@ -0,0 +1,335 @@
+import bisect
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+import ccxt
+import numpy as np
+
+import smartpy.utility.dt_util as dt_util
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_OHLCV_LIMIT = 1000
+DEFAULT_TRADES_LIMIT = 1000
+
+
+def makeMarket(symbol):
+    base, quote = symbol.split('/')
+    return {'id': symbol.replace('/', '_'),
+            'symbol': symbol,
+            'base': base,
+            'quote': quote,
+            'baseId': base,
+            'quoteId': quote,
+            'active': True,
+            'type': 'spot',
+            'spot': True,
+            'margin': False,
+            'swap': False,
+            'future': False,
+            'option': False,
+            'contract': False,
+            'precision': {'amount': 1e-8, 'price': 1e-8},
+            'limits': {'amount': {'min': None, 'max': None}, 'price': {'min': None, 'max': None},
+                       'cost': {'min': None, 'max': None}},
+            'info': {}}
+
+
+class ExchangeRecording:
+    """
+    Exchange responses replayed by FakeExchange: markets, OHLCV bars, tickers, public trades, account fills, orders
+    and balance, all in ccxt unified format. Recordings are saved as JSON.
+    """
+
+    def __init__(self,
+                 markets=None,
+                 ohlcv=None,
+                 tickers=None,
+                 trades=None,
+                 my_trades=None,
+                 orders=None,
+                 balance=None):
+        self.markets = markets if markets is not None else {}
+        self.ohlcv = ohlcv if ohlcv is not None else {}
+        self.tickers = tickers if tickers is not None else {}
+        self.trades = trades if trades is not None else {}
+        self.my_trades = my_trades if my_trades is not None else {}
+        self.orders = orders if orders is not None else []
+        self.balance = balance if balance is not None else {}
+
+    def toDict(self):
+        return {'markets': self.markets,
+                'ohlcv': self.ohlcv,
+                'tickers': self.tickers,
+                'trades': self.trades,
+                'my_trades': self.my_trades,
+                'orders': self.orders,
+                'balance': self.balance}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.toDict(), f, default=str)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def record(cls,
+               aggregator,
+               exchange,
+               symbols,
+               timeframe,
+               start_time,
+               end_time,
+               private=False):
+        """
+        Record the responses of a live exchange through a CCXTAggregator
+        :param private: also record fills, closed orders and balance, which requires API keys
+        """
+        exchange_object = aggregator.ccxt_exchange_objects[exchange]
+        start = exchange_object.parse8601(str(dt_util.toDatetime(start_time)))
+        end = exchange_object.parse8601(str(dt_util.toDatetime(end_time)))
+        tickers = aggregator.ticker_cache.refresh(exchange)
+        recording = cls(markets={symbol: aggregator.exchange_markets[exchange][symbol] for symbol in symbols},
+                        ohlcv={symbol: {timeframe: aggregator._fetchOHLCRange(exchange, symbol, timeframe, start, end)}
+                               for symbol in symbols},
+                        tickers={symbol: tickers[symbol] for symbol in symbols if symbol in tickers},
+                        trades={symbol: aggregator.callEndpoint(exchange, 'fetch_trades', symbol, start)
+                                for symbol in symbols})
+        if private:
+            recording.my_trades = {symbol: aggregator.callEndpoint(exchange, 'fetch_my_trades', symbol=symbol,
+                                                                   since=start)
+                                   for symbol in symbols}
+            recording.orders = [order for symbol in symbols
+                                for order in aggregator.callEndpoint(exchange, 'fetch_closed_orders', symbol=symbol,
+                                                                     since=start)]
+            recording.balance = aggregator.callEndpoint(exchange, 'fetch_balance')
+        # Raw exchange payloads are not needed for replay and make recordings much larger, the key is kept empty
+        # as callers drop or read it like on live responses
+        for rows in [list(recording.markets.values()), list(recording.tickers.values()), recording.orders,
+                     *recording.trades.values(), *recording.my_trades.values()]:
+            for row in rows:
+                row['info'] = {}
+        return recording
+
+    @classmethod
+    def makeSynthetic(cls,
+                      symbols,
+                      timeframe='1m',
+                      start_time='2024-01-01',
+                      n_bars=10000,
+                      n_trades=10000,
+                      seed=0):
+        """
+        Random walk recording, used for offline benchmarks and tests
+        """
+        rng = np.random.default_rng(seed)
+        start = ccxt.Exchange.parse8601(f"{dt_util.toDatetime(start_time).isoformat()}Z")
+        timeframe_ms = ccxt.Exchange.parse_timeframe(timeframe) * 1000
+        recording = cls(markets={symbol: makeMarket(symbol) for symbol in symbols})
+        for i, symbol in enumerate(symbols):
+            closes = 100 * np.exp(np.cumsum(rng.normal(0, 1e-3, n_bars)))
+            opens = np.append(closes[0], closes[:-1])
+            spread = np.abs(rng.normal(0, 5e-4, n_bars)) * closes
+            timestamps = start + np.arange(n_bars) * timeframe_ms
+            recording.ohlcv[symbol] = {timeframe: [[int(t), o, max(o, c) + s, min(o, c) - s, c, v] for t, o, c, s, v
+                                                   in zip(timestamps, opens, closes, spread,
+                                                          rng.uniform(1, 100, n_bars))]}
+            last = float(closes[-1])
+            recording.tickers[symbol] = {'symbol': symbol, 'timestamp': int(timestamps[-1]), 'last': last,
+                                         'bid': last * 0.9999, 'ask': last * 1.0001,
+                                         'bidVolume': 1.0, 'askVolume': 1.0}
+            trade_timestamps = np.sort(rng.integers(start, start + n_bars * timeframe_ms, n_trades))
+            trade_prices = np.interp(trade_timestamps, timestamps, closes)
+            trade_amounts = rng.uniform(0.01, 2, n_trades)
+            sides = np.where(rng.random(n_trades) < 0.5, 'buy', 'sell')
+            recording.trades[symbol] = [{'id': f"{i}-{j}", 'timestamp': int(t), 'symbol': symbol, 'side': str(s),
+                                         'price': float(p), 'amount': float(a), 'cost': float(p * a)}
+                                        for j, (t, s, p, a) in enumerate(zip(trade_timestamps, sides, trade_prices,
+                                                                             trade_amounts))]
+            recording.my_trades[symbol] = [{**trade, 'order': trade['id'], 'type': 'limit', 'takerOrMaker': 'taker',
+                                            'fee': {'cost': trade['cost'] * 1e-3, 'currency': symbol.split('/')[1]}}
+                                           for trade in recording.trades[symbol][::10]]
+        recording.balance = {'free': {}, 'used': {}, 'total': {}}
+        return recording
+
+
+class FakeExchange(ccxt.Exchange):
+    """
+    Local stand-in for a ccxt exchange class replaying an ExchangeRecording, e.g.
+        CCXTAggregator({'fake': {'recording': recording, 'latency': 0.05}}, exchange_classes={'fake': FakeExchange})
+    Config keys on top of the ccxt ones:
+        recording: ExchangeRecording or path of a saved one
+        latency: seconds added to every request, or (min, max) for a uniformly random latency
+        server_rate_limit: requests per second accepted before answering RateLimitExceeded, None for no limit
+        server_burst: number of requests that can be sent at once within server_rate_limit
+        ohlcv_limit, trades_limit: maximum rows returned per page
+    """
+
+    def describe(self):
+        return self.deep_extend(super().describe(), {
+            'id': 'fake',
+            'name': 'Fake',
+            'rateLimit': 50,
+            'has': {'fetchOHLCV': True, 'fetchTicker': True, 'fetchTickers': True, 'fetchTrades': True,
+                    'fetchMyTrades': True, 'fetchOrders': True, 'fetchClosedOrders': True, 'fetchOpenOrders': True,
+                    'createOrder': True, 'cancelOrder': True, 'fetchBalance': True},
+            'timeframes': {tf: tf for tf in ['1m', '5m', '15m', '30m', '1h', '4h', '1d']},
+            'recording': None,
+            'latency': 0,
+            'server_rate_limit': None,
+            'server_burst': 1,
+            'ohlcv_limit': DEFAULT_OHLCV_LIMIT,
+            'trades_limit': DEFAULT_TRADES_LIMIT,
+        })
+
+    def __init__(self, config={}):
+        super().__init__(config)
+        if isinstance(self.recording, str):
+            self.recording = ExchangeRecording.load(self.recording)
+        elif self.recording is None:
+            self.recording = ExchangeRecording()
+        self.request_counts = Counter()
+        self.created_orders = []
+        self._lock = threading.Lock()
+        self._server_tokens = self.server_burst
+        self._server_last_refill = time.monotonic()
+        self._timestamp_indexes = {}
+
+    def _request(self, endpoint):
+        """
+        Count the request, enforce the server side rate limit and wait the configured latency
+        """
+        with self._lock:
+            self.request_counts[endpoint] += 1
+            if self.server_rate_limit is not None:
+                now = time.monotonic()
+                self._server_tokens = min(self.server_burst, self._server_tokens +
+                                          (now - self._server_last_refill) * self.server_rate_limit)
+                self._server_last_refill = now
+                if self._server_tokens < 1:
+                    self.request_counts['rate_limited'] += 1
+                    raise ccxt.RateLimitExceeded(f"{self.id} {endpoint} rate limit exceeded")
+                self._server_tokens -= 1
+        latency = random.uniform(*self.latency) if isinstance(self.latency, (tuple, list)) else self.latency
+        if latency > 0:
+            time.sleep(latency)
+
+    def _getPage(self, key, rows, since, limit, default_limit):
+        """
+        Rows with timestamp >= since, at most limit of them, rows being sorted by timestamp
+        """
+        if key not in self._timestamp_indexes:
+            self._timestamp_indexes[key] = [i[0] if isinstance(i, list) else i['timestamp'] for i in rows]
+        timestamps = self._timestamp_indexes[key]
+        limit = min(limit, default_limit) if limit is not None else default_limit
+        if since is None:
+            return rows[-limit:]
+        first = bisect.bisect_left(timestamps, since)
+        return rows[first:first + limit]
+
+    def _checkSymbol(self, symbol):
+        if symbol not in self.recording.markets:
+            raise ccxt.BadSymbol(f"{self.id} does not have market symbol {symbol}")
+
+    def load_markets(self, reload=False, params={}):
+        if reload or not self.markets:
+            self._request('load_markets')
+            self.set_markets(list(self.recording.markets.values()))
+        return self.markets
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        self._request('fetch_ohlcv')
+        self._checkSymbol(symbol)
+        bars = self.recording.ohlcv.get(symbol, {}).get(timeframe, [])
+        return self._getPage(('ohlcv', symbol, timeframe), bars, since, limit, self.ohlcv_limit)
+
+    def fetch_ticker(self, symbol, params={}):
+        self._request('fetch_ticker')
+        self._checkSymbol(symbol)
+        return self.recording.tickers[symbol]
+
+    def fetch_tickers(self, symbols=None, params={}):
+        self._request('fetch_tickers')
+        if symbols is None:
+            return dict(self.recording.tickers)
+        return {symbol: self.recording.tickers[symbol] for symbol in symbols if symbol in self.recording.tickers}
+
+    def fetch_trades(self, symbol, since=None, limit=None, params={}):
+        self._request('fetch_trades')
+        self._checkSymbol(symbol)
+        return self._getPage(('trades', symbol), self.recording.trades.get(symbol, []), since, limit,
+                             self.trades_limit)
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        self._request('fetch_my_trades')
+        if symbol is None:
+            return [trade for trades in self.recording.my_trades.values() for trade in trades]
+        self._checkSymbol(symbol)
+        return self._getPage(('my_trades', symbol), self.recording.my_trades.get(symbol, []), since, limit,
+                             self.trades_limit)
+
+    def _filterOrders(self, symbol, since, limit, params, statuses):
+        orders = [i for i in self.recording.orders + self.created_orders
+                  if (symbol is None or i['symbol'] == symbol) and (since is None or i['timestamp'] >= since)
+                  and (statuses is None or i['status'] in statuses)]
+        limit = limit if limit is not None else self.trades_limit
+        # Exchanges paging closed orders by page number (e.g. gateio) pass it in params
+        page = params.get('page', 1)
+        return orders[(page - 1) * limit:page * limit]
+
+    def fetch_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._request('fetch_orders')
+        return self._filterOrders(symbol, since, limit, params, None)
+
+    def fetch_closed_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._request('fetch_closed_orders')
+        return self._filterOrders(symbol, since, limit, params, ('closed', 'canceled'))
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._request('fetch_open_orders')
+        return self._filterOrders(symbol, since, limit, params, ('open',))
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        """
+        Orders are filled in full at their limit price, or at the recorded last price for market orders
+        """
+        self._request('create_order')
+        self._checkSymbol(symbol)
+        fill_price = price if price is not None else self.recording.tickers[symbol]['last']
+        timestamp = self.milliseconds()
+        order = {'id': str(len(self.created_orders) + 1),
+                 'clientOrderId': params.get('clientOrderId'),
+                 'timestamp': timestamp,
+                 'datetime': self.iso8601(timestamp),
+                 'symbol': symbol,
+                 'type': type,
+                 'side': side,
+                 'price': fill_price,
+                 'average': fill_price,
+                 'amount': amount,
+                 'filled': amount,
+                 'remaining': 0.0,
+                 'cost': amount * fill_price,
+                 'status': 'closed',
+                 'fee': None,
+                 'fees': [],
+                 'trades': [],
+                 'info': {}}
+        with self._lock:
+            self.created_orders.append(order)
+        return order
+
+    def cancel_order(self, id, symbol=None, params={}):
+        self._request('cancel_order')
+        raise ccxt.OrderNotFound(f"{self.id} order {id} is already closed")
+
+    def fetch_balance(self, params={}):
+        self._request('fetch_balance')
+        return self.recording.balance
@@ -1,16 +1,26 @@
+import datetime as dt
+import time
+
+import numpy as np
+import pandas as pd
 import requests
 import hashlib
 import hmac
 import concurrent
+from itertools import chain
+from operator import itemgetter
 from concurrent.futures import ThreadPoolExecutor
-from ccxt.base.errors import ExchangeNotAvailable, RequestTimeout, NetworkError, ExchangeError
+from ccxt.base.errors import ExchangeNotAvailable, RequestTimeout, NetworkError, ExchangeError, RateLimitExceeded, \
+    DDoSProtection
 from urllib3.exceptions import ProtocolError
 from socket import timeout
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 from sqlalchemy.pool.impl import QueuePool
 
 
 import smartpy.utility.dt_util as dt_util
+from smartpy.ccxt.rate_limiter import getRateLimiter
 
 CCXT_EXCEPTIONS = [QueuePool,
                    HTTPError,
@@ -21,7 +31,9 @@ CCXT_EXCEPTIONS = [QueuePool,
                    NetworkError,
                    ExchangeNotAvailable,
                    RequestTimeout,
-                   ExchangeError]
+                   ExchangeError,
+                   RateLimitExceeded,
+                   DDoSProtection]
 
 
 TIMEFRAMES = ['10min', '30min']
@@ -30,11 +42,20 @@ host = "https://api.gateio.ws"
 prefix = "/api/v4"
 headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
 url = '/spot/orders'
+GATEIO = 'gateio'
+GATEIO_ORDER_COLUMNS = ['id', 'text', 'currency_pair']
+GATEIO_HISTORY_START = '2021-12-01'
+GATEIO_MAX_RATE_LIMIT_RETRIES = 5
+
+
+class GateIOAPIRequestError(Exception):
+    pass
 
 
-def gen_sign(method, url, query_string=None, payload_string=None):
-    key = MY_API_KEYS[GATEIO_CCXT]['apiKey']  # api_key
-    secret = MY_API_KEYS[GATEIO_CCXT]['secret']  # api_secret
+def gen_sign(method, url, query_string=None, payload_string=None, key=None, secret=None):
+    if key is None or secret is None:
+        key = MY_API_KEYS[GATEIO_CCXT]['apiKey']  # api_key
+        secret = MY_API_KEYS[GATEIO_CCXT]['secret']  # api_secret
 
     t = time.time()
     m = hashlib.sha512()
@@ -45,70 +66,186 @@ def gen_sign(method, url, query_string=None, payload_string=None):
     return {'KEY': key, 'Timestamp': str(t), 'SIGN': sign}
 
 
-def requestGateioTradesText(symbol):
-    symbol = symbol.replace('/', '_')
+class GateIOHistoryDownloader:
+    """
+    Finished Gate.io spot orders downloader.
+    Every (symbol, 7 day window) pair is fetched concurrently over one pooled keep-alive HTTP session, within the
+    process wide Gate.io rate limiter budget. Pages are collected as lists and turned into a frame once, or streamed
+    to a Parquet file as windows complete.
+    :param max_workers: maximum number of requests in flight
+    :param max_rate_limit_retries: 429 answers tolerated for one page before giving up
+    """
 
-    timestamp_intervals = dt_util.getPaginationIntervals(start='2021-12-01',
-                                                         end=dt.datetime.now(),
-                                                         freq='7d')
+    def __init__(self,
+                 start=GATEIO_HISTORY_START,
+                 end=None,
+                 window='7d',
+                 max_workers=16,
+                 page_limit=100,
+                 api_key=None,
+                 api_secret=None,
+                 max_rate_limit_retries=GATEIO_MAX_RATE_LIMIT_RETRIES):
+        self.start = start
+        self.end = end
+        self.window = window
+        self.max_workers = max_workers
+        self.page_limit = page_limit
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.rate_limiter = getRateLimiter(GATEIO)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
 
-    orders_df = pd.DataFrame()
+    def getIntervals(self):
+        end = self.end if self.end is not None else dt.datetime.now()
+        intervals = dt_util.getPaginationIntervals(start=self.start, end=end, freq=self.window)
+        # getPaginationIntervals drops the last partial window, which holds the most recent orders
+        end_timestamp = dt_util.toUnixTimestamp(end)
+        last_timestamp = intervals[-1][1] if len(intervals) > 0 else dt_util.toUnixTimestamp(self.start)
+        if last_timestamp < end_timestamp:
+            intervals.append((last_timestamp, end_timestamp))
+        return intervals
 
-    for interval in timestamp_intervals:
-        page = 1
-        # interval = timestamp_intervals[3]
-        while True:
-            query_param = f'currency_pair={symbol}&status=finished&page={page}&limit=100&title={str(interval[0])}&to={str(interval[1])}'
-            sign_headers = gen_sign('GET', prefix + url, query_param)
-            headers.update(sign_headers)
-            r = requests.request('GET', host + prefix + url + "?" + query_param, headers=headers)
-            if r.status_code == 200:
-                results = pd.DataFrame(r.json())
-                if len(results) > 0:
-                    orders_df = orders_df.append(results[['id', 'text', 'currency_pair']])
-                else:
-                    break
-                page += 1
+    def requestPage(self, symbol, interval, page):
+        query_param = f'currency_pair={symbol.replace("/", "_")}&status=finished&page={page}' \
+                      f'&limit={self.page_limit}&title={str(interval[0])}&to={str(interval[1])}'
+        for _ in range(self.max_rate_limit_retries + 1):
+            # Sign after queuing for the rate limiter so the signature timestamp is fresh
+            self.rate_limiter.acquire()
+            sign_headers = gen_sign('GET', prefix + url, query_param, key=self.api_key, secret=self.api_secret)
+            r = self.session.get(host + prefix + url + "?" + query_param, headers=sign_headers)
+            if r.status_code == 429:
+                self.rate_limiter.penalize()
+            elif r.status_code == 200:
+                return r.json()
             else:
                 raise GateIOAPIRequestError(f"Gate Function API spot orders request issue : {r.content}")
+        raise GateIOAPIRequestError(f"Gate Function API spot orders still rate limited after "
+                                    f"{self.max_rate_limit_retries} retries : {query_param}")
 
-        if len(orders_df) == 0 and page == 1:
-            break
-    return orders_df
+    def downloadWindow(self, symbol, interval):
+        rows = []
+        page = 1
+        while True:
+            results = self.requestPage(symbol, interval, page)
+            if len(results) == 0:
+                return rows
+            rows += [[i.get(column) for column in GATEIO_ORDER_COLUMNS] for i in results]
+            page += 1
+
+    def download(self, symbols, parquet_path=None):
+        """
+        :param symbols: list of BASE/QUOTE symbols
+        :param parquet_path: if given, each completed window is appended to this Parquet file as it arrives and
+        only the path is returned
+        :return: DataFrame with GATEIO_ORDER_COLUMNS, or parquet_path
+        """
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        writer = None
+        if parquet_path is not None:
+            # Only needed to stream to Parquet, so importing the helpers does not require pyarrow
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.schema([(column, pa.string()) for column in GATEIO_ORDER_COLUMNS])
+            writer = pq.ParquetWriter(parquet_path, schema)
+        windows = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='gateio_history') as executor:
+                futures = [executor.submit(self.downloadWindow, symbol, interval)
+                           for symbol in symbols for interval in self.getIntervals()]
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        rows = future.result()
+                    except Exception:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    if len(rows) == 0:
+                        continue
+                    if writer is not None:
+                        writer.write_table(pa.Table.from_arrays([pa.array(column, pa.string())
+                                                                 for column in zip(*rows)], schema=schema))
+                    else:
+                        windows.append(rows)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            return parquet_path
+        return pd.DataFrame([row for rows in windows for row in rows], columns=GATEIO_ORDER_COLUMNS)
+
+
+def requestGateioTradesText(symbol):
+    return GateIOHistoryDownloader().download([symbol])
 
 
 def getAllGateIOTradesThreading(symbols):
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = []
-        for symbol in symbols:
-            futures.append(executor.submit(requestGateioTradesText, symbol))
-
-    results = concurrent.futures.as_completed(futures)
-    results = [i.result() for i in results]
-    orders_df = pd.DataFrame()
-    for result in results:
-        orders_df = orders_df.append(result)
-    return orders_df
+    return GateIOHistoryDownloader().download(symbols)
 
 
 def processGateIOCCXTOrdersDF(trades_df):
     to_process = trades_df.copy()
-    to_process['datetime'] = to_process['datetime'].apply(lambda x: str(x).replace('Z', '').replace('T', ' '))
-    to_process['datetime'] = pd.to_datetime(to_process['datetime'])
-    to_process['fee_currency'] = to_process['fees'].apply(lambda x: getFeeAttribute(x, 'currency'))
-    to_process['fee_amount'] = to_process['fees'].apply(lambda x: getFeeAttribute(x, 'cost'))
+    if 'timestamp' in to_process.columns:
+        # ccxt datetime is the ISO8601 string of the millisecond timestamp, converting the integers is much cheaper
+        to_process['datetime'] = pd.to_datetime(to_process['timestamp'], unit='ms')
+    else:
+        to_process['datetime'] = pd.to_datetime(to_process['datetime'], utc=True, format='ISO8601').dt.tz_localize(None)
+    to_process['fee_currency'], to_process['fee_amount'] = getFirstNonGTFees(to_process['fees'].tolist())
     to_process['fee_USDT'] = np.where(to_process['fee_currency'] == 'USDT',
-                                      to_process['fee_amount'].astype(float),
-                                      to_process['fee_amount'].astype(float) * to_process['price'])
+                                      to_process['fee_amount'],
+                                      to_process['fee_amount'] * to_process['price'])
     to_process.drop(['info', 'fee', 'fees', 'trades'], axis=1, inplace=True)
-    to_process['coin'] = to_process['coin'].apply(lambda x: x.split('/')[0])
+    if 'coin' not in to_process.columns:
+        # Unified ccxt orders only have the market symbol
+        to_process['coin'] = to_process['symbol']
+    # Split each distinct symbol once instead of every row, missing symbols (code -1) stay None
+    symbol_codes, symbols = pd.factorize(to_process['coin'])
+    coins = np.array([i.split('/')[0] for i in symbols], dtype=object)[symbol_codes]
+    coins[symbol_codes == -1] = None
+    to_process['coin'] = coins
     return to_process
 
 
+def getFirstNonGTFees(fee_lists):
+    """
+    Currency and cost of the first non GT fee of every order, from a single pass over the flattened fee lists
+    :param fee_lists: list of ccxt 'fees' lists, one per order
+    :return: tuple of numpy arrays (currencies, costs), None and nan for orders without such fee
+    """
+    fee_lists = [i if isinstance(i, list) else [] for i in fee_lists]
+    n_orders = len(fee_lists)
+    n_fees = np.fromiter(map(len, fee_lists), dtype=np.int64, count=n_orders)
+    fees = list(chain.from_iterable(fee_lists))
+    if len(fees) == 0:
+        return np.full(n_orders, None, dtype=object), np.full(n_orders, np.nan)
+    currencies = np.array(list(map(itemgetter('currency'), fees)), dtype=object)
+    costs = np.array(list(map(itemgetter('cost'), fees)), dtype=float)
+
+    non_gt_positions = np.flatnonzero(currencies != 'GT')
+    non_gt_orders = np.repeat(np.arange(n_orders), n_fees)[non_gt_positions]
+    # non_gt_orders is sorted, so the first occurrence of each order is its first non GT fee
+    orders_with_fee, first_occurrences = np.unique(non_gt_orders, return_index=True)
+    first_positions = np.full(n_orders, -1)
+    first_positions[orders_with_fee] = non_gt_positions[first_occurrences]
+    has_fee = first_positions >= 0
+    return np.where(has_fee, currencies[first_positions], None), np.where(has_fee, costs[first_positions], np.nan)
+
+
+def getFirstNonGTFee(fee_list):
+    if isinstance(fee_list, list):
+        for fee_dict in fee_list:
+            if fee_dict['currency'] != 'GT':
+                return fee_dict
+    return None
+
+
 def getFeeAttribute(fee_list, attribute):
-    for fee_dict in fee_list:
-        if fee_dict['currency'] != 'GT':
-            return fee_dict[attribute]
+    fee_dict = getFirstNonGTFee(fee_list)
+    if fee_dict is not None:
+        return fee_dict[attribute]
 
 
 def downloadFTXTrades(coin, hours_lookback=24):
@@ -116,18 +253,19 @@ def downloadFTXTrades(coin, hours_lookback=24):
     since = ftx_exchange.milliseconds() - one_hour*hours_lookback
     # alternatively, fetch from a certain starting datetime
     # since = ftx_exchange.parse8601('2018-01-01T00:00:00Z')
-    all_orders = []
+    pages = []
     while since < ftx_exchange.milliseconds():
         symbol = f'{coin}-PERP'  # change for your coin
         limit = 200000  # change for your limit
         orders = ftx_exchange.fetchTrades(symbol, since, limit)
         if len(orders):
             since = orders[len(orders) - 1]['timestamp'] + 1
-            all_orders += orders
+            # Keep only the raw columns of each page rather than every ccxt trade dict
+            pages.append(pd.DataFrame([i['info'] for i in orders]))
         else:
             break
 
-    orders_df = pd.DataFrame([i['info'] for i in all_orders])
+    orders_df = pd.concat(pages, ignore_index=True) if len(pages) > 0 else pd.DataFrame()
     if len(orders_df) > 0:
         orders_df[['size', 'price']] = orders_df[['size', 'price']].astype(float)
         orders_df['amount_usd'] = orders_df['size'] * orders_df['price']
@@ -135,7 +273,7 @@ def downloadFTXTrades(coin, hours_lookback=24):
                                               -orders_df['size'])
         orders_df['signed_amount_usd'] = np.where(orders_df['side'] == 'buy', orders_df['amount_usd'],
                                                   -orders_df['amount_usd'])
-        orders_df['timestamp'] = orders_df['time'].apply(lambda x: dt_util.toDatetime(x.replace('T', ' ')))
+        orders_df['timestamp'] = pd.to_datetime(orders_df['time'], format='ISO8601')
         orders_df['coin'] = coin
     return orders_df
 
@@ -0,0 +1,259 @@
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import partial
+
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+TICKER = 'ticker'
+TRADE = 'trade'
+BOOK = 'book'
+DEFAULT_CHANNELS = (TICKER, TRADE, BOOK)
+# Seconds after which live values are considered stale and lookups fall back to REST
+DEFAULT_MAX_AGE = 30
+DEFAULT_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+class MarketDataTransport(ABC):
+    """
+    Push feed driving a LiveMarketData. run is called on a dedicated thread and must call on_message with normalized
+    messages until stop_event is set:
+        {'type': 'ticker', 'symbol', 'bid', 'bid_size', 'ask', 'ask_size', 'last', 'timestamp'}
+        {'type': 'trade', 'symbol', 'price', 'amount', 'side', 'timestamp'}
+        {'type': 'book', 'symbol', 'bids': [[price, size], ...], 'asks': [[price, size], ...], 'timestamp'}
+    """
+
+    @abstractmethod
+    def run(self, on_message, symbols, channels, stop_event):
+        pass
+
+
+class ReplayTransport(MarketDataTransport):
+    """
+    Replays recorded messages, used to drive LiveMarketData in tests and offline
+    :param messages: list of normalized messages
+    :param delay: seconds to wait between messages
+    :param loop: restart from the first message once all were sent
+    """
+
+    def __init__(self, messages, delay=0.0, loop=False):
+        self.messages = messages
+        self.delay = delay
+        self.loop = loop
+
+    def run(self, on_message, symbols, channels, stop_event):
+        symbols = set(symbols)
+        while not stop_event.is_set():
+            for message in self.messages:
+                if stop_event.is_set():
+                    return
+                if message['symbol'] in symbols and message['type'] in channels:
+                    on_message(message)
+                if self.delay > 0:
+                    time.sleep(self.delay)
+            if not self.loop:
+                return
+
+
+class CCXTProTransport(MarketDataTransport):
+    """
+    Websocket feed through ccxt.pro watch_ticker / watch_trades / watch_order_book, run on its own event loop.
+    A failing watcher logs the error and calls its watch method again after a backoff, ccxt.pro reconnecting the
+    websocket on that call.
+    """
+
+    def __init__(self, exchange, config=None, book_depth=None, reconnect_delay=DEFAULT_RECONNECT_DELAY):
+        self.exchange = exchange
+        self.config = config if config is not None else {}
+        self.book_depth = book_depth
+        self.reconnect_delay = reconnect_delay
+
+    def run(self, on_message, symbols, channels, stop_event):
+        asyncio.run(self._run(on_message, symbols, channels, stop_event))
+
+    async def _run(self, on_message, symbols, channels, stop_event):
+        import ccxt.pro as ccxtpro
+
+        exchange_object = getattr(ccxtpro, self.exchange)(self.config)
+        watchers = {TICKER: self._watchTicker, TRADE: self._watchTrades, BOOK: self._watchOrderBook}
+        tasks = [asyncio.create_task(self._watch(f"{channel} {symbol}",
+                                                 partial(watchers[channel], exchange_object, symbol, on_message),
+                                                 stop_event))
+                 for symbol in symbols for channel in channels]
+        try:
+            while not stop_event.is_set():
+                await asyncio.sleep(0.1)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await exchange_object.close()
+
+    async def _watch(self, name, watch_once, stop_event):
+        """
+        Await watch_once until stop_event is set, retrying with an exponential backoff after errors
+        """
+        delay = self.reconnect_delay
+        while not stop_event.is_set():
+            try:
+                await watch_once()
+                delay = self.reconnect_delay
+            except Exception as e:
+                logger.error(f"{self.exchange} {name} watcher failed, reconnecting in {delay}s : "
+                             f"{type(e).__name__} {e}")
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, MAX_RECONNECT_DELAY)
+
+    async def _watchTicker(self, exchange_object, symbol, on_message):
+        ticker = await exchange_object.watch_ticker(symbol)
+        on_message({'type': TICKER,
+                    'symbol': symbol,
+                    'bid': ticker.get('bid'),
+                    'bid_size': ticker.get('bidVolume'),
+                    'ask': ticker.get('ask'),
+                    'ask_size': ticker.get('askVolume'),
+                    'last': ticker.get('last'),
+                    'timestamp': ticker.get('timestamp')})
+
+    async def _watchTrades(self, exchange_object, symbol, on_message):
+        for trade in await exchange_object.watch_trades(symbol):
+            on_message({'type': TRADE,
+                        'symbol': symbol,
+                        'price': trade['price'],
+                        'amount': trade['amount'],
+                        'side': trade.get('side'),
+                        'timestamp': trade.get('timestamp')})
+
+    async def _watchOrderBook(self, exchange_object, symbol, on_message):
+        order_book = await exchange_object.watch_order_book(symbol, self.book_depth)
+        # ccxt.pro mutates its book in place on the next update, so hand over copies of the ladders
+        on_message({'type': BOOK,
+                    'symbol': symbol,
+                    'bids': list(order_book['bids'][:self.book_depth]),
+                    'asks': list(order_book['asks'][:self.book_depth]),
+                    'timestamp': order_book.get('timestamp')})
+
+
+class LiveMarketData:
+    """
+    In-memory top of book, last trade and L2 state of the subscribed symbols of one exchange, updated from a push feed.
+    Every update replaces whole per-symbol objects, so lookups are plain dict reads without locks.
+    Lookups raise KeyError when no value was received for the symbol or when it is older than max_age seconds.
+    :param max_age: seconds after which a value is stale, None to never expire them
+    """
+
+    def __init__(self,
+                 exchange,
+                 symbols,
+                 transport,
+                 channels=DEFAULT_CHANNELS,
+                 max_age=DEFAULT_MAX_AGE):
+        self.exchange = exchange
+        self.symbols = list(symbols)
+        self.transport = transport
+        self.channels = tuple(channels)
+        self.max_age = max_age
+
+        self.top_of_book = {}
+        self.last_trades = {}
+        self.order_books = {}
+        self.last_update_time = {}
+        self.top_of_book_update_time = {}
+        self.last_trade_update_time = {}
+        self.order_book_update_time = {}
+        self.n_messages = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name=f"live_market_data_{self.exchange}",
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self.transport.run(self.onMessage, self.symbols, self.channels, self._stop_event)
+        except Exception as e:
+            logger.error(f"{self.exchange} live market data feed stopped : {type(e).__name__} {e}")
+
+    def onMessage(self, message):
+        symbol = message['symbol']
+        message_type = message['type']
+        now = time.time()
+        if message_type == TICKER:
+            # Some exchanges send tickers without bid/ask, they only update the last price
+            if message.get('bid') is not None and message.get('ask') is not None:
+                self.top_of_book[symbol] = (message['bid'], message.get('bid_size'),
+                                            message['ask'], message.get('ask_size'))
+                self.top_of_book_update_time[symbol] = now
+            if message.get('last') is not None:
+                self.last_trades[symbol] = (message['last'], None, None, message.get('timestamp'))
+                self.last_trade_update_time[symbol] = now
+        elif message_type == TRADE:
+            self.last_trades[symbol] = (message['price'], message['amount'], message.get('side'),
+                                        message.get('timestamp'))
+            self.last_trade_update_time[symbol] = now
+        elif message_type == BOOK:
+            bids, asks = message['bids'], message['asks']
+            self.order_books[symbol] = (bids, asks, message.get('timestamp'))
+            self.order_book_update_time[symbol] = now
+            if len(bids) > 0 and len(asks) > 0:
+                self.top_of_book[symbol] = (bids[0][0], bids[0][1], asks[0][0], asks[0][1])
+                self.top_of_book_update_time[symbol] = now
+        self.last_update_time[symbol] = now
+        self.n_messages += 1
+
+    def _getFresh(self, values, update_times, symbol):
+        value = values[symbol]
+        if self.max_age is not None and time.time() - update_times[symbol] > self.max_age:
+            raise KeyError(f"{self.exchange} {symbol} live value older than {self.max_age}s")
+        return value
+
+    def get_last(self, symbol):
+        """
+        Last trade price, raises KeyError if no fresh trade or ticker was received for the symbol
+        """
+        return self._getFresh(self.last_trades, self.last_trade_update_time, symbol)[0]
+
+    def getLastTrade(self, symbol):
+        price, amount, side, timestamp = self._getFresh(self.last_trades, self.last_trade_update_time, symbol)
+        return {'price': price, 'amount': amount, 'side': side, 'timestamp': timestamp}
+
+    def getTopOfBook(self, symbol):
+        bid, bid_size, ask, ask_size = self._getFresh(self.top_of_book, self.top_of_book_update_time, symbol)
+        return {'bid': bid, 'bid_size': bid_size, 'ask': ask, 'ask_size': ask_size}
+
+    def getMid(self, symbol):
+        """
+        Top of book mid, raises KeyError if no fresh bid and ask were received for the symbol
+        """
+        bid, _, ask, _ = self._getFresh(self.top_of_book, self.top_of_book_update_time, symbol)
+        return 0.5 * (bid + ask)
+
+    def getOrderBook(self, symbol):
+        bids, asks, timestamp = self._getFresh(self.order_books, self.order_book_update_time, symbol)
+        return {'bids': bids, 'asks': asks, 'timestamp': timestamp}
+
+    def getAge(self, symbol):
+        """
+        Seconds since the last update of the symbol
+        """
+        return time.time() - self.last_update_time[symbol]
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+import smartpy.utility.os_util as os_util
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_MARKETS_TTL = 24 * 3600
+# Config keys that do not change the markets an exchange returns, left out of the cache key
+CREDENTIAL_KEYS = {'apiKey', 'secret', 'password', 'uid', 'login', 'privateKey', 'walletAddress', 'token', 'twofa'}
+
+
+def getMarketsCacheKey(exchange, exchange_class, config):
+    """
+    Cache file stem of an exchange: its name, class and a hash of the class path and non credential config, so
+    aggregators with another class, sandbox mode or options do not share markets files
+    """
+    config = {key: value for key, value in config.items() if key not in CREDENTIAL_KEYS}
+    # Objects without a JSON form (e.g. a FakeExchange recording) are keyed by their repr, i.e. per instance
+    description = json.dumps([exchange_class.__module__, exchange_class.__qualname__, config], sort_keys=True,
+                             default=repr)
+    return f"{exchange}-{exchange_class.__name__}-{hashlib.sha1(description.encode('utf-8')).hexdigest()[:12]}"
+
+
+class ExchangeMarkets(Mapping):
+    """
+    exchange -> ccxt markets mapping that loads each exchange on first access.
+    Loaded markets are persisted to cache_dir and reused by later processes until they are older than ttl seconds.
+    :param exchange_objects: dict of ccxt exchange objects, markets are set on them when read from disk
+    :param load_markets: function taking an exchange name and loading its markets from the network
+    :param cache_dir: directory of the markets files, None to disable the disk cache
+    :param cache_keys: dict exchange -> markets file stem (see getMarketsCacheKey), the exchange name if missing
+    """
+
+    def __init__(self,
+                 exchange_objects,
+                 load_markets,
+                 cache_dir=None,
+                 ttl=DEFAULT_MARKETS_TTL,
+                 cache_keys=None):
+        self.exchange_objects = exchange_objects
+        self.load_markets = load_markets
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.cache_keys = cache_keys if cache_keys is not None else {}
+        self.markets = {}
+        self._locks = {exchange: threading.Lock() for exchange in exchange_objects}
+
+    def __getitem__(self, exchange):
+        if exchange not in self.markets:
+            if exchange not in self.exchange_objects:
+                raise KeyError(exchange)
+            with self._locks[exchange]:
+                if exchange not in self.markets:
+                    self.markets[exchange] = self._load(exchange)
+        return self.markets[exchange]
+
+    def __contains__(self, exchange):
+        return exchange in self.exchange_objects
+
+    def __iter__(self):
+        return iter(self.exchange_objects)
+
+    def __len__(self):
+        return len(self.exchange_objects)
+
+    def isLoaded(self, exchange):
+        return exchange in self.markets
+
+    def preload(self, exchanges=None, max_workers=8):
+        """
+        Load the markets of several exchanges concurrently
+        """
+        exchanges = list(exchanges) if exchanges is not None else list(self.exchange_objects)
+        if len(exchanges) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(exchanges)),
+                                thread_name_prefix='load_markets') as executor:
+            list(executor.map(self.__getitem__, exchanges))
+
+    def getCachePath(self, exchange):
+        return os.path.join(self.cache_dir, f"{self.cache_keys.get(exchange, exchange)}.json")
+
+    def _load(self, exchange):
+        exchange_object = self.exchange_objects[exchange]
+        if self.cache_dir is not None:
+            cache_path = self.getCachePath(exchange)
+            if os_util.fileExists(cache_path) and time.time() - os.path.getmtime(cache_path) < self.ttl:
+                try:
+                    with open(cache_path) as f:
+                        cached = json.load(f)
+                    exchange_object.set_markets(cached['markets'], cached['currencies'])
+                    return exchange_object.markets
+                except Exception as e:
+                    logger.warning(f"Could not read cached {exchange} markets, reloading : {type(e).__name__} {e}")
+
+        markets = self.load_markets(exchange)
+        if self.cache_dir is not None:
+            self._save(exchange, exchange_object)
+        return markets
+
+    def _save(self, exchange, exchange_object):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self.getCachePath(exchange)
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'markets': exchange_object.markets,
+                       'currencies': exchange_object.currencies}, f, default=str)
+        os.replace(tmp_path, cache_path)
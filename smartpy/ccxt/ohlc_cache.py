@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import smartpy.utility.os_util as os_util
+
+CACHE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+COVERAGE_FILE_NAME = 'coverage.json'
+MONTH_FORMAT = '%Y-%m'
+
+
+class OHLCCache:
+    """
+    Local on-disk cache of exchange OHLC bars.
+    Bars are stored as monthly Parquet files partitioned by exchange/symbol/timeframe, next to a coverage file listing
+    the [start, end) millisecond ranges already downloaded, so only the missing ranges are requested from the exchange.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir if cache_dir is not None else os_util.getTempDir('ccxt_ohlc_cache')
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def getLock(self, exchange, symbol, timeframe):
+        key = (exchange, symbol, timeframe)
+        with self._locks_lock:
+            if key not in self._locks:
+                self._locks[key] = threading.RLock()
+            return self._locks[key]
+
+    def getPartitionPath(self, exchange, symbol, timeframe):
+        symbol_key = symbol.replace('/', '_').replace(':', '_')
+        return os.path.join(self.cache_dir,
+                            f"exchange={exchange}",
+                            f"symbol={symbol_key}",
+                            f"timeframe={timeframe}")
+
+    def getCoverage(self, exchange, symbol, timeframe):
+        coverage_path = os.path.join(self.getPartitionPath(exchange, symbol, timeframe), COVERAGE_FILE_NAME)
+        if not os_util.fileExists(coverage_path):
+            return []
+        with open(coverage_path) as f:
+            return [tuple(i) for i in json.load(f)]
+
+    def getMissingRanges(self, exchange, symbol, timeframe, start, end):
+        """
+        Ranges of [start, end) not yet covered by the cache
+        :param start: range start in milliseconds
+        :param end: range end in milliseconds
+        :return: list of (start, end) millisecond tuples
+        """
+        missing = []
+        cursor = start
+        for covered_start, covered_end in self.getCoverage(exchange, symbol, timeframe):
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > cursor:
+                missing.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+        if cursor < end:
+            missing.append((cursor, end))
+        return missing
+
+    def read(self, exchange, symbol, timeframe, start, end):
+        """
+        Cached bars with start <= timestamp <= end, timestamps in milliseconds
+        """
+        partition_path = self.getPartitionPath(exchange, symbol, timeframe)
+        months = pd.period_range(pd.to_datetime(start, unit='ms'), pd.to_datetime(end, unit='ms'), freq='M')
+        tables = []
+        for month in months:
+            file_path = os.path.join(partition_path, f"{month.strftime(MONTH_FORMAT)}.parquet")
+            if os_util.fileExists(file_path):
+                tables.append(pq.read_table(file_path))
+        if len(tables) == 0:
+            return pd.DataFrame(columns=CACHE_COLUMNS)
+        df = pa.concat_tables(tables).to_pandas()
+        df = df[(df['timestamp'] >= start) & (df['timestamp'] <= end)]
+        return df.sort_values('timestamp').reset_index(drop=True)
+
+    def write(self, exchange, symbol, timeframe, bars, covered_start, covered_end):
+        """
+        Merge new bars into the cache and mark [covered_start, covered_end) as downloaded
+        :param bars: list of ccxt ohlcv rows or DataFrame with CACHE_COLUMNS, timestamps in milliseconds
+        """
+        partition_path = self.getPartitionPath(exchange, symbol, timeframe)
+        os.makedirs(partition_path, exist_ok=True)
+        new_bars = pd.DataFrame(bars, columns=CACHE_COLUMNS)
+        with self.getLock(exchange, symbol, timeframe):
+            if len(new_bars) > 0:
+                new_bars['timestamp'] = new_bars['timestamp'].astype('int64')
+                new_bars[CACHE_COLUMNS[1:]] = new_bars[CACHE_COLUMNS[1:]].astype('float64')
+                months = pd.to_datetime(new_bars['timestamp'], unit='ms').dt.strftime(MONTH_FORMAT)
+                for month, month_bars in new_bars.groupby(months):
+                    file_path = os.path.join(partition_path, f"{month}.parquet")
+                    if os_util.fileExists(file_path):
+                        month_bars = pd.concat([pq.read_table(file_path).to_pandas(), month_bars])
+                    month_bars = month_bars.drop_duplicates(subset='timestamp', keep='last') \
+                        .sort_values('timestamp') \
+                        .reset_index(drop=True)
+                    self._atomicWrite(pa.Table.from_pandas(month_bars, preserve_index=False), file_path)
+            if covered_end > covered_start:
+                self._addCoverage(exchange, symbol, timeframe, covered_start, covered_end)
+
+    def _addCoverage(self, exchange, symbol, timeframe, start, end):
+        intervals = sorted(self.getCoverage(exchange, symbol, timeframe) + [(start, end)])
+        merged = [list(intervals[0])]
+        for interval_start, interval_end in intervals[1:]:
+            if interval_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], interval_end)
+            else:
+                merged.append([interval_start, interval_end])
+        coverage_path = os.path.join(self.getPartitionPath(exchange, symbol, timeframe), COVERAGE_FILE_NAME)
+        tmp_path = coverage_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, coverage_path)
+
+    @staticmethod
+    def _atomicWrite(table, file_path):
+        tmp_path = file_path + '.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, file_path)
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+from ccxt import Exchange
+
+OHLC_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+# Exchange weekly bars start on Monday 00:00 UTC, epoch based buckets would start on Thursday
+WEEK_OFFSET_MS = 4 * 24 * 3600 * 1000
+
+
+def getTimeframeMs(timeframe):
+    if timeframe.endswith('M') or timeframe.endswith('y'):
+        raise ValueError(f"Calendar timeframe {timeframe} can not be resampled with fixed size buckets")
+    return int(Exchange.parse_timeframe(timeframe) * 1000)
+
+
+def getTimeframeOffsetMs(timeframe):
+    return WEEK_OFFSET_MS if timeframe.endswith('w') else 0
+
+
+def _toMilliseconds(timestamps):
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return timestamps.astype('datetime64[ms]').astype(np.int64)
+    return timestamps.astype(np.int64)
+
+
+def resampleOHLCArrays(timestamps, opens, highs, lows, closes, volumes, timeframe):
+    """
+    Aggregate sorted bars into timeframe buckets in one vectorized pass
+    :param timestamps: bar open times in milliseconds, sorted
+    :return: dict of numpy arrays keyed by OHLC_COLUMNS, timestamps in milliseconds
+    """
+    if len(timestamps) == 0:
+        return {column: np.array([]) for column in OHLC_COLUMNS}
+    timeframe_ms = getTimeframeMs(timeframe)
+    offset = getTimeframeOffsetMs(timeframe)
+    buckets = (timestamps - offset) // timeframe_ms * timeframe_ms + offset
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.append(starts[1:], len(buckets)) - 1
+    return {'timestamp': buckets[starts],
+            'open': opens[starts],
+            'high': np.maximum.reduceat(highs, starts),
+            'low': np.minimum.reduceat(lows, starts),
+            'close': closes[ends],
+            'volume': np.add.reduceat(volumes, starts)}
+
+
+def resampleOHLC(df, timeframe):
+    """
+    Resample a get_ohlc frame (any base timeframe) to a higher timeframe, e.g. 1m bars to 5m, 1h, 1d or 90m bars
+    :param df: frame with OHLC_COLUMNS sorted by timestamp, extra columns like 'coin' keep their first value
+    """
+    arrays = resampleOHLCArrays(_toMilliseconds(df['timestamp'].values),
+                                *[df[column].values.astype(float) for column in OHLC_COLUMNS[1:]],
+                                timeframe=timeframe)
+    resampled = pd.DataFrame(arrays, columns=OHLC_COLUMNS)
+    resampled['timestamp'] = pd.to_datetime(resampled['timestamp'].astype(np.int64), unit='ms')
+    for column in df.columns:
+        if column not in OHLC_COLUMNS:
+            resampled[column] = df[column].iloc[0] if len(df) > 0 else None
+    return resampled
+
+
+class OHLCResampler:
+    """
+    Keeps several higher timeframes up to date from a stream of base bars.
+    Each update only aggregates the new base bars and merges the first resulting bar into the last, possibly
+    incomplete, bar of every timeframe.
+    """
+
+    def __init__(self, timeframes):
+        self.timeframes = list(timeframes)
+        self.last_base_timestamp = None
+        self._chunks = {timeframe: [] for timeframe in self.timeframes}
+        self._bars = {timeframe: None for timeframe in self.timeframes}
+
+    def update(self, base_df):
+        """
+        :param base_df: new base bars, sorted, bars not newer than the previous update are ignored
+        :return: dict timeframe -> frame of the bars created or modified by this update
+        """
+        timestamps = _toMilliseconds(base_df['timestamp'].values)
+        is_new = np.ones(len(timestamps), dtype=bool) if self.last_base_timestamp is None \
+            else timestamps > self.last_base_timestamp
+        timestamps = timestamps[is_new]
+        columns = [base_df[column].values.astype(float)[is_new] for column in OHLC_COLUMNS[1:]]
+        if len(timestamps) == 0:
+            return {timeframe: pd.DataFrame(columns=OHLC_COLUMNS) for timeframe in self.timeframes}
+        self.last_base_timestamp = timestamps[-1]
+
+        updated = {}
+        for timeframe in self.timeframes:
+            new_bars = resampleOHLCArrays(timestamps, *columns, timeframe=timeframe)
+            chunks = self._chunks[timeframe]
+            if len(chunks) > 0 and chunks[-1]['timestamp'][-1] == new_bars['timestamp'][0]:
+                last_chunk = {column: values.copy() for column, values in chunks[-1].items()}
+                last_chunk['high'][-1] = max(last_chunk['high'][-1], new_bars['high'][0])
+                last_chunk['low'][-1] = min(last_chunk['low'][-1], new_bars['low'][0])
+                last_chunk['close'][-1] = new_bars['close'][0]
+                last_chunk['volume'][-1] += new_bars['volume'][0]
+                chunks[-1] = last_chunk
+                merged_bar = {column: values[-1:] for column, values in last_chunk.items()}
+                new_bars = {column: values[1:] for column, values in new_bars.items()}
+                updated_bars = {column: np.concatenate([merged_bar[column], new_bars[column]])
+                                for column in OHLC_COLUMNS}
+            else:
+                updated_bars = new_bars
+            if len(new_bars['timestamp']) > 0:
+                chunks.append(new_bars)
+            self._bars[timeframe] = None
+            updated[timeframe] = self._toDataFrame(updated_bars)
+        return updated
+
+    def getBars(self, timeframe):
+        """
+        All bars of a timeframe, the last one being incomplete until its bucket is over
+        """
+        if self._bars[timeframe] is None:
+            chunks = self._chunks[timeframe]
+            if len(chunks) == 0:
+                return pd.DataFrame(columns=OHLC_COLUMNS)
+            # Collapse the chunks so later reads and merges stay cheap
+            self._chunks[timeframe] = [{column: np.concatenate([chunk[column] for chunk in chunks])
+                                        for column in OHLC_COLUMNS}]
+            self._bars[timeframe] = self._toDataFrame(self._chunks[timeframe][0])
+        return self._bars[timeframe]
+
+    @staticmethod
+    def _toDataFrame(arrays):
+        df = pd.DataFrame(arrays, columns=OHLC_COLUMNS)
+        df['timestamp'] = pd.to_datetime(df['timestamp'].astype(np.int64), unit='ms')
+        return df
@@ -0,0 +1,128 @@
+from collections import deque
+
+import numpy as np
+
+# Currencies tried first when several conversion paths have the same number of hops
+PREFERRED_HUBS = ['USDT', 'USD', 'BTC', 'ETH', 'USDC', 'BUSD', 'EUR']
+
+
+class CurrencyGraph:
+    """
+    Conversion graph over the markets of one exchange. Each spot market BASE/QUOTE is an edge BASE -> QUOTE
+    (multiply by the market price) and QUOTE -> BASE (divide by it). Paths have the fewest hops, ties going through
+    the preferred hubs, and are cached once resolved.
+    """
+
+    def __init__(self, markets, hubs=PREFERRED_HUBS):
+        self.hubs = list(hubs)
+        self.edges = {}
+        self.paths = {}
+        self._compiled = {}
+
+        for symbol, market in markets.items():
+            if market.get('active') is False or market.get('spot') is False:
+                continue
+            base, quote = market.get('base'), market.get('quote')
+            if base is None or quote is None:
+                continue
+            self.edges.setdefault(base, {})
+            self.edges.setdefault(quote, {})
+            # Keep the first market found for a currency pair
+            self.edges[base].setdefault(quote, (symbol, False))
+            self.edges[quote].setdefault(base, (symbol, True))
+
+        hub_rank = {hub: i for i, hub in enumerate(self.hubs)}
+        self._neighbours = {currency: sorted(neighbours, key=lambda x: (hub_rank.get(x, len(hub_rank)), x))
+                            for currency, neighbours in self.edges.items()}
+
+    def getPath(self, base, quote):
+        """
+        Conversion path from base to quote
+        :return: list of (market symbol, inverted) tuples, empty when base == quote
+        """
+        key = (base, quote)
+        if key not in self.paths:
+            self.paths[key] = self._findPath(base, quote)
+        if self.paths[key] is None:
+            raise KeyError(f"No conversion path from {base} to {quote}")
+        return self.paths[key]
+
+    def _findPath(self, base, quote):
+        if base == quote:
+            return []
+        if base not in self.edges or quote not in self.edges:
+            return None
+        previous = {base: None}
+        queue = deque([base])
+        while queue:
+            currency = queue.popleft()
+            for neighbour in self._neighbours[currency]:
+                if neighbour in previous:
+                    continue
+                previous[neighbour] = currency
+                if neighbour == quote:
+                    path = []
+                    while previous[neighbour] is not None:
+                        path.append(self.edges[previous[neighbour]][neighbour])
+                        neighbour = previous[neighbour]
+                    return path[::-1]
+                queue.append(neighbour)
+        return None
+
+    def _compile(self, symbols):
+        """
+        Flatten the paths of a list of BASE/QUOTE symbols into market index, inversion flag and segment arrays.
+        Symbols without a conversion path get an empty segment and are flagged as not routable.
+        """
+        key = tuple(symbols)
+        if key not in self._compiled:
+            markets = []
+            market_positions = {}
+            edge_markets = []
+            edge_inverted = []
+            path_lengths = []
+            routable = []
+            for symbol in symbols:
+                base, quote = symbol.split('/')[:2]
+                try:
+                    path = self.getPath(base, quote.split(':')[0])
+                    routable.append(True)
+                except KeyError:
+                    path = []
+                    routable.append(False)
+                for market, inverted in path:
+                    if market not in market_positions:
+                        market_positions[market] = len(markets)
+                        markets.append(market)
+                    edge_markets.append(market_positions[market])
+                    edge_inverted.append(inverted)
+                path_lengths.append(len(path))
+            path_lengths = np.array(path_lengths, dtype=np.int64)
+            self._compiled[key] = (markets,
+                                   np.array(edge_markets, dtype=np.int64),
+                                   np.array(edge_inverted, dtype=bool),
+                                   path_lengths,
+                                   np.array(routable, dtype=bool))
+        return self._compiled[key]
+
+    def computeRates(self, symbols, tickers):
+        """
+        Price of every BASE/QUOTE symbol from one ticker snapshot, multiplying the rates along each path at once
+        :param symbols: list of BASE/QUOTE symbols
+        :param tickers: ccxt fetch_tickers dict
+        :return: numpy array of rates, nan when a market along the path has no last price or there is no path
+        """
+        markets, edge_markets, edge_inverted, path_lengths, routable = self._compile(symbols)
+        market_prices = np.array([tickers[m]['last'] if m in tickers and tickers[m]['last'] is not None
+                                  else np.nan for m in markets], dtype=float)
+        edge_prices = market_prices[edge_markets]
+        with np.errstate(divide='ignore'):
+            edge_factors = np.where(edge_inverted, 1 / edge_prices, edge_prices)
+
+        rates = np.ones(len(path_lengths))
+        has_path = path_lengths > 0
+        if has_path.any():
+            starts = (np.cumsum(path_lengths) - path_lengths)[has_path]
+            rates[has_path] = np.multiply.reduceat(edge_factors, starts)
+        rates[~routable] = np.nan
+        return rates
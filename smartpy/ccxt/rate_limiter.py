@@ -0,0 +1,171 @@
+import threading
+import time
+
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_RATE = 10
+RATE_LIMIT_PENALTY_SECONDS = 5
+
+# Relative cost of each endpoint in bucket tokens, a plain request costs 1
+ENDPOINT_WEIGHTS = {
+    "default": {
+        "fetch_tickers": 10,
+        "fetch_my_trades": 5,
+        "fetch_closed_orders": 5,
+        "fetch_orders": 5,
+        "fetch_open_orders": 5,
+        "fetch_balance": 2,
+        "load_markets": 10
+    },
+    "binance": {
+        "fetch_ohlcv": 2,
+        "fetch_tickers": 40,
+        "fetch_my_trades": 10,
+        "fetch_closed_orders": 10,
+        "fetch_orders": 10,
+        "fetch_open_orders": 40,
+        "fetch_balance": 10,
+        "load_markets": 20
+    }
+}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Callers queue in FIFO order until the bucket holds enough tokens for their request
+    weight, instead of failing and retrying.
+    :param rate: tokens added per second, ie sustained requests per second for weight 1 requests
+    :param capacity: maximum number of tokens, ie size of the allowed burst
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.created_at = self.last_refill
+        self.condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving_ticket = 0
+
+        # Metrics
+        self.n_requests = 0
+        self.n_penalties = 0
+        self.tokens_consumed = 0.0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, weight=1):
+        """
+        Block until weight tokens are available and consume them
+        :return: time spent waiting in the queue, in seconds
+        """
+        weight = min(float(weight), self.capacity)
+        start = time.monotonic()
+        with self.condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while True:
+                if ticket == self._serving_ticket:
+                    self._refill()
+                    if self.tokens >= weight:
+                        break
+                    self.condition.wait((weight - self.tokens) / self.rate)
+                else:
+                    self.condition.wait()
+            self.tokens -= weight
+            self._serving_ticket += 1
+            wait = time.monotonic() - start
+            self.n_requests += 1
+            self.tokens_consumed += weight
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.condition.notify_all()
+        return wait
+
+    def setRate(self, rate, capacity=None):
+        """
+        Change the rate and capacity, tokens already in the bucket are kept up to the new capacity
+        """
+        with self.condition:
+            self._refill()
+            self.rate = float(rate)
+            self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+            self.tokens = min(self.tokens, self.capacity)
+            self.condition.notify_all()
+
+    def penalize(self, seconds=RATE_LIMIT_PENALTY_SECONDS):
+        """
+        Drain the bucket so that no request goes out for the next seconds, used when the exchange answers 429
+        """
+        with self.condition:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+            self.n_penalties += 1
+            self.condition.notify_all()
+
+    def getMetrics(self):
+        with self.condition:
+            elapsed = time.monotonic() - self.created_at
+            return {
+                "rate": self.rate,
+                "capacity": self.capacity,
+                "requests": self.n_requests,
+                "queue_length": self._next_ticket - self._serving_ticket,
+                "penalties": self.n_penalties,
+                "total_wait_s": self.total_wait,
+                "mean_wait_s": self.total_wait / self.n_requests if self.n_requests > 0 else 0.0,
+                "max_wait_s": self.max_wait,
+                "tokens_consumed": self.tokens_consumed,
+                "utilisation": self.tokens_consumed / (self.capacity + elapsed * self.rate)
+            }
+
+
+def getRateLimiter(exchange, rate=None, capacity=None, default_rate=DEFAULT_RATE):
+    """
+    Process wide token bucket of an exchange, so every client and thread hitting the exchange shares one budget.
+    :param rate: explicit rate, applied to the bucket even if it already exists
+    :param capacity: explicit capacity, applied like rate, max(1, rate) if None
+    :param default_rate: rate of the bucket when it is created without an explicit rate
+    """
+    with _rate_limiters_lock:
+        if exchange not in _rate_limiters:
+            _rate_limiters[exchange] = TokenBucket(rate=rate if rate is not None else default_rate,
+                                                   capacity=capacity)
+        elif rate is not None or capacity is not None:
+            rate_limiter = _rate_limiters[exchange]
+            rate = rate if rate is not None else rate_limiter.rate
+            if rate != rate_limiter.rate or (capacity is not None and capacity != rate_limiter.capacity):
+                logger.info(f"{exchange} rate limit changed from {rate_limiter.rate}/s to {rate}/s, shared by every "
+                            f"client of the exchange")
+                rate_limiter.setRate(rate, capacity)
+        return _rate_limiters[exchange]
+
+
+def resetRateLimiters():
+    """
+    Drop every bucket, the next getRateLimiter creates new ones. Meant for tests and benchmarks.
+    """
+    with _rate_limiters_lock:
+        _rate_limiters.clear()
+
+
+def getEndpointWeight(exchange, endpoint):
+    exchange_weights = ENDPOINT_WEIGHTS.get(exchange, ENDPOINT_WEIGHTS['default'])
+    return exchange_weights.get(endpoint, ENDPOINT_WEIGHTS['default'].get(endpoint, 1))
+
+
+def getRateLimitMetrics():
+    with _rate_limiters_lock:
+        rate_limiters = dict(_rate_limiters)
+    return {exchange: rate_limiter.getMetrics() for exchange, rate_limiter in rate_limiters.items()}
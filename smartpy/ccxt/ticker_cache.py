@@ -0,0 +1,92 @@
+import threading
+import time
+
+from smartpy.utility.log_util import getLogger
+from smartpy.utility.scheduler import RepeatFunction
+
+logger = getLogger(__name__)
+
+DEFAULT_TICKER_TTL = 5
+
+
+class TickerCache:
+    """
+    Per exchange snapshot of all tickers, refreshed with a single bulk fetch_tickers call once older than its TTL
+    :param fetch_tickers: function taking an exchange name and returning the ccxt fetch_tickers dict
+    :param ttl: snapshot time to live in seconds, either one value for all exchanges or a dict per exchange
+    """
+
+    def __init__(self, fetch_tickers, ttl=DEFAULT_TICKER_TTL):
+        self.fetch_tickers = fetch_tickers
+        self.ttl = ttl
+        self.snapshots = {}
+        self.snapshot_times = {}
+        self.refreshers = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def getTTL(self, exchange):
+        if isinstance(self.ttl, dict):
+            return self.ttl.get(exchange, DEFAULT_TICKER_TTL)
+        return self.ttl
+
+    def _getLock(self, exchange):
+        with self._locks_lock:
+            if exchange not in self._locks:
+                self._locks[exchange] = threading.Lock()
+            return self._locks[exchange]
+
+    def _isFresh(self, exchange):
+        return exchange in self.snapshots and \
+            time.monotonic() - self.snapshot_times[exchange] < self.getTTL(exchange)
+
+    def _fetch(self, exchange):
+        tickers = self.fetch_tickers(exchange)
+        self.snapshot_times[exchange] = time.monotonic()
+        self.snapshots[exchange] = tickers
+        return tickers
+
+    def refresh(self, exchange):
+        with self._getLock(exchange):
+            return self._fetch(exchange)
+
+    def getTickers(self, exchange):
+        """
+        Ticker snapshot of the exchange, refreshed first if it expired. Concurrent callers share one refresh.
+        """
+        if self._isFresh(exchange):
+            return self.snapshots[exchange]
+        with self._getLock(exchange):
+            if self._isFresh(exchange):
+                return self.snapshots[exchange]
+            return self._fetch(exchange)
+
+    def getTicker(self, exchange, symbol):
+        return self.getTickers(exchange)[symbol]
+
+    def getLast(self, exchange, symbol):
+        return self.getTicker(exchange, symbol)['last']
+
+    def startBackgroundRefresh(self, exchange, interval=None):
+        """
+        Keep the exchange snapshot warm by refreshing it every interval seconds (defaults to the TTL)
+        """
+        if exchange not in self.refreshers:
+            self.refreshers[exchange] = RepeatFunction(interval if interval is not None else self.getTTL(exchange),
+                                                       self._backgroundRefresh,
+                                                       exchange)
+
+    def stopBackgroundRefresh(self, exchange=None):
+        exchanges = [exchange] if exchange is not None else list(self.refreshers.keys())
+        for exchange in exchanges:
+            # Stopping an exchange that is not refreshed, or twice, is a no-op
+            refresher = self.refreshers.pop(exchange, None)
+            if refresher is None:
+                continue
+            refresher.stop()
+
+    def _backgroundRefresh(self, exchange):
+        try:
+            self.refresh(exchange)
+        except Exception as e:
+            logger.warning(f"Background ticker refresh failed for {exchange} : {type(e).__name__} {e}")
@@ -0,0 +1,243 @@
+import json
+import os
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import smartpy.utility.dt_util as dt_util
+import smartpy.utility.os_util as os_util
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+PUBLIC_TRADE_SCHEMA = pa.schema([('id', pa.string()),
+                                 ('timestamp', pa.int64()),
+                                 ('side', pa.string()),
+                                 ('price', pa.float64()),
+                                 ('amount', pa.float64())])
+DEFAULT_ROW_GROUP_SIZE = 100000
+DEFAULT_PAGE_LIMIT = 1000
+# Part files are named after their first and last trade timestamps, zero padded so they sort chronologically
+PART_FILE_FORMAT = 'part-{:013d}-{:013d}.parquet'
+COVERAGE_FILE_NAME = 'coverage.json'
+
+
+def tradesToColumns(trades):
+    """
+    ccxt trade dicts to PUBLIC_TRADE_SCHEMA numpy columns, the raw exchange payloads are not kept
+    """
+    return {'id': np.array([None if i is None else str(i) for i in map(itemgetter('id'), trades)], dtype=object),
+            'timestamp': np.fromiter(map(itemgetter('timestamp'), trades), dtype=np.int64, count=len(trades)),
+            'side': np.array([i.get('side') for i in trades], dtype=object),
+            'price': np.fromiter(map(itemgetter('price'), trades), dtype=np.float64, count=len(trades)),
+            'amount': np.fromiter(map(itemgetter('amount'), trades), dtype=np.float64, count=len(trades))}
+
+
+class TradeDownloader:
+    """
+    Historical public trades of any ccxt exchange streamed to Parquet.
+    Pages are fetched by 'since', turned into columns straight away and buffered until row_group_size trades are
+    available, which are then written as one part file holding a single row group. Memory use is bounded by the
+    row group size whatever the length of the download. A coverage file lists the [start, end) millisecond ranges
+    fully downloaded, so a new download only fetches the gaps of its range, and an interrupted one resumes after its
+    last part file.
+    :param aggregator: CCXTAggregator used for the rate limited fetch_trades calls
+    """
+
+    def __init__(self,
+                 aggregator,
+                 store_dir=None,
+                 row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 page_limit=DEFAULT_PAGE_LIMIT):
+        self.aggregator = aggregator
+        self.store_dir = store_dir if store_dir is not None else os_util.getTempDir('ccxt_public_trades')
+        self.row_group_size = row_group_size
+        self.page_limit = page_limit
+
+    def getPartitionPath(self, exchange, symbol):
+        symbol_key = symbol.replace('/', '_').replace(':', '_')
+        return os.path.join(self.store_dir, f"exchange={exchange}", f"symbol={symbol_key}")
+
+    def getPartFiles(self, exchange, symbol):
+        partition_path = self.getPartitionPath(exchange, symbol)
+        if not os_util.dirExists(partition_path):
+            return []
+        return [os.path.join(partition_path, i) for i in sorted(os.listdir(partition_path))
+                if i.startswith('part-') and i.endswith('.parquet')]
+
+    def _getPartFileRange(self, file_path):
+        first_timestamp, last_timestamp = map(int, os.path.basename(file_path)[5:-8].split('-'))
+        return first_timestamp, last_timestamp
+
+    def _getCoveragePath(self, exchange, symbol):
+        return os.path.join(self.getPartitionPath(exchange, symbol), COVERAGE_FILE_NAME)
+
+    def getCoverage(self, exchange, symbol):
+        """
+        :return: sorted list of (start, end) millisecond ranges fully downloaded
+        """
+        coverage_path = self._getCoveragePath(exchange, symbol)
+        if os_util.fileExists(coverage_path):
+            with open(coverage_path) as f:
+                return [tuple(i) for i in json.load(f)]
+        # Stores written before the coverage file were always downloaded in one contiguous range
+        part_files = self.getPartFiles(exchange, symbol)
+        if len(part_files) == 0:
+            return []
+        return [(self._getPartFileRange(part_files[0])[0], self._getPartFileRange(part_files[-1])[1])]
+
+    def _addCoverage(self, exchange, symbol, start, end):
+        if end <= start:
+            return
+        intervals = sorted(self.getCoverage(exchange, symbol) + [(start, end)])
+        merged = [list(intervals[0])]
+        for interval_start, interval_end in intervals[1:]:
+            if interval_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], interval_end)
+            else:
+                merged.append([interval_start, interval_end])
+        coverage_path = self._getCoveragePath(exchange, symbol)
+        os.makedirs(os.path.dirname(coverage_path), exist_ok=True)
+        tmp_path = coverage_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, coverage_path)
+
+    def getMissingRanges(self, exchange, symbol, start, end=None):
+        """
+        Ranges of [start, end) not downloaded yet
+        :param end: range end in milliseconds, None for open ended
+        :return: list of (start, end) millisecond tuples, the last end being None if end is None
+        """
+        missing = []
+        cursor = start
+        for covered_start, covered_end in self.getCoverage(exchange, symbol):
+            if covered_end <= cursor:
+                continue
+            if end is not None and covered_start >= end:
+                break
+            if covered_start > cursor:
+                missing.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+        if end is None or cursor < end:
+            missing.append((cursor, end))
+        return missing
+
+    def getStoredIds(self, exchange, symbol, timestamp):
+        """
+        Ids of the stored trades at a millisecond timestamp, read from the part files whose range contains it
+        """
+        ids = set()
+        for file_path in self.getPartFiles(exchange, symbol):
+            first_timestamp, last_timestamp = self._getPartFileRange(file_path)
+            if first_timestamp <= timestamp <= last_timestamp:
+                table = pq.read_table(file_path, columns=['id', 'timestamp'])
+                timestamps = table.column('timestamp').to_numpy()
+                ids |= set(np.asarray(table.column('id').to_pylist(), dtype=object)[timestamps == timestamp])
+        return ids
+
+    def _flush(self, exchange, symbol, buffer):
+        columns = {name: np.concatenate([page[name] for page in buffer]) for name in PUBLIC_TRADE_SCHEMA.names}
+        table = pa.Table.from_pydict(columns, schema=PUBLIC_TRADE_SCHEMA)
+        partition_path = self.getPartitionPath(exchange, symbol)
+        os.makedirs(partition_path, exist_ok=True)
+        file_path = os.path.join(partition_path, PART_FILE_FORMAT.format(columns['timestamp'][0],
+                                                                         columns['timestamp'][-1]))
+        # Written under a temporary name first so a crash never leaves a truncated part file behind
+        tmp_path = file_path + '.tmp'
+        pq.write_table(table, tmp_path, row_group_size=len(table))
+        os.replace(tmp_path, file_path)
+        return len(table)
+
+    def download(self,
+                 exchange,
+                 symbol,
+                 start_time,
+                 end_time=None):
+        """
+        Download the trades of [start_time, end_time) missing from the store
+        :return: number of trades written by this call
+        """
+        since = dt_util.toUnixMillisUTC(start_time)
+        until = dt_util.toUnixMillisUTC(end_time) if end_time is not None else None
+        n_written = 0
+        for gap_start, gap_end in self.getMissingRanges(exchange, symbol, since, until):
+            if gap_start > since:
+                logger.info(f"Resuming {exchange} {symbol} trades download from {pd.to_datetime(gap_start, unit='ms')}")
+            n_written += self._downloadRange(exchange, symbol, gap_start, gap_end)
+        logger.info(f"Downloaded {n_written} {exchange} {symbol} trades")
+        return n_written
+
+    def _downloadRange(self, exchange, symbol, start, until):
+        """
+        Download the trades of [start, until) and mark the range downloaded as pages are flushed
+        """
+        since = start
+        # Trades stored at the range start were downloaded by the range ending there
+        seen_ids = self.getStoredIds(exchange, symbol, since)
+        buffer = []
+        n_buffered = 0
+        n_written = 0
+        while until is None or since < until:
+            page = self.aggregator.callEndpoint(exchange, 'fetch_trades', symbol, since, self.page_limit)
+            trades = [i for i in page if str(i['id']) not in seen_ids and (until is None or i['timestamp'] < until)]
+            if len(trades) == 0:
+                if len(page) >= self.page_limit and all(i['timestamp'] == since for i in page):
+                    # A full page inside one millisecond can not be paged through by timestamp
+                    logger.warning(f"More than {self.page_limit} {exchange} {symbol} trades at {since}, skipping ahead")
+                    since += 1
+                    seen_ids = set()
+                    continue
+                break
+            columns = tradesToColumns(trades)
+            order = np.argsort(columns['timestamp'], kind='stable')
+            columns = {name: values[order] for name, values in columns.items()}
+            buffer.append(columns)
+            n_buffered += len(trades)
+
+            # The next page starts at the last timestamp again, skipping the ids already downloaded at it
+            last_timestamp = int(columns['timestamp'][-1])
+            if last_timestamp != since:
+                since = last_timestamp
+                seen_ids = set()
+            seen_ids |= set(columns['id'][columns['timestamp'] == since])
+
+            if n_buffered >= self.row_group_size:
+                n_written += self._flush(exchange, symbol, buffer)
+                buffer, n_buffered = [], 0
+                # Trades at the last flushed timestamp may continue on the next page
+                self._addCoverage(exchange, symbol, start, since)
+        if n_buffered > 0:
+            n_written += self._flush(exchange, symbol, buffer)
+        self._addCoverage(exchange, symbol, start, until if until is not None else since)
+        return n_written
+
+    def load(self,
+             exchange,
+             symbol,
+             start_time=None,
+             end_time=None):
+        """
+        Stored trades of a symbol in [start_time, end_time), only reading the part files overlapping the range
+        """
+        start = dt_util.toUnixMillisUTC(start_time) if start_time is not None else None
+        end = dt_util.toUnixMillisUTC(end_time) if end_time is not None else None
+        tables = []
+        for file_path in self.getPartFiles(exchange, symbol):
+            first_timestamp, last_timestamp = self._getPartFileRange(file_path)
+            if (start is not None and last_timestamp < start) or (end is not None and first_timestamp >= end):
+                continue
+            tables.append(pq.read_table(file_path))
+        if len(tables) == 0:
+            return PUBLIC_TRADE_SCHEMA.empty_table().to_pandas()
+        df = pa.concat_tables(tables).to_pandas()
+        # A crash between a part file write and the coverage update downloads its trades again on resume
+        df = df.drop_duplicates(subset='id')
+        if start is not None:
+            df = df[df['timestamp'] >= start]
+        if end is not None:
+            df = df[df['timestamp'] < end]
+        return df.reset_index(drop=True)
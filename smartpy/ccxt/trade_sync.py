@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import smartpy.utility.dt_util as dt_util
+import smartpy.utility.os_util as os_util
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+TRADE_COLUMNS = ['id', 'order', 'timestamp', 'symbol', 'type', 'side', 'takerOrMaker', 'price', 'amount', 'cost',
+                 'fee_cost', 'fee_currency']
+HIGH_WATER_MARKS_FILE_NAME = 'high_water_marks.json'
+DEFAULT_PAGE_LIMIT = 1000
+
+
+def flattenTrades(trades):
+    """
+    ccxt trade dicts to a flat frame with TRADE_COLUMNS, dropping the raw exchange 'info' payload
+    """
+    rows = []
+    for trade in trades:
+        fee = trade.get('fee') or {}
+        rows.append((None if trade.get('id') is None else str(trade['id']),
+                     None if trade.get('order') is None else str(trade['order']),
+                     trade.get('timestamp'),
+                     trade.get('symbol'),
+                     trade.get('type'),
+                     trade.get('side'),
+                     trade.get('takerOrMaker'),
+                     trade.get('price'),
+                     trade.get('amount'),
+                     trade.get('cost'),
+                     fee.get('cost'),
+                     fee.get('currency')))
+    df = pd.DataFrame(rows, columns=TRADE_COLUMNS)
+    df['timestamp'] = df['timestamp'].astype('int64')
+    df[['price', 'amount', 'cost', 'fee_cost']] = df[['price', 'amount', 'cost', 'fee_cost']].astype(float)
+    return df
+
+
+class TradeSync:
+    """
+    Incremental sync of account fills into a local Parquet store.
+    A high-water mark (last trade timestamp and the trade ids seen at that timestamp) is kept per exchange and symbol,
+    so each sync only downloads fills newer than the previous one, with symbols synced concurrently.
+    :param aggregator: CCXTAggregator used for the rate limited fetch_my_trades calls
+    :param start_time: where the first sync of a symbol starts paging from, the epoch if None. Exchanges only return
+    their latest page without a since, so it is always set explicitly.
+    """
+
+    def __init__(self,
+                 aggregator,
+                 store_dir=None,
+                 max_workers=4,
+                 page_limit=DEFAULT_PAGE_LIMIT,
+                 start_time=None):
+        self.aggregator = aggregator
+        self.start_time = start_time
+        self.store_dir = store_dir if store_dir is not None else os_util.getTempDir('ccxt_trades')
+        self.max_workers = max_workers
+        self.page_limit = page_limit
+        self._lock = threading.Lock()
+        self.high_water_marks = self._loadHighWaterMarks()
+
+    def _getHighWaterMarksPath(self):
+        return os.path.join(self.store_dir, HIGH_WATER_MARKS_FILE_NAME)
+
+    def _loadHighWaterMarks(self):
+        if os_util.fileExists(self._getHighWaterMarksPath()):
+            with open(self._getHighWaterMarksPath()) as f:
+                return json.load(f)
+        return {}
+
+    def _setHighWaterMark(self, exchange, symbol, timestamp, ids):
+        with self._lock:
+            self.high_water_marks[f"{exchange}|{symbol}"] = {'timestamp': timestamp, 'ids': sorted(ids)}
+            os.makedirs(self.store_dir, exist_ok=True)
+            tmp_path = self._getHighWaterMarksPath() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.high_water_marks, f)
+            os.replace(tmp_path, self._getHighWaterMarksPath())
+
+    def getHighWaterMark(self, exchange, symbol):
+        return self.high_water_marks.get(f"{exchange}|{symbol}")
+
+    def getPartitionPath(self, exchange, symbol):
+        symbol_key = symbol.replace('/', '_').replace(':', '_')
+        return os.path.join(self.store_dir, f"exchange={exchange}", f"symbol={symbol_key}")
+
+    def getStartTimestamp(self, start_time=None):
+        start_time = start_time if start_time is not None else self.start_time
+        return dt_util.toUnixMillisUTC(start_time) if start_time is not None else 0
+
+    def syncSymbol(self, exchange, symbol, start_time=None):
+        """
+        Download the fills newer than the symbol high-water mark and append them to the store
+        :param start_time: first sync start, overriding the constructor one. Ignored once the symbol has a mark.
+        :return: DataFrame of the new fills
+        """
+        high_water_mark = self.getHighWaterMark(exchange, symbol)
+        since = high_water_mark['timestamp'] if high_water_mark is not None else self.getStartTimestamp(start_time)
+        seen_ids = set(high_water_mark['ids']) if high_water_mark is not None else set()
+
+        new_trades = []
+        while True:
+            page = self.aggregator.callEndpoint(exchange, 'fetch_my_trades', symbol=symbol, since=since,
+                                                limit=self.page_limit)
+            trades = [i for i in page if str(i['id']) not in seen_ids]
+            if len(trades) == 0:
+                break
+            new_trades += trades
+            # A page boundary can fall inside a millisecond, so the next page starts at the last timestamp again
+            # and skips the ids already seen there
+            last_timestamp = max(i['timestamp'] for i in trades)
+            if last_timestamp != since:
+                since = last_timestamp
+                seen_ids = set()
+            # Exchanges may cap pages below page_limit, so paging only stops on a page without unseen fills
+            seen_ids |= {str(i['id']) for i in trades if i['timestamp'] == since}
+
+        if len(new_trades) == 0:
+            return flattenTrades([])
+
+        df = flattenTrades(new_trades).sort_values('timestamp').reset_index(drop=True)
+        partition_path = self.getPartitionPath(exchange, symbol)
+        os.makedirs(partition_path, exist_ok=True)
+        file_name = f"part-{df['timestamp'].iloc[0]}-{df['timestamp'].iloc[-1]}-{time.time_ns()}.parquet"
+        file_path = os.path.join(partition_path, file_name)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), file_path)
+        self._setHighWaterMark(exchange, symbol, since, seen_ids)
+        logger.info(f"Synced {len(df)} new {exchange} {symbol} fills")
+        return df
+
+    def sync(self, exchange, symbols, start_time=None):
+        """
+        Sync several symbols concurrently
+        :return: tuple (new fills DataFrame, failures dict symbol -> exception)
+        """
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        new_trades = []
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"trade_sync_{exchange}") as executor:
+            futures = {symbol: executor.submit(self.syncSymbol, exchange, symbol, start_time) for symbol in symbols}
+            for symbol, future in futures.items():
+                try:
+                    new_trades.append(future.result())
+                except Exception as e:
+                    logger.warning(f"Fill sync failed for {exchange} {symbol} : {type(e).__name__} {e}")
+                    failures[symbol] = e
+        new_trades = pd.concat(new_trades, ignore_index=True) if len(new_trades) > 0 else flattenTrades([])
+        return new_trades, failures
+
+    def load(self, exchange, symbols=None):
+        """
+        All stored fills of an exchange, optionally filtered on symbols
+        """
+        exchange_path = os.path.join(self.store_dir, f"exchange={exchange}")
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        if symbols is not None:
+            partition_paths = [self.getPartitionPath(exchange, symbol) for symbol in symbols]
+        elif os_util.dirExists(exchange_path):
+            partition_paths = [os.path.join(exchange_path, i) for i in os.listdir(exchange_path)]
+        else:
+            partition_paths = []
+        tables = [pq.read_table(os.path.join(path, file_name))
+                  for path in partition_paths if os_util.dirExists(path)
+                  for file_name in sorted(os.listdir(path)) if file_name.endswith('.parquet')]
+        if len(tables) == 0:
+            return flattenTrades([])
+        df = pa.concat_tables(tables).to_pandas()
+        # A crash between the Parquet write and the high-water mark update can store a page twice
+        return df.drop_duplicates(subset=['symbol', 'id']).sort_values('timestamp').reset_index(drop=True)
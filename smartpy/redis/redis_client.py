@@ -1,7 +1,12 @@
 import json
+import threading
 
 from redis.client import Redis
 
+from smartpy.redis.redis_codecs import JsonCodec
+from smartpy.redis.redis_stream_consumer import RedisStreamConsumer
+from smartpy.redis.redis_stream_writer import RedisStreamWriter
+
 
 encoder = json.JSONEncoder()
 decoder = json.JSONDecoder
@@ -11,8 +16,17 @@ L2_OB_REDIS_STREAM = 'order_book'
 
 class RedisClient:
 
-    def __init__(self, host='localhost', port=6379, verbose=False):
+    def __init__(self, host='localhost', port=6379, verbose=False, writer_config=None, codec=None):
+        """
+        :param codec: serialization of the stream messages (JsonCodec, MsgpackCodec or StructCodec), JsonCodec if None
+        :param writer_config: RedisStreamWriter keyword arguments (batch_size, flush_interval, max_buffer, maxlen,
+        max_retries) used by add_concurrently
+        """
         self.redis_client = Redis(host, port)
+        self.codec = codec if codec is not None else JsonCodec()
+        self.writer_config = writer_config if writer_config is not None else {}
+        self.writer = None
+        self._writer_lock = threading.Lock()
 
     def get(self, stream_name, last_n=1, return_all=False):
         tuples = self.redis_client.xrevrange(stream_name, max='+', min='-', count=last_n)
@@ -24,9 +38,33 @@ class RedisClient:
             else:
                 return [i[1] for i in tuples]
 
-    def add(self, stream_name, output_dict: dict):
-        output_dict = {key: encoder.encode(value) for key, value in output_dict.items()}
-        return self.redis_client.xadd(stream_name, output_dict)
+    def getColumns(self, stream_name, last_n=1):
+        """
+        Last last_n messages decoded in one batch, oldest first
+        :return: dict of column name to numpy array
+        """
+        tuples = self.redis_client.xrevrange(stream_name, max='+', min='-', count=last_n)
+        return self.codec.decodeBatch([fields for _, fields in reversed(tuples)])
+
+    def encode(self, output_dict):
+        return self.codec.encode(output_dict)
+
+    def decode(self, fields):
+        return self.codec.decode(fields)
+
+    def add(self, stream_name, output_dict: dict, maxlen=None):
+        return self.redis_client.xadd(stream_name, self.encode(output_dict), maxlen=maxlen, approximate=True)
+
+    def add_many(self, stream_name, output_dicts, maxlen=None):
+        """
+        Add several messages in one pipelined round trip
+        :param maxlen: trim the stream to about maxlen entries (MAXLEN ~)
+        :return: list of the added entry ids
+        """
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for output_dict in output_dicts:
+            pipeline.xadd(stream_name, self.encode(output_dict), maxlen=maxlen, approximate=True)
+        return pipeline.execute()
 
     def parse_redis_keys(self, list_of_keys):
         return [i.decode('utf-8') for i in list_of_keys]
@@ -34,6 +72,33 @@ class RedisClient:
     def parse_redis_dicts(self, list_of_dicts):
         return [{k.decode('utf-8'): v.decode('utf-8') for k, v in i.items()} for i in list_of_dicts]
 
-    def add_concurrently(self, stream_name, output_dict):
-        self.add(stream_name, output_dict)
+    def getWriter(self):
+        if self.writer is None:
+            with self._writer_lock:
+                if self.writer is None:
+                    self.writer = RedisStreamWriter(self.redis_client, self.encode, **self.writer_config)
+        return self.writer
+
+    def add_concurrently(self, stream_name, output_dict, timeout=None):
+        """
+        Queue the message on the background writer, which flushes batches of pipelined XADD.
+        Blocks if the writer buffer is full, encoding errors are raised here.
+        """
+        self.getWriter().add(stream_name, output_dict, timeout=timeout)
+
+    def getConsumer(self, stream_names, group_name, consumer_name, **kwargs):
+        """
+        Consumer group reader of the streams, decoding messages with the client codec
+        :param kwargs: RedisStreamConsumer keyword arguments (count, block_ms, min_idle_ms, start_id)
+        """
+        return RedisStreamConsumer(self.redis_client, stream_names, group_name, consumer_name, self.decode, **kwargs)
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
@@ -0,0 +1,128 @@
+import json
+import struct
+
+import numpy as np
+
+# Stream field holding the whole message for the single field codecs
+PAYLOAD_FIELD = b'd'
+# Standard size struct codes by numpy dtype kind and item size, native dtype.char sizes differ across platforms
+STRUCT_CODES = {('b', 1): '?',
+                ('i', 1): 'b', ('i', 2): 'h', ('i', 4): 'i', ('i', 8): 'q',
+                ('u', 1): 'B', ('u', 2): 'H', ('u', 4): 'I', ('u', 8): 'Q',
+                ('f', 2): 'e', ('f', 4): 'f', ('f', 8): 'd'}
+
+
+class JsonCodec:
+    """
+    One stream field per message key holding its JSON encoded value, the historical format of RedisClient.add
+    """
+
+    _encoder = json.JSONEncoder()
+
+    def encode(self, message):
+        return {key: self._encoder.encode(value) for key, value in message.items()}
+
+    def decode(self, fields):
+        return {key.decode('utf-8') if isinstance(key, bytes) else key: json.loads(value)
+                for key, value in fields.items()}
+
+    def decodeBatch(self, fields_list):
+        """
+        :return: dict of column name to numpy array
+        """
+        return _messagesToColumns([self.decode(fields) for fields in fields_list])
+
+
+class MsgpackCodec:
+    """
+    Whole message packed with msgpack in a single stream field, keeps the schema free form.
+    Needs the optional msgpack package.
+    """
+
+    def __init__(self):
+        # Imported here so that RedisClient and the other codecs do not depend on msgpack
+        import msgpack
+        self.packb = msgpack.packb
+        self.unpackb = msgpack.unpackb
+
+    def encode(self, message):
+        return {PAYLOAD_FIELD: self.packb(message, use_bin_type=True)}
+
+    def decode(self, fields):
+        return self.unpackb(fields[PAYLOAD_FIELD], raw=False)
+
+    def decodeBatch(self, fields_list):
+        return _messagesToColumns([self.decode(fields) for fields in fields_list])
+
+
+class StructCodec:
+    """
+    Fixed schema message packed as a little-endian C struct in a single stream field. A batch decodes with one
+    np.frombuffer over the concatenated payloads.
+    :param schema: list of (name, numpy dtype), fixed size only. Bytes fields ('S8') are null padded.
+    """
+
+    def __init__(self, schema):
+        self.dtype = np.dtype([(name, np.dtype(dtype).newbyteorder('<')) for name, dtype in schema])
+        self.names = list(self.dtype.names)
+        self.struct = struct.Struct('<' + ''.join(_getStructCode(self.dtype[name]) for name in self.names))
+        assert self.struct.size == self.dtype.itemsize
+
+    def encode(self, message):
+        return {PAYLOAD_FIELD: self.struct.pack(*[message[name] for name in self.names])}
+
+    def decode(self, fields):
+        return dict(zip(self.names, self.struct.unpack(fields[PAYLOAD_FIELD])))
+
+    def decodeArray(self, fields_list):
+        """
+        :return: numpy structured array of the messages
+        """
+        return np.frombuffer(b''.join([fields[PAYLOAD_FIELD] for fields in fields_list]), dtype=self.dtype)
+
+    def decodeBatch(self, fields_list):
+        array = self.decodeArray(fields_list)
+        return {name: array[name] for name in self.names}
+
+
+def _getStructCode(dtype):
+    if dtype.kind == 'S':
+        return f"{dtype.itemsize}s"
+    if (dtype.kind, dtype.itemsize) not in STRUCT_CODES:
+        raise ValueError(f"Unsupported struct field dtype {dtype}")
+    return STRUCT_CODES[(dtype.kind, dtype.itemsize)]
+
+
+def _messagesToColumns(messages):
+    columns = {}
+    for i, message in enumerate(messages):
+        for key, value in message.items():
+            columns.setdefault(key, [None] * len(messages))[i] = value
+    return {key: np.array(values) for key, values in columns.items()}
+
+
+def getTradeCodec():
+    """
+    StructCodec of trade messages: timestamp in ms, price, amount and side (1 buy, -1 sell)
+    """
+    return StructCodec([('timestamp', np.int64), ('price', np.float64), ('amount', np.float64), ('side', np.int8)])
+
+
+def getL2Codec(n_levels):
+    """
+    StructCodec of L2 snapshots flattened as 'bid_price_0', 'bid_amount_0', 'ask_price_0', ... up to n_levels
+    """
+    schema = [('timestamp', np.int64)]
+    for side in ['bid', 'ask']:
+        for i in range(n_levels):
+            schema += [(f"{side}_price_{i}", np.float64), (f"{side}_amount_{i}", np.float64)]
+    return StructCodec(schema)
+
+
+def toArrowTable(columns):
+    """
+    pyarrow Table of decodeBatch columns, without copy for numeric columns. Needs the optional pyarrow package.
+    """
+    import pyarrow as pa
+
+    return pa.table({name: pa.array(values) for name, values in columns.items()})
@@ -0,0 +1,223 @@
+import threading
+import time
+
+from redis.exceptions import ResponseError
+
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_COUNT = 100
+DEFAULT_BLOCK_MS = 1000
+DEFAULT_MIN_IDLE_MS = 60000
+DEFAULT_CLAIM_INTERVAL = 30
+DEFAULT_MAX_DELIVERIES = 5
+DEFAULT_ERROR_DELAY = 1
+
+
+class RedisStreamConsumer:
+    """
+    Consumer group reader of one or several streams. Every entry is delivered to a single consumer of the group and
+    stays pending until acknowledged, so workers can be added to share the load, and the entries of a worker that
+    died are claimed by the others once idle for min_idle_ms.
+    :param redis_client: redis.Redis connection
+    :param streams: stream name or list of stream names
+    :param group: consumer group name, created on the streams if missing
+    :param consumer: name of this consumer in the group, it has to be stable across restarts to recover its pending
+    entries
+    :param decode: function decoding the raw stream fields of an entry, None to pass the raw fields to process, e.g.
+    to decode the whole batch at once with a codec decodeBatch
+    :param start_id: where a newly created group starts reading, '$' for new entries only, '0' for the whole stream
+    :param max_deliveries: entries delivered more times than this (XPENDING delivery count) are not processed again
+    but acknowledged, after being copied to dead_letter_stream if set. None to retry forever.
+    """
+
+    def __init__(self,
+                 redis_client,
+                 streams,
+                 group,
+                 consumer,
+                 decode,
+                 count=DEFAULT_COUNT,
+                 block_ms=DEFAULT_BLOCK_MS,
+                 min_idle_ms=DEFAULT_MIN_IDLE_MS,
+                 start_id='$',
+                 max_deliveries=DEFAULT_MAX_DELIVERIES,
+                 dead_letter_stream=None):
+        self.redis_client = redis_client
+        self.streams = [streams] if isinstance(streams, str) else list(streams)
+        self.group = group
+        self.consumer = consumer
+        self.decode = decode
+        self.count = count
+        self.block_ms = block_ms
+        self.min_idle_ms = min_idle_ms
+        self.max_deliveries = max_deliveries
+        self.dead_letter_stream = dead_letter_stream
+        self.n_processed = 0
+        self.n_claimed = 0
+        self.n_dead_letters = 0
+        self._stop_event = threading.Event()
+        self.createGroups(start_id)
+
+    def createGroups(self, start_id='$'):
+        for stream in self.streams:
+            try:
+                self.redis_client.xgroup_create(stream, self.group, id=start_id, mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    def _decodeEntries(self, stream, entries):
+        stream = stream.decode('utf-8') if isinstance(stream, bytes) else stream
+        decode = self.decode if self.decode is not None else (lambda fields: fields)
+        return [(stream, entry_id, decode(fields) if fields else None) for entry_id, fields in entries]
+
+    def _dropUndeliverable(self, stream, entries):
+        """
+        Acknowledge and dead letter the entries of this consumer delivered more than max_deliveries times
+        :return: the other entries
+        """
+        if self.max_deliveries is None or len(entries) == 0:
+            return entries
+        pending = self.redis_client.xpending_range(stream, self.group, min=entries[0][0], max=entries[-1][0],
+                                                   count=len(entries), consumername=self.consumer)
+        delivery_counts = {i['message_id']: i['times_delivered'] for i in pending}
+        undeliverable = [(entry_id, fields) for entry_id, fields in entries
+                         if delivery_counts.get(entry_id, 0) > self.max_deliveries]
+        if len(undeliverable) == 0:
+            return entries
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for entry_id, fields in undeliverable:
+            if self.dead_letter_stream is not None and fields:
+                pipeline.xadd(self.dead_letter_stream, fields)
+        pipeline.xack(stream, self.group, *[entry_id for entry_id, _ in undeliverable])
+        pipeline.execute()
+        self.n_dead_letters += len(undeliverable)
+        logger.error(f"Giving up on {len(undeliverable)} {stream} entries delivered more than {self.max_deliveries} "
+                     f"times : {[entry_id for entry_id, _ in undeliverable]}")
+        undeliverable_ids = {entry_id for entry_id, _ in undeliverable}
+        return [entry for entry in entries if entry[0] not in undeliverable_ids]
+
+    def read(self, block_ms=None):
+        """
+        Next entries never delivered to the group, waiting up to block_ms for some to arrive
+        :return: list of (stream, entry_id, message)
+        """
+        response = self.redis_client.xreadgroup(self.group, self.consumer, {stream: '>' for stream in self.streams},
+                                                count=self.count,
+                                                block=block_ms if block_ms is not None else self.block_ms)
+        return [message for stream, entries in response or [] for message in self._decodeEntries(stream, entries)]
+
+    def readPending(self):
+        """
+        Entries delivered to this consumer but not acknowledged yet, e.g. after a restart
+        :return: list of (stream, entry_id, message), message being None for entries deleted from the stream
+        """
+        response = self.redis_client.xreadgroup(self.group, self.consumer, {stream: '0' for stream in self.streams},
+                                                count=self.count)
+        return [message for stream, entries in response or []
+                for message in self._decodeEntries(stream, self._dropUndeliverable(stream, entries))]
+
+    def claimStale(self):
+        """
+        Take over the entries left pending by other consumers for more than min_idle_ms, about count at most
+        :return: list of (stream, entry_id, message)
+        """
+        messages = []
+        for stream in self.streams:
+            start_id = '0-0'
+            while len(messages) < self.count:
+                response = self.redis_client.xautoclaim(stream, self.group, self.consumer, self.min_idle_ms,
+                                                        start_id=start_id, count=self.count)
+                start_id, entries = response[0], response[1]
+                messages += self._decodeEntries(stream, self._dropUndeliverable(stream, entries))
+                # XAUTOCLAIM returns a 0-0 cursor once the whole pending list was scanned
+                if start_id in (b'0-0', '0-0'):
+                    break
+        self.n_claimed += len(messages)
+        return messages
+
+    def ack(self, messages):
+        """
+        Acknowledge processed (stream, entry_id, message) entries
+        """
+        ids_by_stream = {}
+        for stream, entry_id, _ in messages:
+            ids_by_stream.setdefault(stream, []).append(entry_id)
+        if len(ids_by_stream) == 0:
+            return
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for stream, entry_ids in ids_by_stream.items():
+            pipeline.xack(stream, self.group, *entry_ids)
+        pipeline.execute()
+
+    def _process(self, process, messages):
+        """
+        Entries are only acknowledged once process returned, a failure leaves them pending to be processed again.
+        A failed batch is processed again one entry at a time, so only the failing entries stay pending.
+        """
+        if len(messages) == 0:
+            return
+        # Entries deleted from the stream while pending can not be processed, they are only acknowledged
+        valid_messages = [message for message in messages if message[2] is not None]
+        try:
+            if len(valid_messages) > 0:
+                process(valid_messages)
+        except Exception:
+            if len(valid_messages) == 1:
+                raise
+            errors = []
+            for message in valid_messages:
+                try:
+                    process([message])
+                    self.ack([message])
+                    self.n_processed += 1
+                except Exception as e:
+                    errors.append(e)
+            self.ack([message for message in messages if message[2] is None])
+            if len(errors) > 0:
+                raise errors[0]
+            return
+        self.ack(messages)
+        self.n_processed += len(valid_messages)
+
+    def run(self, process, claim_interval=DEFAULT_CLAIM_INTERVAL, error_delay=DEFAULT_ERROR_DELAY):
+        """
+        Process entries in batches until stop is called: first the pending entries of this consumer, then new ones,
+        claiming stale entries of other consumers every claim_interval seconds
+        :param process: function taking a list of (stream, entry_id, message)
+        :param error_delay: seconds to wait after a failure
+        """
+        self._stop_event.clear()
+        recovering = True
+        last_claim_time = 0
+        while not self._stop_event.is_set():
+            try:
+                if recovering:
+                    pending = self.readPending()
+                    if len(pending) > 0:
+                        self._process(process, pending)
+                        continue
+                    recovering = False
+                if time.monotonic() - last_claim_time >= claim_interval:
+                    last_claim_time = time.monotonic()
+                    self._process(process, self.claimStale())
+                self._process(process, self.read())
+            except Exception as e:
+                logger.error(f"{self.consumer} failed processing {self.streams} : {type(e).__name__} {e}")
+                # Failed pending entries are retried by claimStale once idle, counting their deliveries
+                recovering = False
+                self._stop_event.wait(error_delay)
+
+    def start(self, process, claim_interval=DEFAULT_CLAIM_INTERVAL, error_delay=DEFAULT_ERROR_DELAY):
+        """
+        run on a background thread
+        """
+        thread = threading.Thread(target=self.run, args=(process, claim_interval, error_delay),
+                                  name=f"redis_consumer_{self.consumer}", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+
+from redis.exceptions import ConnectionError, TimeoutError
+
+from smartpy.utility.log_util import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_MAX_BUFFER = 100000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BACKOFF = 0.1
+_STOP = object()
+
+
+class RedisStreamWriter:
+    """
+    Buffered stream writer: messages are queued by add and written by a background thread with one pipelined batch
+    of XADD per flush, a flush happening once batch_size messages are waiting or flush_interval seconds after the
+    first one. The queue holds at most max_buffer messages, add blocks when it is full so a slow Redis slows the
+    producer down instead of growing memory.
+    Messages are encoded by add on the producer thread, so bad input raises to the caller. A batch failing on a
+    connection error or timeout is retried max_retries times with exponential backoff, a retry after a failure in
+    the middle of a pipeline can write some messages twice.
+    :param redis_client: redis.Redis connection
+    :param encode: function encoding a message dict to the stream fields
+    :param maxlen: trim streams to about maxlen entries on every XADD (MAXLEN ~), None to keep everything
+    :param retry_backoff: seconds before the first retry, doubled on every following one
+    """
+
+    def __init__(self,
+                 redis_client,
+                 encode,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_buffer=DEFAULT_MAX_BUFFER,
+                 maxlen=None,
+                 approximate=True,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF):
+        self.redis_client = redis_client
+        self.encode = encode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maxlen = maxlen
+        self.approximate = approximate
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.n_written = 0
+        self.n_failed = 0
+        self.n_retries = 0
+        self.n_flushes = 0
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._thread = threading.Thread(target=self._run, name='redis_stream_writer', daemon=True)
+        self._thread.start()
+
+    def add(self, stream_name, output_dict, timeout=None):
+        """
+        Encode a message and queue it, waiting up to timeout seconds (forever if None) for buffer space
+        :raises queue.Full: if the buffer is still full after timeout
+        """
+        self._queue.put((stream_name, self.encode(output_dict)), timeout=timeout)
+
+    def flush(self):
+        """
+        Wait until every message queued so far was written or failed
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def getMetrics(self):
+        return {'queued': self._queue.qsize(),
+                'written': self.n_written,
+                'failed': self.n_failed,
+                'retries': self.n_retries,
+                'flushes': self.n_flushes}
+
+    def _run(self):
+        stop = False
+        while not stop:
+            message = self._queue.get()
+            if message is _STOP:
+                self._queue.task_done()
+                break
+            batch = [message]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message is _STOP:
+                    stop = True
+                    self._queue.task_done()
+                    break
+                batch.append(message)
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for stream_name, fields in batch:
+                    pipeline.xadd(stream_name, fields, maxlen=self.maxlen, approximate=self.approximate)
+                # Command errors (e.g. a key of another type) only fail their own message
+                errors = [i for i in pipeline.execute(raise_on_error=False) if isinstance(i, Exception)]
+                self.n_written += len(batch) - len(errors)
+                self.n_failed += len(errors)
+                if len(errors) > 0:
+                    logger.error(f"Could not write {len(errors)} messages to redis : {type(errors[0]).__name__} "
+                                 f"{errors[0]}")
+                break
+            except (ConnectionError, TimeoutError) as e:
+                if attempt == self.max_retries:
+                    self.n_failed += len(batch)
+                    logger.error(f"Could not write {len(batch)} messages to redis after {attempt + 1} attempts : "
+                                 f"{type(e).__name__} {e}")
+                    break
+                self.n_retries += 1
+                logger.warning(f"Retrying {len(batch)} messages to redis : {type(e).__name__} {e}")
+                time.sleep(self.retry_backoff * 2 ** attempt)
+            except Exception as e:
+                self.n_failed += len(batch)
+                logger.error(f"Could not write {len(batch)} messages to redis : {type(e).__name__} {e}")
+                break
+        self.n_flushes += 1
@@ -82,6 +82,18 @@ def toUnixTimestamp(date_time):
     return int(time.mktime(date_time.timetuple()))
 
 
+def toUnixMillisUTC(date_time):
+    """
+    Unix timestamp in milliseconds, naive datetimes being taken as UTC like exchange timestamps
+    """
+    if isinstance(date_time, (int, float)):
+        # Unix timestamps in seconds, as in toDatetime
+        return round(date_time * 1000)
+    timestamp = pd.Timestamp(toDatetime(date_time))
+    timestamp = timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+    return round(timestamp.timestamp() * 1000)
+
+
 def getPaginationIntervals(start,
                            end,
                            freq):
@@ -93,3 +105,12 @@ def getPaginationIntervals(start,
     intervals = [(toUnixTimestamp(ranges[i]), toUnixTimestamp(ranges[i + 1])) for i in range(len(ranges) - 1)]
     return intervals
 
+
+def getMillisecondPaginationIntervals(start,
+                                      end,
+                                      interval):
+    """
+    Split [start, end) into consecutive [window_start, window_end) tuples of at most interval milliseconds
+    """
+    window_starts = range(int(start), int(end), int(interval))
+    return [(window_start, min(window_start + int(interval), int(end))) for window_start in window_starts]
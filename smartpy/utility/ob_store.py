@@ -0,0 +1,197 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import smartpy.utility.os_util as os_util
+from smartpy.utility.ob_util import computeOrderBookMetrics, getSnapshotArrays, DEFAULT_CHUNK_SIZE
+
+META_FILE_NAME = 'meta.json'
+# Tick value of missing levels, decoded as NaN
+MISSING_TICK = np.iinfo(np.int32).min
+COLUMN_DTYPES = {'timestamps': np.int64,
+                 'bid_ticks': np.int32,
+                 'bid_sizes': np.float32,
+                 'ask_ticks': np.int32,
+                 'ask_sizes': np.float32}
+
+
+class TickDecodedPrices:
+    """
+    Read-only (snapshots x levels) price matrix decoded from tick counts on indexing, so slices of a memory-mapped
+    store can be passed to computeOrderBookMetrics without decoding the whole file
+    """
+
+    def __init__(self, ticks, tick_size):
+        self.ticks = ticks
+        self.tick_size = tick_size
+        self.shape = ticks.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        ticks = self.ticks[key]
+        prices = ticks * self.tick_size
+        return np.where(ticks == MISSING_TICK, np.nan, prices) if np.ndim(prices) > 0 else \
+            (np.nan if ticks == MISSING_TICK else prices)
+
+
+class OrderBookSnapshotStore:
+    """
+    Append-only on-disk store of fixed depth L2 snapshots, one directory holding raw little-endian column files:
+        timestamps: int64 nanoseconds, ascending
+        bid_ticks, ask_ticks: int32 (snapshots x n_levels) prices in number of tick_size, exact and 4 bytes per level
+        bid_sizes, ask_sizes: float32 (snapshots x n_levels), NaN for missing levels
+    Columns are read back as memory maps, and meta.json holds the snapshot count, so bytes of an interrupted append
+    are never read.
+    :param n_levels: depth stored, deeper levels are dropped and shallower books padded. Only needed on creation.
+    :param tick_size: price increment of the instrument. Only needed on creation.
+    """
+
+    def __init__(self, path, n_levels=None, tick_size=None):
+        self.path = path
+        meta_path = os.path.join(path, META_FILE_NAME)
+        if os_util.fileExists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            if n_levels is None or tick_size is None:
+                raise ValueError(f"No snapshot store at {path}, n_levels and tick_size are needed to create one")
+            os.makedirs(path, exist_ok=True)
+            self.meta = {'n_levels': n_levels, 'tick_size': tick_size, 'n_snapshots': 0}
+            self._saveMeta()
+        self.n_levels = self.meta['n_levels']
+        self.tick_size = self.meta['tick_size']
+        self._columns = None
+
+    def __len__(self):
+        return self.meta['n_snapshots']
+
+    def _saveMeta(self):
+        meta_path = os.path.join(self.path, META_FILE_NAME)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _getColumnPath(self, column):
+        return os.path.join(self.path, f"{column}.bin")
+
+    def _fitDepth(self, levels, fill_value):
+        levels = np.asarray(levels)[:, :self.n_levels]
+        if levels.shape[1] < self.n_levels:
+            padding = np.full((levels.shape[0], self.n_levels - levels.shape[1]), fill_value, dtype=levels.dtype)
+            levels = np.concatenate([levels, padding], axis=1)
+        return levels
+
+    def encodePrices(self, prices):
+        prices = self._fitDepth(np.asarray(prices, dtype=float), np.nan)
+        ticks = np.rint(prices / self.tick_size)
+        missing = np.isnan(ticks)
+        if np.any(np.abs(ticks[~missing]) >= np.iinfo(np.int32).max):
+            raise ValueError(f"Prices do not fit in int32 ticks of {self.tick_size}")
+        return np.where(missing, MISSING_TICK, ticks).astype(np.int32)
+
+    def append(self, timestamps, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        """
+        Append snapshots, (snapshots x levels) arrays best level first with NaN for missing levels
+        :param timestamps: datetime-like or nanosecond values, not older than the last stored snapshot
+        """
+        timestamps = pd.to_datetime(timestamps).values.astype('datetime64[ns]').astype(np.int64)
+        if len(timestamps) == 0:
+            return
+        last_timestamp = self._getColumns()['timestamps'][-1] if len(self) > 0 else timestamps[0]
+        if np.any(np.diff(timestamps) < 0) or timestamps[0] < last_timestamp:
+            raise ValueError("Snapshots have to be appended in timestamp order")
+        columns = {'timestamps': timestamps,
+                   'bid_ticks': self.encodePrices(bid_prices),
+                   'bid_sizes': self._fitDepth(np.asarray(bid_sizes, dtype=np.float32), np.nan),
+                   'ask_ticks': self.encodePrices(ask_prices),
+                   'ask_sizes': self._fitDepth(np.asarray(ask_sizes, dtype=np.float32), np.nan)}
+        for column, values in columns.items():
+            column_path = self._getColumnPath(column)
+            with open(column_path, 'r+b' if os_util.fileExists(column_path) else 'wb') as f:
+                # Overwrite anything past the committed count, left over by an interrupted append
+                f.seek(len(self) * self._getRowBytes(column))
+                f.write(np.ascontiguousarray(values, dtype=np.dtype(COLUMN_DTYPES[column]).newbyteorder('<')).tobytes())
+                f.truncate()
+        self.meta['n_snapshots'] += len(timestamps)
+        self._saveMeta()
+        self._columns = None
+
+    def appendFrame(self, snapshots_df, timestamp_column='timestamp'):
+        """
+        Append a frame of flattened snapshots ('bid_price_0', 'bid_amount_0', 'ask_price_0', ...)
+        """
+        self.append(snapshots_df[timestamp_column], *getSnapshotArrays(snapshots_df, self.n_levels))
+
+    def _getRowBytes(self, column):
+        return np.dtype(COLUMN_DTYPES[column]).itemsize * (1 if column == 'timestamps' else self.n_levels)
+
+    def _getColumns(self):
+        if self._columns is None:
+            self._columns = {}
+            for column, dtype in COLUMN_DTYPES.items():
+                shape = (len(self),) if column == 'timestamps' else (len(self), self.n_levels)
+                self._columns[column] = np.memmap(self._getColumnPath(column), mode='r',
+                                                  dtype=np.dtype(dtype).newbyteorder('<'), shape=shape) \
+                    if len(self) > 0 else np.empty(shape, dtype=dtype)
+        return self._columns
+
+    def getTimestamps(self):
+        return self._getColumns()['timestamps'].view('datetime64[ns]')
+
+    def getSlice(self, start_time=None, end_time=None):
+        """
+        Row slice of the snapshots in [start_time, end_time)
+        """
+        timestamps = self._getColumns()['timestamps']
+        start = np.searchsorted(timestamps, pd.Timestamp(start_time).value) if start_time is not None else 0
+        end = np.searchsorted(timestamps, pd.Timestamp(end_time).value) if end_time is not None else len(self)
+        return slice(start, end)
+
+    def getArrays(self, start_time=None, end_time=None):
+        """
+        :return: tuple (timestamps, bid_prices, bid_sizes, ask_prices, ask_sizes) of [start_time, end_time).
+        Timestamps and sizes are views of the memory maps, prices are TickDecodedPrices decoded when indexed.
+        """
+        rows = self.getSlice(start_time, end_time)
+        columns = self._getColumns()
+        return (columns['timestamps'][rows].view('datetime64[ns]'),
+                TickDecodedPrices(columns['bid_ticks'][rows], self.tick_size),
+                columns['bid_sizes'][rows],
+                TickDecodedPrices(columns['ask_ticks'][rows], self.tick_size),
+                columns['ask_sizes'][rows])
+
+    def replay(self, reconstructor, start_time=None, end_time=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Feed the snapshots of [start_time, end_time) to an OrderBookReconstructor one at a time
+        :return: generator of (timestamp, reconstructor), the reconstructor being updated in place
+        """
+        timestamps, bid_prices, bid_sizes, ask_prices, ask_sizes = self.getArrays(start_time, end_time)
+        for chunk_start in range(0, len(timestamps), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            chunk_bid_prices, chunk_ask_prices = bid_prices[chunk], ask_prices[chunk]
+            chunk_bid_sizes, chunk_ask_sizes = bid_sizes[chunk], ask_sizes[chunk]
+            n_bids = (~np.isnan(chunk_bid_prices)).sum(axis=1)
+            n_asks = (~np.isnan(chunk_ask_prices)).sum(axis=1)
+            for i, timestamp in enumerate(timestamps[chunk]):
+                reconstructor.updateArrays(chunk_bid_prices[i, :n_bids[i]], chunk_bid_sizes[i, :n_bids[i]],
+                                           chunk_ask_prices[i, :n_asks[i]], chunk_ask_sizes[i, :n_asks[i]])
+                yield timestamp, reconstructor
+
+    def computeMetrics(self,
+                       orderbook_depth_perc,
+                       vw_sizes_usd=(),
+                       start_time=None,
+                       end_time=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        computeOrderBookMetrics of the snapshots of [start_time, end_time), indexed by timestamp
+        """
+        timestamps, *levels = self.getArrays(start_time, end_time)
+        metrics = computeOrderBookMetrics(*levels, orderbook_depth_perc, vw_sizes_usd=vw_sizes_usd,
+                                          chunk_size=chunk_size)
+        metrics.index = pd.DatetimeIndex(np.asarray(timestamps), name='timestamp')
+        return metrics
@@ -1,18 +1,152 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+from operator import itemgetter
+
 import numpy as np
+import pandas as pd
+
+DEFAULT_CAPACITY = 64
+DEFAULT_CHUNK_SIZE = 100000
+
+
+@lru_cache(maxsize=None)
+def getLevelGetters(side, n_levels):
+    """
+    Getters of the price and amount keys ('ask_price_0', 'ask_amount_0', ...) of an order book dict, built once
+    per side and number of levels
+    """
+    price_keys = [f"{side}_price_{i}" for i in range(n_levels)]
+    amount_keys = [f"{side}_amount_{i}" for i in range(n_levels)]
+    if n_levels == 1:
+        return (lambda d: (d[price_keys[0]],)), (lambda d: (d[amount_keys[0]],))
+    return itemgetter(*price_keys), itemgetter(*amount_keys)
+
+
+def getSnapshotArrays(snapshots_df, n_levels):
+    """
+    (snapshots x levels) price and size matrices of a frame of flattened snapshots ('bid_price_0', 'bid_amount_0',
+    'ask_price_0', ...), missing levels being NaN
+    :return: tuple (bid_prices, bid_sizes, ask_prices, ask_sizes)
+    """
+    arrays = []
+    for side in ['bid', 'ask']:
+        for field in ['price', 'amount']:
+            columns = [f"{side}_{field}_{i}" for i in range(n_levels)]
+            arrays.append(snapshots_df.reindex(columns=columns).to_numpy(dtype=float))
+    return tuple(arrays)
+
+
+def _getSideMask(prices, price_thresholds, direction):
+    """
+    Levels kept by OrderBookReconstructor: up to and including the first one beyond the threshold, NaN levels excluded
+    """
+    beyond = direction * prices > direction * price_thresholds[:, None]
+    first_beyond = np.where(beyond.any(axis=1), beyond.argmax(axis=1), prices.shape[1] - 1)
+    return (np.arange(prices.shape[1]) <= first_beyond[:, None]) & ~np.isnan(prices)
+
+
+def _getBatchVwaps(prices, cum_sizes, cum_notionals, sizes, is_executable):
+    """
+    Vectorized OrderBookReconstructor._getVwap, one size per snapshot
+    """
+    totals = cum_sizes[:, -1]
+    last_levels = np.minimum((cum_sizes < sizes[:, None]).sum(axis=1), prices.shape[1] - 1)[:, None]
+    previous_levels = np.maximum(last_levels - 1, 0)
+    has_previous = last_levels > 0
+    filled_sizes = np.where(has_previous, np.take_along_axis(cum_sizes, previous_levels, axis=1), 0.0)[:, 0]
+    filled_notionals = np.where(has_previous, np.take_along_axis(cum_notionals, previous_levels, axis=1), 0.0)[:, 0]
+    last_prices = np.take_along_axis(prices, last_levels, axis=1)[:, 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwaps = (filled_notionals + last_prices * (sizes - filled_sizes)) / sizes
+        not_executable = cum_notionals[:, -1] / totals
+    return np.where(sizes > totals, np.nan if is_executable else not_executable, vwaps)
+
+
+def computeOrderBookMetrics(bid_prices,
+                            bid_sizes,
+                            ask_prices,
+                            ask_sizes,
+                            orderbook_depth_perc,
+                            vw_sizes_usd=(),
+                            chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    OrderBookReconstructor metrics of many snapshots at once, with the same depth truncation
+    :param bid_prices: (snapshots x levels) array, best level first, NaN for missing levels. Can be a np.memmap,
+    only chunk_size rows are loaded at a time.
+    :param vw_sizes_usd: sizes of the bid/ask executable VWAP and volume weighted spread columns
+    :return: DataFrame with one row per snapshot: mid, tob_spread_absolute, tob_spread_bps, total_bid_size,
+    total_ask_size, bid_dispersion, ask_dispersion and bid_vwap_{size}, ask_vwap_{size}, vw_spread_bps_{size}
+    """
+    n_snapshots = bid_prices.shape[0]
+    columns = ['mid', 'tob_spread_absolute', 'tob_spread_bps', 'total_bid_size', 'total_ask_size', 'bid_dispersion',
+               'ask_dispersion']
+    for size_usd in vw_sizes_usd:
+        columns += [f"bid_vwap_{size_usd}", f"ask_vwap_{size_usd}", f"vw_spread_bps_{size_usd}"]
+    metrics = {column: np.empty(n_snapshots) for column in columns}
+
+    for start in range(0, n_snapshots, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n_snapshots))
+        chunk_metrics = {}
+        best_bids, best_asks = np.asarray(bid_prices[chunk, 0], dtype=float), np.asarray(ask_prices[chunk, 0],
+                                                                                        dtype=float)
+        mids = 0.5 * (best_bids + best_asks)
+        chunk_metrics['mid'] = mids
+        chunk_metrics['tob_spread_absolute'] = np.where((best_bids != 0) & (best_asks != 0), best_asks - best_bids,
+                                                        np.nan)
+        chunk_metrics['tob_spread_bps'] = chunk_metrics['tob_spread_absolute'] / mids * 10000.0
+
+        sides = {}
+        for side, prices, sizes, direction in [('bid', bid_prices, bid_sizes, -1), ('ask', ask_prices, ask_sizes, 1)]:
+            prices = np.asarray(prices[chunk], dtype=float)
+            mask = _getSideMask(prices, mids * (1 + direction * orderbook_depth_perc / 100), direction)
+            sizes = np.where(mask, np.asarray(sizes[chunk], dtype=float), 0.0)
+            prices = np.where(mask, prices, 0.0)
+            cum_sizes = np.cumsum(sizes, axis=1)
+            cum_notionals = np.cumsum(prices * sizes, axis=1)
+            totals = cum_sizes[:, -1]
+            n_levels = mask.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                deviations = np.where(mask, sizes / totals[:, None] - 1 / n_levels[:, None], 0.0)
+                chunk_metrics[f"{side}_dispersion"] = np.sqrt((deviations ** 2).sum(axis=1) / n_levels)
+            chunk_metrics[f"total_{side}_size"] = totals
+            sides[side] = (prices, cum_sizes, cum_notionals)
+
+        for size_usd in vw_sizes_usd:
+            for side in ['bid', 'ask']:
+                chunk_metrics[f"{side}_vwap_{size_usd}"] = _getBatchVwaps(*sides[side], size_usd / mids, True)
+            chunk_metrics[f"vw_spread_bps_{size_usd}"] = (chunk_metrics[f"ask_vwap_{size_usd}"] -
+                                                          chunk_metrics[f"bid_vwap_{size_usd}"]) / mids * 10000.0
+        for column in columns:
+            metrics[column][chunk] = chunk_metrics[column]
+    return pd.DataFrame(metrics, columns=columns)
 
 
 class OrderBookReconstructor:
+    """
+    Top of book, spread, VWAP and depth metrics of an L2 snapshot.
+    Levels are kept in fixed capacity arrays reused across updates, with cumulative sizes and notionals so VWAP and
+    depth queries are searchsorted lookups. bid_prices, bid_sizes, ask_prices and ask_sizes are views of these
+    arrays, valid until the next update.
+    """
 
-    def __init__(self, orderbook_depth_perc):
+    def __init__(self, orderbook_depth_perc, capacity=DEFAULT_CAPACITY):
 
-        self.mid = np.float('nan')
-        self.tob_spread_absolute = np.float('nan')
-        self.tob_spread_bps = np.float('nan')
-        self.total_bid_size = np.float('nan')
-        self.total_ask_size = np.float('nan')
-        self.bid_price = np.float('nan')
-        self.ask_price = np.float('nan')
+        self.mid = np.nan
+        self.tob_spread_absolute = np.nan
+        self.tob_spread_bps = np.nan
+        self.total_bid_size = np.nan
+        self.total_ask_size = np.nan
+        self.bid_price = np.nan
+        self.ask_price = np.nan
         self.orderbook_depth_perc = orderbook_depth_perc
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        # Rows: prices, sizes, cumulative sizes, cumulative notionals
+        self._bids = np.zeros((4, capacity))
+        self._asks = np.zeros((4, capacity))
 
     def update(self, asks_dict, bids_dict):
 
@@ -23,99 +157,158 @@ class OrderBookReconstructor:
         self.computeSpreadAbs()
         self.computeSpreadBps()
 
+    def updateArrays(self, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        """
+        Update from price and size arrays, best level first, e.g. rows of a snapshot matrix.
+        The depth truncation of update is applied, the inputs are only read.
+        """
+        self._setLevels(bid_prices, bid_sizes, ask_prices, ask_sizes)
+        self.computeMid()
+        self.computeSpreadAbs()
+        self.computeSpreadBps()
+
     def _convertDictToNumpy(self):
 
-        self.bid_prices = np.array([])
-        self.bid_sizes = np.array([])
-        self.ask_prices = np.array([])
-        self.ask_sizes = np.array([])
-        mid = (self.asks_dict[f"ask_price_{0}"]+self.bids_dict[f"bid_price_{0}"])/2
-
-        for i in range(int(len(self.asks_dict.keys()) / 2)):
-            self.ask_prices = np.append(self.ask_prices, self.asks_dict[f"ask_price_{i}"])
-            self.ask_sizes = np.append(self.ask_sizes, self.asks_dict[f"ask_amount_{i}"])
-            if self.asks_dict[f"ask_price_{i}"] > mid*(1+self.orderbook_depth_perc/100):
-                #print(f"Stopped at {i} ask levels")
-                break
-        for i in range(int(len(self.bids_dict.keys()) / 2)):
-            self.bid_prices = np.append(self.bid_prices, self.bids_dict[f"bid_price_{i}"])
-            self.bid_sizes = np.append(self.bid_sizes, self.bids_dict[f"bid_amount_{i}"])
-            if self.bids_dict[f"bid_price_{i}"] < mid*(1-self.orderbook_depth_perc/100):
-                #print(f"Stopped at {i} bid levels")
-                break
+        n_ask_levels = int(len(self.asks_dict.keys()) / 2)
+        n_bid_levels = int(len(self.bids_dict.keys()) / 2)
+        ask_price_getter, ask_amount_getter = getLevelGetters('ask', n_ask_levels)
+        bid_price_getter, bid_amount_getter = getLevelGetters('bid', n_bid_levels)
+        self._setLevels(bid_price_getter(self.bids_dict), bid_amount_getter(self.bids_dict),
+                        ask_price_getter(self.asks_dict), ask_amount_getter(self.asks_dict))
+
+    def _setLevels(self, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        n_levels = max(len(bid_prices), len(ask_prices))
+        if n_levels > self.capacity:
+            self._allocate(max(n_levels, 2 * self.capacity))
+        mid = (ask_prices[0] + bid_prices[0]) / 2
+
+        # Levels are kept up to and including the first one beyond orderbook_depth_perc from the mid
+        n_asks = self._setSide(self._asks, ask_prices, ask_sizes, mid * (1 + self.orderbook_depth_perc / 100), 1)
+        n_bids = self._setSide(self._bids, bid_prices, bid_sizes, mid * (1 - self.orderbook_depth_perc / 100), -1)
+        self.ask_prices, self.ask_sizes = self._asks[0, :n_asks], self._asks[1, :n_asks]
+        self.bid_prices, self.bid_sizes = self._bids[0, :n_bids], self._bids[1, :n_bids]
+        self.ask_cum_sizes, self.ask_cum_notionals = self._asks[2, :n_asks], self._asks[3, :n_asks]
+        self.bid_cum_sizes, self.bid_cum_notionals = self._bids[2, :n_bids], self._bids[3, :n_bids]
 
         # total bid & ask sizes
-        self.total_bid_size = np.sum(self.bid_sizes)
-        self.total_ask_size = np.sum(self.ask_sizes)
+        self.total_bid_size = self.bid_cum_sizes[-1]
+        self.total_ask_size = self.ask_cum_sizes[-1]
         self.bid_price = self.bid_prices[0]
         self.ask_price = self.ask_prices[0]
 
+    @staticmethod
+    def _setSide(levels, prices, sizes, price_threshold, direction):
+        n = len(prices)
+        levels[0, :n] = prices
+        levels[1, :n] = sizes
+        beyond = np.flatnonzero(direction * levels[0, :n] > direction * price_threshold)
+        n = beyond[0] + 1 if len(beyond) > 0 else n
+        np.cumsum(levels[1, :n], out=levels[2, :n])
+        np.multiply(levels[0, :n], levels[1, :n], out=levels[3, :n])
+        np.cumsum(levels[3, :n], out=levels[3, :n])
+        return n
 
     def computeMid(self):
         # We only compute if it doesn't already exist
         if (not np.isnan(self.bid_price)) and (not np.isnan(self.ask_price)):
             self.mid = 0.5 * (self.bid_price + self.ask_price)
         else:
-            self.mid = np.float('nan')
+            self.mid = np.nan
 
     def computeSpreadAbs(self):
         if (self.bid_prices[0] != 0.0) and (self.ask_prices[0] != 0.0):
             self.tob_spread_absolute = self.ask_prices[0] - self.bid_prices[0]
         else:
-            self.tob_spread_absolute = np.float('nan')
+            self.tob_spread_absolute = np.nan
 
     def computeSpreadBps(self):
         self.computeSpreadAbs()
         if np.isnan(self.mid):
-            self.tob_spread_bps = np.float('nan')
+            self.tob_spread_bps = np.nan
         else:
-            self.tob_spread_bps = self.tob_spread_absolute / self.mid * np.float(10000)
+            self.tob_spread_bps = self.tob_spread_absolute / self.mid * 10000.0
 
     def getVWSpreadAbs(self, size_usd):
-        size_btc = size_usd / self.mid
-        bid_vwap = self.getBidVwap(size_btc, True)
-        ask_vwap = self.getAskVwap(size_btc, True)
+        bid_vwap = self.getBidVwap(size_usd, True)
+        ask_vwap = self.getAskVwap(size_usd, True)
         return ask_vwap - bid_vwap
 
     def getVWSpreadBps(self, size_usd):
-        size_btc = size_usd / self.mid
-        vw_spread = self.getVWSpreadAbs(size_btc)
-        return vw_spread / self.mid * np.float(10000.0)
+        vw_spread = self.getVWSpreadAbs(size_usd)
+        return vw_spread / self.mid * 10000.0
+
+    @staticmethod
+    def _getVwap(prices, cum_sizes, cum_notionals, size, is_executable):
+        """
+        Average price of filling size through the levels, the last level touched being partially filled
+        """
+        if size <= 0:
+            raise ZeroDivisionError("Weights sum to zero, can't be normalized")
+        if size > cum_sizes[-1]:
+            return np.nan if is_executable else cum_notionals[-1] / cum_sizes[-1]
+        last_level = np.searchsorted(cum_sizes, size)
+        filled_size = cum_sizes[last_level - 1] if last_level > 0 else 0.0
+        filled_notional = cum_notionals[last_level - 1] if last_level > 0 else 0.0
+        return (filled_notional + prices[last_level] * (size - filled_size)) / size
 
     def getBidVwap(self, size_usd, is_executable=False):
-        cum_size = np.float(0.0)
-        int_sizes = np.array([])
-        size_btc = size_usd / self.mid
-
-        for i in range(len(self.bid_sizes)):
-            if (self.bid_sizes[i] + cum_size) < size_btc:
-                int_sizes = np.append(int_sizes, self.bid_sizes[i])
-                cum_size += self.bid_sizes[i]
-            else:
-                int_sizes = np.append(int_sizes, size_btc - cum_size)
-                cum_size += size_btc - cum_size
-
-        if is_executable and (cum_size < size_btc):
-            return np.float('nan')
-        else:
-            return np.average(self.bid_prices, weights=int_sizes)
+        return self._getVwap(self.bid_prices, self.bid_cum_sizes, self.bid_cum_notionals, size_usd / self.mid,
+                             is_executable)
 
     def getAskVwap(self, size_usd, is_executable=False):
-        cum_size = np.float(0.0)
-        int_sizes = np.array([])
-        size_btc = size_usd / self.mid
-        for i in range(len(self.ask_sizes)):
-            if (self.ask_sizes[i] + cum_size) < size_btc:
-                int_sizes = np.append(int_sizes, self.ask_sizes[i])
-                cum_size += self.ask_sizes[i]
-            else:
-                int_sizes = np.append(int_sizes, size_btc - cum_size)
-                cum_size += size_btc - cum_size
-
-        if is_executable and (cum_size < size_btc):
-            return np.float('nan')
-        else:
-            return np.average(self.ask_prices, weights=int_sizes)
+        return self._getVwap(self.ask_prices, self.ask_cum_sizes, self.ask_cum_notionals, size_usd / self.mid,
+                             is_executable)
+
+    @staticmethod
+    def _getVwaps(prices, cum_sizes, cum_notionals, sizes):
+        """
+        Vectorized _getVwap over sorted or unsorted sizes
+        :return: tuple (vwaps, is_executable), vwaps of non executable sizes being the average price of the whole side
+        """
+        is_executable = sizes <= cum_sizes[-1]
+        last_levels = np.minimum(np.searchsorted(cum_sizes, sizes), len(cum_sizes) - 1)
+        filled_sizes = np.where(last_levels > 0, cum_sizes[last_levels - 1], 0.0)
+        filled_notionals = np.where(last_levels > 0, cum_notionals[last_levels - 1], 0.0)
+        vwaps = np.where(is_executable,
+                         (filled_notionals + prices[last_levels] * (sizes - filled_sizes)) / sizes,
+                         cum_notionals[-1] / cum_sizes[-1])
+        return vwaps, is_executable
+
+    def getVwapCurve(self, sizes_usd):
+        """
+        Bid and ask VWAPs of many notional sizes from the cumulative depth computed on update
+        :param sizes_usd: array of sizes in quote currency
+        :return: dict of arrays aligned with sizes_usd: bid_vwap, ask_vwap, vw_mid, bid_executable, ask_executable,
+        vw_spread_bps (NaN if a side is not executable) and bid/ask_impact_bps, the VWAP distance to the mid
+        """
+        sizes_usd = np.asarray(sizes_usd, dtype=float)
+        sizes = sizes_usd / self.mid
+        bid_vwaps, bid_executable = self._getVwaps(self.bid_prices, self.bid_cum_sizes, self.bid_cum_notionals, sizes)
+        ask_vwaps, ask_executable = self._getVwaps(self.ask_prices, self.ask_cum_sizes, self.ask_cum_notionals, sizes)
+        return {'size_usd': sizes_usd,
+                'bid_vwap': bid_vwaps,
+                'ask_vwap': ask_vwaps,
+                'vw_mid': 0.5 * (bid_vwaps + ask_vwaps),
+                'bid_executable': bid_executable,
+                'ask_executable': ask_executable,
+                'vw_spread_bps': np.where(bid_executable & ask_executable, ask_vwaps - bid_vwaps, np.nan) /
+                                 self.mid * 10000.0,
+                'bid_impact_bps': (self.mid - bid_vwaps) / self.mid * 10000.0,
+                'ask_impact_bps': (ask_vwaps - self.mid) / self.mid * 10000.0}
+
+    def getBidDepth(self, depth_bps):
+        """
+        Bid size executable without selling below depth_bps under the mid
+        """
+        n_levels = np.searchsorted(-self.bid_prices, -self.mid * (1 - depth_bps / 10000), side='right')
+        return self.bid_cum_sizes[n_levels - 1] if n_levels > 0 else 0.0
+
+    def getAskDepth(self, depth_bps):
+        """
+        Ask size executable without buying above depth_bps over the mid
+        """
+        n_levels = np.searchsorted(self.ask_prices, self.mid * (1 + depth_bps / 10000), side='right')
+        return self.ask_cum_sizes[n_levels - 1] if n_levels > 0 else 0.0
 
     def getTotalVolume(self):
         return self.total_ask_size + self.total_bid_size
@@ -131,3 +324,294 @@ class OrderBookReconstructor:
         bid_vwap = self.getBidVwap(size_usd, False)
         ask_vwap = self.getAskVwap(size_usd, False)
         return ((bid_vwap * size_usd) + (ask_vwap * size_usd)) / (size_usd * 2.0)
+
+
+class IncrementalOrderBook:
+    """
+    L2 book maintained from level updates (price, size), a size of 0 deleting the level.
+    Each side is a price -> size dict plus a sorted price list (bids stored negated so both lists are ascending from
+    the best level). A size change of an existing level is a dict write, adding or removing a level is a bisect plus
+    an O(n) list insert or delete, a memmove that stays cheap for books of a few thousand levels. Best prices and
+    totals are O(1), and top N or depth reads only walk the levels they return.
+    """
+
+    def __init__(self, orderbook_depth_perc=None):
+        self.orderbook_depth_perc = orderbook_depth_perc
+        self.bids = {}
+        self.asks = {}
+        self._bid_keys = []
+        self._ask_keys = []
+        self.total_bid_size = 0.0
+        self.total_ask_size = 0.0
+        self.sequence = None
+        self.n_updates = 0
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._bid_keys.clear()
+        self._ask_keys.clear()
+        self.total_bid_size = 0.0
+        self.total_ask_size = 0.0
+
+    def applySnapshot(self, bids, asks, sequence=None):
+        """
+        Replace the book with full sides, lists of (price, size) in any order
+        """
+        self.clear()
+        self.bids.update((price, size) for price, size in bids if size > 0)
+        self.asks.update((price, size) for price, size in asks if size > 0)
+        self._bid_keys[:] = sorted(-price for price in self.bids)
+        self._ask_keys[:] = sorted(self.asks)
+        # Totals are recomputed from scratch on every snapshot, which also resets any float drift of the deltas
+        self.total_bid_size = sum(self.bids.values())
+        self.total_ask_size = sum(self.asks.values())
+        self.sequence = sequence
+        self.n_updates += 1
+
+    def applyDeltas(self, bids, asks, sequence=None):
+        """
+        Apply level updates, lists of (price, size). Updates with a sequence not newer than the book are ignored.
+        :return: False if the update was ignored
+        """
+        if sequence is not None and self.sequence is not None and sequence <= self.sequence:
+            return False
+        for price, size in bids:
+            self.total_bid_size += self._setLevel(self.bids, self._bid_keys, price, -price, size)
+        for price, size in asks:
+            self.total_ask_size += self._setLevel(self.asks, self._ask_keys, price, price, size)
+        if sequence is not None:
+            self.sequence = sequence
+        self.n_updates += 1
+        return True
+
+    def updateLevel(self, side, price, size):
+        if side == 'bid':
+            self.total_bid_size += self._setLevel(self.bids, self._bid_keys, price, -price, size)
+        else:
+            self.total_ask_size += self._setLevel(self.asks, self._ask_keys, price, price, size)
+
+    @staticmethod
+    def _setLevel(levels, keys, price, key, size):
+        """
+        :return: change of the side total size
+        """
+        previous_size = levels.get(price)
+        if size > 0:
+            levels[price] = size
+            if previous_size is None:
+                insort(keys, key)
+                return size
+            return size - previous_size
+        if previous_size is not None:
+            del levels[price]
+            del keys[bisect_left(keys, key)]
+            return -previous_size
+        return 0.0
+
+    @property
+    def bid_price(self):
+        return -self._bid_keys[0] if len(self._bid_keys) > 0 else np.nan
+
+    @property
+    def ask_price(self):
+        return self._ask_keys[0] if len(self._ask_keys) > 0 else np.nan
+
+    def getMid(self):
+        return 0.5 * (self.bid_price + self.ask_price)
+
+    def getSpreadAbs(self):
+        return self.ask_price - self.bid_price
+
+    def getSpreadBps(self):
+        return self.getSpreadAbs() / self.getMid() * 10000.0
+
+    def isCrossed(self):
+        return self.bid_price >= self.ask_price
+
+    def getTopLevels(self, n_levels):
+        """
+        :return: tuple of arrays (bid_prices, bid_sizes, ask_prices, ask_sizes) of the n best levels, best first
+        """
+        bid_prices = np.array([-key for key in self._bid_keys[:n_levels]])
+        ask_prices = np.array(self._ask_keys[:n_levels])
+        bid_sizes = np.array([self.bids[price] for price in bid_prices])
+        ask_sizes = np.array([self.asks[price] for price in ask_prices])
+        return bid_prices, bid_sizes, ask_prices, ask_sizes
+
+    def getDepth(self, depth_perc=None):
+        """
+        Bid and ask sizes within depth_perc (defaults to orderbook_depth_perc) of the mid, only walking those levels
+        :return: tuple (bid_size, ask_size)
+        """
+        depth_perc = depth_perc if depth_perc is not None else self.orderbook_depth_perc
+        if depth_perc is None:
+            raise ValueError("depth_perc has to be given when the book has no orderbook_depth_perc")
+        mid = self.getMid()
+        n_bids = bisect_right(self._bid_keys, -mid * (1 - depth_perc / 100))
+        n_asks = bisect_right(self._ask_keys, mid * (1 + depth_perc / 100))
+        return (sum(self.bids[-key] for key in self._bid_keys[:n_bids]),
+                sum(self.asks[key] for key in self._ask_keys[:n_asks]))
+
+    def toReconstructor(self, reconstructor, n_levels):
+        """
+        Feed the n best levels to an OrderBookReconstructor for its VWAP and spread metrics
+        """
+        reconstructor.updateArrays(*self.getTopLevels(n_levels))
+        return reconstructor
+
+
+class ConsolidatedOrderBook:
+    """
+    Bid and ask ladders of several venues merged into one book with venue attribution of every level, e.g. one
+    OrderBookReconstructor per exchange of a CCXTAggregator.
+    Venue updates are only recorded, the merge happens on the next query: a k-way heap merge of all ladders when
+    several venues changed, or when a single one did, removing its previous levels and inserting its new ones into the
+    merged arrays.
+    """
+
+    def __init__(self):
+        self.venues = []
+        self.ladders = {}
+        self._dirty_venues = set()
+        self._sides = {'bid': None, 'ask': None}
+
+    def updateVenue(self, venue, reconstructor):
+        """
+        Set the levels of a venue from its OrderBookReconstructor, the levels are copied
+        """
+        self.updateVenueArrays(venue, reconstructor.bid_prices, reconstructor.bid_sizes,
+                               reconstructor.ask_prices, reconstructor.ask_sizes)
+
+    def updateVenueArrays(self, venue, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        if venue not in self.ladders:
+            self.venues.append(venue)
+        self.ladders[venue] = {'bid': (np.array(bid_prices, dtype=float), np.array(bid_sizes, dtype=float)),
+                               'ask': (np.array(ask_prices, dtype=float), np.array(ask_sizes, dtype=float))}
+        self._dirty_venues.add(venue)
+
+    def removeVenue(self, venue):
+        if venue in self.ladders:
+            del self.ladders[venue]
+            self.venues.remove(venue)
+            # Venue indices shift, so the next query rebuilds the whole book
+            self._dirty_venues.update(self.venues)
+            self._sides = {'bid': None, 'ask': None}
+
+    def _refresh(self):
+        if len(self._dirty_venues) == 0:
+            return
+        if len(self._dirty_venues) == 1 and self._sides['bid'] is not None:
+            venue = self._dirty_venues.pop()
+            for side in ['bid', 'ask']:
+                self._sides[side] = self._replaceVenue(side, venue)
+        else:
+            for side in ['bid', 'ask']:
+                self._sides[side] = self._merge(side)
+        self._dirty_venues.clear()
+
+    def _merge(self, side):
+        """
+        k-way merge of the venue ladders, each already sorted best level first
+        """
+        direction = -1 if side == 'bid' else 1
+        ladders = [[(direction * price, venue_index, size) for price, size in zip(*self.ladders[venue][side])]
+                   for venue_index, venue in enumerate(self.venues)]
+        merged = list(heapq.merge(*ladders))
+        keys = np.array([level[0] for level in merged], dtype=float)
+        venue_indices = np.array([level[1] for level in merged], dtype=int)
+        sizes = np.array([level[2] for level in merged], dtype=float)
+        return self._makeSide(keys, sizes, venue_indices, direction)
+
+    def _replaceVenue(self, side, venue):
+        """
+        Merged side with the levels of one venue replaced, the other venues keeping their merged order
+        """
+        direction = -1 if side == 'bid' else 1
+        venue_index = self.venues.index(venue)
+        current = self._sides[side]
+        kept = current['venue_indices'] != venue_index
+        keys, sizes, venue_indices = current['keys'][kept], current['sizes'][kept], current['venue_indices'][kept]
+        new_prices, new_sizes = self.ladders[venue][side]
+        positions = np.searchsorted(keys, direction * new_prices, side='right')
+        return self._makeSide(np.insert(keys, positions, direction * new_prices),
+                              np.insert(sizes, positions, new_sizes),
+                              np.insert(venue_indices, positions, venue_index),
+                              direction)
+
+    @staticmethod
+    def _makeSide(keys, sizes, venue_indices, direction):
+        prices = direction * keys
+        return {'keys': keys,
+                'prices': prices,
+                'sizes': sizes,
+                'venue_indices': venue_indices,
+                'cum_sizes': np.cumsum(sizes),
+                'cum_notionals': np.cumsum(prices * sizes)}
+
+    def getSide(self, side):
+        """
+        :return: dict of arrays prices, sizes, venue_indices (index in venues), cum_sizes and cum_notionals, best first
+        """
+        self._refresh()
+        return self._sides[side]
+
+    @property
+    def bid_price(self):
+        prices = self.getSide('bid')['prices']
+        return prices[0] if len(prices) > 0 else np.nan
+
+    @property
+    def ask_price(self):
+        prices = self.getSide('ask')['prices']
+        return prices[0] if len(prices) > 0 else np.nan
+
+    def getMid(self):
+        return 0.5 * (self.bid_price + self.ask_price)
+
+    def getLevels(self, side, n_levels=None):
+        """
+        :return: list of (price, size, venue) of the n best levels
+        """
+        levels = self.getSide(side)
+        return [(float(price), float(size), self.venues[venue_index]) for price, size, venue_index in
+                zip(levels['prices'][:n_levels], levels['sizes'][:n_levels], levels['venue_indices'][:n_levels])]
+
+    def _getFill(self, side, size_usd):
+        levels = self.getSide(side)
+        size = size_usd / self.getMid()
+        last_level = np.searchsorted(levels['cum_sizes'], size)
+        fills = levels['sizes'][:last_level + 1].copy()
+        if last_level < len(fills):
+            fills[last_level] = size - (levels['cum_sizes'][last_level - 1] if last_level > 0 else 0.0)
+        return levels, size, fills
+
+    def getVwap(self, side, size_usd, is_executable=False):
+        """
+        VWAP of sweeping the consolidated side for a notional size, with OrderBookReconstructor semantics
+        """
+        levels = self.getSide(side)
+        return OrderBookReconstructor._getVwap(levels['prices'], levels['cum_sizes'], levels['cum_notionals'],
+                                               size_usd / self.getMid(), is_executable)
+
+    def getVenueAllocation(self, side, size_usd):
+        """
+        Base size to take on each venue to sweep the consolidated side for a notional size
+        :return: dict venue -> size, only holding venues with a non zero allocation
+        """
+        levels, size, fills = self._getFill(side, size_usd)
+        venue_sizes = np.bincount(levels['venue_indices'][:len(fills)], weights=fills, minlength=len(self.venues))
+        return {self.venues[i]: float(venue_sizes[i]) for i in np.flatnonzero(venue_sizes)}
+
+    def getDepth(self, side, depth_bps):
+        """
+        Consolidated size within depth_bps of the consolidated mid, with its split per venue
+        :return: tuple (size, dict venue -> size)
+        """
+        levels = self.getSide(side)
+        direction = -1 if side == 'bid' else 1
+        n_levels = np.searchsorted(levels['keys'], direction * self.getMid() * (1 + direction * depth_bps / 10000),
+                                   side='right')
+        venue_sizes = np.bincount(levels['venue_indices'][:n_levels], weights=levels['sizes'][:n_levels],
+                                  minlength=len(self.venues))
+        return float(venue_sizes.sum()), {self.venues[i]: float(venue_sizes[i]) for i in np.flatnonzero(venue_sizes)}
@@ -0,0 +1,264 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from smartpy.ccxt.aggregator import CCXTAggregator
+from smartpy.ccxt.fake_exchange import FakeExchange, ExchangeRecording
+from smartpy.ccxt.live_market_data import LiveMarketData, ReplayTransport, CCXTProTransport
+from smartpy.ccxt.ohlc_resampler import OHLCResampler, OHLC_COLUMNS, resampleOHLC
+from smartpy.ccxt.rate_limiter import resetRateLimiters
+from smartpy.ccxt.trade_downloader import TradeDownloader
+from smartpy.ccxt.trade_sync import TradeSync
+
+SYMBOLS = ['BTC/USDT', 'ETH/USDT', 'ETH/BTC']
+START, END = '2024-01-01 00:00', '2024-01-03 23:59'
+
+
+def makeAggregator(recording, ohlc_cache_dir=None, **exchange_config):
+    exchange = 'fake'
+    aggregator = CCXTAggregator({exchange: {'recording': recording, **exchange_config}},
+                                ohlc_cache_dir=ohlc_cache_dir,
+                                rate_limits={exchange: (1000,)},
+                                markets_cache_dir=tempfile.mkdtemp(),
+                                exchange_classes={exchange: FakeExchange})
+    return aggregator, exchange
+
+
+class TestCCXTAggregator(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recording = ExchangeRecording.makeSynthetic(SYMBOLS, n_bars=3 * 1440, n_trades=5000)
+
+    def setUp(self):
+        resetRateLimiters()
+
+    def test_getOHLC(self):
+        aggregator, exchange = makeAggregator(self.recording, ohlcv_limit=500)
+        df = aggregator.get_ohlc(exchange, 'BTC/USDT', '1m', START, END)
+        self.assertEqual(len(df), 3 * 1440)
+        self.assertTrue(df['timestamp'].is_unique and df['timestamp'].is_monotonic_increasing)
+        self.assertEqual(df['close'].tolist(), [i[4] for i in self.recording.ohlcv['BTC/USDT']['1m']])
+
+    def test_getOHLCCached(self):
+        aggregator, exchange = makeAggregator(self.recording, ohlc_cache_dir=tempfile.mkdtemp())
+        expected = aggregator.get_ohlc(exchange, 'BTC/USDT', '1m', START, END)
+        request_counts = dict(aggregator.ccxt_exchange_objects[exchange].request_counts)
+        cached = aggregator.get_ohlc(exchange, 'BTC/USDT', '1m', '2024-01-02', '2024-01-02 12:00')
+        self.assertEqual(dict(aggregator.ccxt_exchange_objects[exchange].request_counts), request_counts)
+        self.assertEqual(cached['close'].tolist(),
+                         expected.set_index('timestamp').loc['2024-01-02':'2024-01-02 12:00', 'close'].tolist())
+
+    def test_getOHLCMany(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        windows = [('2024-01-01 00:00', '2024-01-01 01:00'), ('2024-01-02 00:00', '2024-01-02 01:00')]
+        requests = [{'exchange': exchange, 'symbol': 'BTC/USDT', 'timeframe': '1m', 'start_time': start,
+                     'end_time': end} for start, end in windows + windows[:1]]
+        requests.append({'exchange': 'missing', 'symbol': 'BTC/USDT', 'timeframe': '1m', 'start_time': START})
+        ohlc, failures = aggregator.get_ohlc_many(requests)
+        self.assertEqual(list(failures), [('missing', 'BTC/USDT', '1m', START, None)])
+        frames, _ = aggregator.get_ohlc_many(requests[:2], concat=False)
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(len(ohlc), sum(len(df) for df in frames.values()))
+        self.assertEqual(ohlc['timestamp'].nunique(), len(ohlc))
+
+    def test_getOHLCMulti(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        bars = aggregator.get_ohlc_multi(exchange, 'BTC/USDT', ['5m', '1h', '1d'], START, END)
+        self.assertEqual([len(bars[i]) for i in ['5m', '1h', '1d']], [3 * 288, 3 * 24, 3])
+        self.assertAlmostEqual(bars['1d']['volume'].sum(), bars['5m']['volume'].sum())
+
+    def test_getSyntheticRate(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        tickers = self.recording.tickers
+        self.assertAlmostEqual(aggregator.getSyntheticRate(exchange, 'BTC/ETH'), 1 / tickers['ETH/BTC']['last'])
+        self.assertAlmostEqual(aggregator.getSyntheticRate(exchange, 'ETH/USDT'), tickers['ETH/USDT']['last'])
+
+    def test_getSyntheticRatesUnroutable(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        tickers = self.recording.tickers
+        rates = aggregator.getSyntheticRates(exchange, ['BTC/ETH', 'XRP/USDT', 'ETH/USDT', 'USDT/USDT'])
+        self.assertAlmostEqual(rates['BTC/ETH'], 1 / tickers['ETH/BTC']['last'])
+        self.assertTrue(np.isnan(rates['XRP/USDT']))
+        self.assertAlmostEqual(rates['ETH/USDT'], tickers['ETH/USDT']['last'])
+        self.assertEqual(rates['USDT/USDT'], 1)
+
+    def test_sendAgressiveOrders(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        results = aggregator.sendAgressiveOrders(exchange, [('BTC/USDT', 'buy', 1.0), ('ETH/USDT', 'sell', 2.0)],
+                                                 aggressivity_bps=100, refresh_prices=False)
+        self.assertEqual(results['error'].notna().tolist(), [False, False])
+        self.assertAlmostEqual(results['price'].iloc[0], results['mid'].iloc[0] * 1.01)
+        self.assertAlmostEqual(results['price'].iloc[1], results['mid'].iloc[1] * 0.99)
+        self.assertEqual(aggregator.ccxt_exchange_objects[exchange].request_counts['fetch_tickers'], 1)
+
+    def test_replayClosedOrders(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        aggregator.sendAgressiveOrders(exchange, [('BTC/USDT', 'buy', 1.0), ('BTC/USDT', 'sell', 2.0)],
+                                       refresh_prices=False)
+        recording = ExchangeRecording.record(aggregator, exchange, ['BTC/USDT'], '1h', START, END, private=True)
+        replay_aggregator, exchange = makeAggregator(recording)
+        orders = replay_aggregator.getClosedOrders(exchange, 'BTC/USDT', START, END)
+        self.assertEqual(orders['coin'].tolist(), ['BTC', 'BTC'])
+        self.assertEqual(orders['side'].tolist(), ['buy', 'sell'])
+        self.assertNotIn('info', orders.columns)
+
+    def test_iterClosedOrders(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        exchange_object = aggregator.ccxt_exchange_objects[exchange]
+        for i in range(10):
+            exchange_object.create_order('BTC/USDT', 'limit', 'buy', i + 1.0, 100.0)
+        chunks = list(aggregator.iterClosedOrders(exchange, 'BTC/USDT', START, END, prefetch=2, limit=3))
+        self.assertEqual([len(i) for i in chunks], [3, 3, 3, 1])
+        self.assertEqual(pd.concat(chunks)['id'].tolist(), [str(i + 1) for i in range(10)])
+
+        exchange_object.request_counts.clear()
+        chunks = aggregator.iterClosedOrders(exchange, 'BTC/USDT', START, END, prefetch=2, limit=3)
+        self.assertEqual(next(chunks)['id'].tolist(), ['1', '2', '3'])
+        chunks.close()
+        # The two prefetched pages and the one requested after the first chunk at most
+        self.assertLessEqual(exchange_object.request_counts['fetch_closed_orders'], 3)
+
+    def test_getClosedOrdersEmpty(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        orders = aggregator.getClosedOrders(exchange, 'BTC/USDT', START, END, prefetch=2)
+        self.assertTrue(orders.empty)
+        # No page is requested past the prefetched ones
+        self.assertLessEqual(aggregator.ccxt_exchange_objects[exchange].request_counts['fetch_closed_orders'], 2)
+
+    def test_marketsCacheKey(self):
+        cache_dir = tempfile.mkdtemp()
+        symbols = []
+        for recording_symbols in [['BTC/USDT'], ['ETH/USDT']]:
+            recording = ExchangeRecording.makeSynthetic(recording_symbols, n_bars=10, n_trades=10)
+            aggregator = CCXTAggregator({'binance': {'recording': recording}},
+                                        markets_cache_dir=cache_dir,
+                                        exchange_classes={'binance': FakeExchange})
+            symbols.append(list(aggregator.exchange_markets['binance']))
+        self.assertEqual(symbols, [['BTC/USDT'], ['ETH/USDT']])
+
+    def test_downloadTradesResume(self):
+        aggregator, exchange = makeAggregator(self.recording, trades_limit=300)
+        downloader = TradeDownloader(aggregator, tempfile.mkdtemp(), row_group_size=1000, page_limit=300)
+        n_first = downloader.download(exchange, 'BTC/USDT', START, '2024-01-02')
+        n_second = downloader.download(exchange, 'BTC/USDT', START)
+        df = downloader.load(exchange, 'BTC/USDT')
+        # Naive bounds are UTC whatever the local timezone
+        split = pd.Timestamp('2024-01-02', tz='UTC').value // 10 ** 6
+        self.assertEqual(n_first, sum(i['timestamp'] < split for i in self.recording.trades['BTC/USDT']))
+        self.assertEqual(n_first + n_second, 5000)
+        self.assertEqual(df['id'].tolist(), [i['id'] for i in self.recording.trades['BTC/USDT']])
+
+    def test_downloadTradesBackfill(self):
+        aggregator, exchange = makeAggregator(self.recording, trades_limit=300)
+        downloader = TradeDownloader(aggregator, tempfile.mkdtemp(), row_group_size=1000, page_limit=300)
+        n_later = downloader.download(exchange, 'BTC/USDT', '2024-01-02', '2024-01-03')
+        n_earlier = downloader.download(exchange, 'BTC/USDT', START, '2024-01-02')
+        self.assertGreater(n_earlier, 0)
+        self.assertEqual(downloader.download(exchange, 'BTC/USDT', START, '2024-01-03'), 0)
+        df = downloader.load(exchange, 'BTC/USDT', START, '2024-01-03')
+        self.assertEqual(len(df), n_later + n_earlier)
+        self.assertTrue(df['timestamp'].is_monotonic_increasing)
+        self.assertEqual(set(df['id']), {i['id'] for i in self.recording.trades['BTC/USDT']
+                                         if df['timestamp'].iloc[0] <= i['timestamp'] <= df['timestamp'].iloc[-1]})
+
+    def test_syncMyTrades(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        trade_sync = TradeSync(aggregator, tempfile.mkdtemp(), page_limit=100)
+        expected_ids = [i['id'] for i in self.recording.my_trades['BTC/USDT']]
+        self.assertGreater(len(expected_ids), 100)
+        new_trades, failures = trade_sync.sync(exchange, ['BTC/USDT'])
+        self.assertEqual((len(new_trades), failures), (len(expected_ids), {}))
+        self.assertEqual(len(trade_sync.syncSymbol(exchange, 'BTC/USDT')), 0)
+        self.assertEqual(trade_sync.load(exchange, 'BTC/USDT')['id'].tolist(), expected_ids)
+
+    def test_syncMyTradesCappedPages(self):
+        # The exchange returns at most 50 fills per page whatever the requested limit
+        aggregator, exchange = makeAggregator(self.recording, trades_limit=50)
+        trade_sync = TradeSync(aggregator, tempfile.mkdtemp(), page_limit=100)
+        expected_ids = [i['id'] for i in self.recording.my_trades['ETH/USDT']]
+        new_trades, _ = trade_sync.sync(exchange, ['ETH/USDT'])
+        self.assertEqual(len(new_trades), len(expected_ids))
+        self.assertEqual(len(trade_sync.syncSymbol(exchange, 'ETH/USDT')), 0)
+        self.assertEqual(trade_sync.load(exchange, 'ETH/USDT')['id'].tolist(), expected_ids)
+
+
+class TestOHLCResampler(unittest.TestCase):
+
+    def test_updateChunks(self):
+        recording = ExchangeRecording.makeSynthetic(['BTC/USDT'], n_bars=3 * 1440, n_trades=0)
+        bars = pd.DataFrame(recording.ohlcv['BTC/USDT']['1m'], columns=OHLC_COLUMNS)
+        bars['timestamp'] = pd.to_datetime(bars['timestamp'], unit='ms')
+        timeframes = ['5m', '1h', '90m', '1d']
+        resampler = OHLCResampler(timeframes)
+        # Chunk boundaries falling inside buckets of every timeframe, and a chunk repeating bars already seen
+        chunks = [(0, 7), (7, 20), (20, 95), (95, 1500), (1490, 2000), (2000, 2001), (2001, len(bars))]
+        for start, end in chunks:
+            updated = resampler.update(bars.iloc[start:end])
+            for timeframe in timeframes:
+                if len(updated[timeframe]) > 0:
+                    pd.testing.assert_frame_equal(updated[timeframe].iloc[-1:].reset_index(drop=True),
+                                                  resampler.getBars(timeframe).iloc[-1:].reset_index(drop=True))
+        self.assertTrue(all(len(i) == 0 for i in resampler.update(bars.iloc[:10]).values()))
+        for timeframe in timeframes:
+            pd.testing.assert_frame_equal(resampler.getBars(timeframe), resampleOHLC(bars, timeframe))
+
+
+class TestLiveMarketData(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recording = ExchangeRecording.makeSynthetic(SYMBOLS, n_bars=60, n_trades=100)
+
+    def setUp(self):
+        resetRateLimiters()
+
+    def test_replay(self):
+        messages = [{'type': 'book', 'symbol': 'BTC/USDT', 'bids': [[99, 1], [98, 2]], 'asks': [[101, 1]],
+                     'timestamp': 1},
+                    {'type': 'ticker', 'symbol': 'BTC/USDT', 'bid': None, 'ask': None, 'last': 123, 'timestamp': 2},
+                    {'type': 'trade', 'symbol': 'ETH/USDT', 'price': 10, 'amount': 1, 'side': 'buy', 'timestamp': 3}]
+        live_market_data = LiveMarketData('fake', ['BTC/USDT'], ReplayTransport(messages)).start()
+        live_market_data.join(5)
+        self.assertEqual(live_market_data.n_messages, 2)
+        self.assertEqual(live_market_data.getMid('BTC/USDT'), 100)
+        self.assertEqual(live_market_data.get_last('BTC/USDT'), 123)
+        self.assertEqual(live_market_data.getOrderBook('BTC/USDT')['bids'], [[99, 1], [98, 2]])
+        with self.assertRaises(KeyError):
+            live_market_data.get_last('ETH/USDT')
+
+    def test_aggregatorFallback(self):
+        aggregator, exchange = makeAggregator(self.recording)
+        ticker = self.recording.tickers['BTC/USDT']
+        messages = [{'type': 'ticker', 'symbol': 'BTC/USDT', 'bid': None, 'ask': None, 'last': 123, 'timestamp': 1}]
+        aggregator.subscribeLiveMarketData(exchange, ['BTC/USDT'], transport=ReplayTransport(messages), max_age=0.05)
+        aggregator.exchange_live_market_data[exchange].join(5)
+        # Ticker without bid/ask: the mid comes from the REST snapshot
+        self.assertAlmostEqual(aggregator.getMid(exchange, 'BTC/USDT'), 0.5 * (ticker['bid'] + ticker['ask']))
+        self.assertEqual(aggregator.get_last(exchange, 'BTC/USDT'), 123)
+        time.sleep(0.1)
+        self.assertEqual(aggregator.get_last(exchange, 'BTC/USDT'), ticker['last'])
+
+    def test_watcherReconnects(self):
+        transport = CCXTProTransport('fake', reconnect_delay=0.001)
+        stop_event = threading.Event()
+        calls = []
+
+        async def watchOnce():
+            calls.append(len(calls))
+            if len(calls) <= 2:
+                raise ConnectionError('websocket closed')
+            if len(calls) == 5:
+                stop_event.set()
+
+        asyncio.run(transport._watch('ticker BTC/USDT', watchOnce, stop_event))
+        self.assertEqual(len(calls), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import threading
+import unittest
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import smartpy.utility.dt_util as dt_util
+from smartpy.ccxt.helpers import GateIOHistoryDownloader, GateIOAPIRequestError, processGateIOCCXTOrdersDF
+
+START, END = '2024-01-01', '2024-01-20'
+
+
+class StubResponse:
+
+    def __init__(self, status_code, orders=None):
+        self.status_code = status_code
+        self.orders = orders
+        self.content = b''
+
+    def json(self):
+        return self.orders
+
+
+class StubSession:
+    """
+    Gate.io spot orders endpoint serving n_orders finished orders per (currency pair, window), page by page
+    """
+
+    def __init__(self, n_orders, status_code=200):
+        self.n_orders = n_orders
+        self.status_code = status_code
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get(self, request_url, headers=None):
+        query = {key: values[0] for key, values in parse_qs(urlparse(request_url).query).items()}
+        with self._lock:
+            self.requests.append(query)
+        if self.status_code != 200:
+            return StubResponse(self.status_code)
+        page, limit = int(query['page']), int(query['limit'])
+        window = f"{query['currency_pair']}-{query['to']}"
+        orders = [{'id': f"{window}-{i}", 'text': 't-0', 'currency_pair': query['currency_pair']}
+                  for i in range(self.n_orders)]
+        return StubResponse(200, orders[(page - 1) * limit:page * limit])
+
+
+class StubRateLimiter:
+
+    def __init__(self):
+        self.n_penalties = 0
+
+    def acquire(self, weight=1):
+        pass
+
+    def penalize(self, seconds=None):
+        self.n_penalties += 1
+
+
+def makeDownloader(session, **kwargs):
+    downloader = GateIOHistoryDownloader(start=START, end=END, page_limit=100, max_workers=4, api_key='key',
+                                         api_secret='secret', **kwargs)
+    downloader.session = session
+    downloader.rate_limiter = StubRateLimiter()
+    return downloader
+
+
+class TestGateIOHistoryDownloader(unittest.TestCase):
+
+    def test_download(self):
+        session = StubSession(n_orders=250)
+        downloader = makeDownloader(session)
+        intervals = downloader.getIntervals()
+        # Two full 7 day windows and the trailing partial one up to the end
+        self.assertEqual(len(intervals), 3)
+        self.assertEqual(intervals[-1][1], dt_util.toUnixTimestamp(END))
+        df = downloader.download(['BTC/USDT', 'ETH/USDT'])
+        expected_ids = {f"{pair}-{interval[1]}-{i}" for pair in ['BTC_USDT', 'ETH_USDT'] for interval in intervals
+                        for i in range(250)}
+        self.assertEqual(len(df), len(expected_ids))
+        self.assertEqual(set(df['id']), expected_ids)
+        # 3 pages of orders and the empty page ending each window
+        self.assertEqual(len(session.requests), 2 * 3 * 4)
+
+    def test_downloadParquet(self):
+        downloader = makeDownloader(StubSession(n_orders=150))
+        parquet_path = os.path.join(tempfile.mkdtemp(), 'orders.parquet')
+        self.assertEqual(downloader.download('BTC/USDT', parquet_path=parquet_path), parquet_path)
+        df = pq.read_table(parquet_path).to_pandas()
+        self.assertEqual(list(df.columns), ['id', 'text', 'currency_pair'])
+        self.assertEqual(set(df['id']), {f"BTC_USDT-{interval[1]}-{i}" for interval in downloader.getIntervals()
+                                         for i in range(150)})
+
+    def test_rateLimitRetries(self):
+        session = StubSession(n_orders=0, status_code=429)
+        downloader = makeDownloader(session, max_rate_limit_retries=2)
+        with self.assertRaises(GateIOAPIRequestError):
+            downloader.requestPage('BTC/USDT', downloader.getIntervals()[0], 1)
+        self.assertEqual(len(session.requests), 3)
+        self.assertEqual(downloader.rate_limiter.n_penalties, 3)
+
+
+class TestProcessGateIOCCXTOrdersDF(unittest.TestCase):
+
+    def test_missingCoin(self):
+        orders = pd.DataFrame({'timestamp': [1704067200000, 1704067260000, 1704067320000],
+                               'coin': ['BTC/USDT', None, 'ETH/USDT'],
+                               'price': [40000.0, 1.0, 2000.0],
+                               'fees': [[{'currency': 'GT', 'cost': 0.1}, {'currency': 'USDT', 'cost': 1.0}], [],
+                                        [{'currency': 'ETH', 'cost': 0.001}]],
+                               'info': None, 'fee': None, 'trades': None})
+        df = processGateIOCCXTOrdersDF(orders)
+        self.assertEqual(df['coin'].iloc[[0, 2]].tolist(), ['BTC', 'ETH'])
+        self.assertTrue(pd.isna(df['coin'].iloc[1]))
+        self.assertEqual(df['fee_currency'].iloc[[0, 2]].tolist(), ['USDT', 'ETH'])
+        self.assertEqual(df['fee_USDT'].tolist()[::2], [1.0, 2.0])
+        self.assertTrue(np.isnan(df['fee_USDT'].iloc[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from smartpy.utility.ob_store import OrderBookSnapshotStore
+from smartpy.utility.ob_util import OrderBookReconstructor, IncrementalOrderBook, ConsolidatedOrderBook, \
+    computeOrderBookMetrics
+
+
+def makeBook(rng, n_levels):
+    mid = rng.uniform(100, 50000)
+    tick = mid * 1e-4
+    ask_prices = mid + tick * np.cumsum(rng.integers(1, 5, n_levels))
+    bid_prices = mid - tick * np.cumsum(rng.integers(1, 5, n_levels))
+    asks_dict, bids_dict = {}, {}
+    for i in range(n_levels):
+        asks_dict[f"ask_price_{i}"] = ask_prices[i]
+        asks_dict[f"ask_amount_{i}"] = rng.uniform(0.01, 5)
+        bids_dict[f"bid_price_{i}"] = bid_prices[i]
+        bids_dict[f"bid_amount_{i}"] = rng.uniform(0.01, 5)
+    return asks_dict, bids_dict
+
+
+def getLevelsLoop(book_dict, side, price_threshold, direction):
+    """
+    Reference level truncation, walking the levels like the original implementation
+    """
+    prices, sizes = [], []
+    for i in range(len(book_dict) // 2):
+        prices.append(book_dict[f"{side}_price_{i}"])
+        sizes.append(book_dict[f"{side}_amount_{i}"])
+        if direction * book_dict[f"{side}_price_{i}"] > direction * price_threshold:
+            break
+    return np.array(prices), np.array(sizes)
+
+
+def getVwapLoop(prices, sizes, size, is_executable):
+    cum_size = 0.0
+    int_sizes = []
+    for level_size in sizes:
+        if level_size + cum_size < size:
+            int_sizes.append(level_size)
+            cum_size += level_size
+        else:
+            int_sizes.append(size - cum_size)
+            cum_size += size - cum_size
+    if is_executable and cum_size < size:
+        return np.nan
+    return np.average(prices, weights=int_sizes)
+
+
+class TestOrderBookReconstructor(unittest.TestCase):
+
+    def test_matchesLevelLoop(self):
+        rng = np.random.default_rng(0)
+        ob = OrderBookReconstructor(orderbook_depth_perc=0.5, capacity=8)
+        for _ in range(200):
+            asks_dict, bids_dict = makeBook(rng, int(rng.integers(1, 40)))
+            ob.update(asks_dict, bids_dict)
+            mid = (asks_dict['ask_price_0'] + bids_dict['bid_price_0']) / 2
+            ask_prices, ask_sizes = getLevelsLoop(asks_dict, 'ask', mid * 1.005, 1)
+            bid_prices, bid_sizes = getLevelsLoop(bids_dict, 'bid', mid * 0.995, -1)
+            np.testing.assert_array_equal(ob.ask_prices, ask_prices)
+            np.testing.assert_array_equal(ob.bid_sizes, bid_sizes)
+            self.assertAlmostEqual(ob.total_ask_size, ask_sizes.sum())
+            self.assertEqual(ob.mid, mid)
+
+            for size_usd in rng.uniform(0, 2 * mid * min(ask_sizes.sum(), bid_sizes.sum()), 5):
+                for is_executable in [False, True]:
+                    np.testing.assert_allclose(ob.getAskVwap(size_usd, is_executable),
+                                               getVwapLoop(ask_prices, ask_sizes, size_usd / mid, is_executable))
+                    np.testing.assert_allclose(ob.getBidVwap(size_usd, is_executable),
+                                               getVwapLoop(bid_prices, bid_sizes, size_usd / mid, is_executable))
+
+    def test_updateArrays(self):
+        ob = OrderBookReconstructor(orderbook_depth_perc=1)
+        ob.updateArrays(np.array([99.0, 98.0, 97.0]), np.array([1.0, 2.0, 3.0]),
+                        np.array([101.0, 102.0, 103.0]), np.array([1.0, 1.0, 1.0]))
+        self.assertEqual(ob.mid, 100.0)
+        self.assertEqual(ob.tob_spread_bps, 200.0)
+        self.assertEqual(len(ob.bid_prices), 2)
+        self.assertEqual(ob.getBidDepth(150), 1.0)
+        self.assertEqual(ob.getBidDepth(250), 3.0)
+        self.assertEqual(ob.getAskDepth(50), 0.0)
+        self.assertAlmostEqual(ob.getBidVwap(200), (99.0 + 98.0) / 2)
+        self.assertTrue(np.isnan(ob.getAskVwap(1000, is_executable=True)))
+
+    def test_getVwapCurve(self):
+        ob = OrderBookReconstructor(orderbook_depth_perc=5)
+        ob.updateArrays(np.array([99.0, 98.0, 97.0]), np.array([1.0, 2.0, 3.0]),
+                        np.array([101.0, 102.0, 103.0]), np.array([1.0, 1.0, 1.0]))
+        # 200 USD is 2 units at a mid of 100: one level plus one unit of the next on each side
+        self.assertAlmostEqual(ob.getVWSpreadBps(200), ((101.0 + 102.0) / 2 - (99.0 + 98.0) / 2) / 100 * 10000)
+        sizes_usd = np.array([50.0, 200.0, 450.0, 600.0])
+        curve = ob.getVwapCurve(sizes_usd)
+        np.testing.assert_array_equal(curve['bid_executable'], [True, True, True, True])
+        np.testing.assert_array_equal(curve['ask_executable'], [True, True, False, False])
+        for i, size_usd in enumerate(sizes_usd):
+            self.assertAlmostEqual(curve['bid_vwap'][i], ob.getBidVwap(size_usd))
+            self.assertAlmostEqual(curve['ask_vwap'][i], ob.getAskVwap(size_usd))
+            self.assertAlmostEqual(curve['vw_mid'][i], ob.getVWMid(size_usd))
+            np.testing.assert_allclose(curve['vw_spread_bps'][i], ob.getVWSpreadBps(size_usd), equal_nan=True)
+
+    def test_computeOrderBookMetrics(self):
+        rng = np.random.default_rng(0)
+        n_snapshots, n_levels = 500, 20
+        mids = rng.uniform(100, 200, n_snapshots)[:, None]
+        ask_prices = mids + 0.05 * np.cumsum(rng.integers(1, 5, (n_snapshots, n_levels)), axis=1)
+        bid_prices = mids - 0.05 * np.cumsum(rng.integers(1, 5, (n_snapshots, n_levels)), axis=1)
+        ask_sizes = rng.uniform(0.01, 3, (n_snapshots, n_levels))
+        bid_sizes = rng.uniform(0.01, 3, (n_snapshots, n_levels))
+        snapshot_levels = rng.integers(1, n_levels + 1, n_snapshots)
+        for levels in [ask_prices, ask_sizes, bid_prices, bid_sizes]:
+            levels[np.arange(n_levels) >= snapshot_levels[:, None]] = np.nan
+
+        metrics = computeOrderBookMetrics(bid_prices, bid_sizes, ask_prices, ask_sizes, 1.0, vw_sizes_usd=(500,),
+                                          chunk_size=64)
+        ob = OrderBookReconstructor(orderbook_depth_perc=1.0)
+        for i, n in enumerate(snapshot_levels):
+            ob.updateArrays(bid_prices[i, :n], bid_sizes[i, :n], ask_prices[i, :n], ask_sizes[i, :n])
+            np.testing.assert_allclose(metrics.loc[i, ['mid', 'tob_spread_bps', 'total_bid_size', 'ask_dispersion',
+                                                      'bid_vwap_500', 'ask_vwap_500']].to_numpy(dtype=float),
+                                       [ob.mid, ob.tob_spread_bps, ob.total_bid_size, ob.getAskDispersion(),
+                                        ob.getBidVwap(500, True), ob.getAskVwap(500, True)], equal_nan=True)
+
+
+class TestIncrementalOrderBook(unittest.TestCase):
+
+    def test_matchesRebuiltBook(self):
+        rng = np.random.default_rng(0)
+        book = IncrementalOrderBook(orderbook_depth_perc=0.5)
+        book.applySnapshot([(100 - i * 0.1, 1.0) for i in range(1, 50)], [(100 + i * 0.1, 1.0) for i in range(1, 50)],
+                           sequence=0)
+        bids, asks = dict(book.bids), dict(book.asks)
+        for sequence in range(1, 2000):
+            side_levels, direction = (bids, -1) if rng.random() < 0.5 else (asks, 1)
+            price = round(100 + direction * 0.1 * int(rng.integers(1, 80)), 1)
+            size = 0.0 if rng.random() < 0.3 else float(rng.uniform(0.1, 3))
+            deltas = [(price, size)]
+            book.applyDeltas(deltas if side_levels is bids else [], deltas if side_levels is asks else [],
+                             sequence=sequence)
+            if size > 0:
+                side_levels[price] = size
+            else:
+                side_levels.pop(price, None)
+
+        self.assertFalse(book.applyDeltas([(99.9, 5.0)], [], sequence=10))
+        bid_prices, bid_sizes, ask_prices, ask_sizes = book.getTopLevels(10)
+        np.testing.assert_array_equal(bid_prices, sorted(bids, reverse=True)[:10])
+        np.testing.assert_array_equal(ask_sizes, [asks[i] for i in sorted(asks)[:10]])
+        self.assertAlmostEqual(book.total_bid_size, sum(bids.values()))
+        self.assertAlmostEqual(book.total_ask_size, sum(asks.values()))
+        mid = (max(bids) + min(asks)) / 2
+        self.assertEqual(book.getMid(), mid)
+        bid_depth, ask_depth = book.getDepth()
+        self.assertAlmostEqual(bid_depth, sum(size for price, size in bids.items() if price >= mid * 0.995))
+        self.assertAlmostEqual(ask_depth, sum(size for price, size in asks.items() if price <= mid * 1.005))
+        ob = book.toReconstructor(OrderBookReconstructor(orderbook_depth_perc=100), 10)
+        self.assertEqual(ob.mid, mid)
+        with self.assertRaises(ValueError):
+            IncrementalOrderBook().getDepth()
+
+
+class TestConsolidatedOrderBook(unittest.TestCase):
+
+    def test_incrementalMatchesFullMerge(self):
+        rng = np.random.default_rng(0)
+        venues = ['binance', 'okx', 'kraken']
+
+        def makeLadders():
+            mid = 100 + rng.normal() * 0.02
+            return (np.round(mid - 0.01 * np.cumsum(rng.integers(1, 4, 30)), 2), rng.uniform(0.1, 2, 30),
+                    np.round(mid + 0.01 * np.cumsum(rng.integers(1, 4, 30)), 2), rng.uniform(0.1, 2, 30))
+
+        ladders = {venue: makeLadders() for venue in venues}
+        book = ConsolidatedOrderBook()
+        for venue in venues:
+            book.updateVenueArrays(venue, *ladders[venue])
+        for _ in range(50):
+            venue = venues[rng.integers(0, len(venues))]
+            ladders[venue] = makeLadders()
+            book.updateVenueArrays(venue, *ladders[venue])
+            rebuilt = ConsolidatedOrderBook()
+            for other_venue in venues:
+                rebuilt.updateVenueArrays(other_venue, *ladders[other_venue])
+            for side in ['bid', 'ask']:
+                prices = book.getSide(side)['prices']
+                np.testing.assert_array_equal(prices, rebuilt.getSide(side)['prices'])
+                # Venues quoting the same price can be merged in a different order, totals per price can not differ
+                price_ends = np.append(np.flatnonzero(np.diff(prices)), len(prices) - 1)
+                np.testing.assert_allclose(book.getSide(side)['cum_sizes'][price_ends],
+                                           rebuilt.getSide(side)['cum_sizes'][price_ends])
+
+        ask_prices = np.concatenate([ladders[venue][2] for venue in venues])
+        ask_sizes = np.concatenate([ladders[venue][3] for venue in venues])
+        order = np.argsort(ask_prices, kind='stable')
+        ob = OrderBookReconstructor(orderbook_depth_perc=100)
+        ob.updateArrays(np.array([book.bid_price]), np.array([1.0]), ask_prices[order], ask_sizes[order])
+        self.assertAlmostEqual(book.getVwap('ask', 500), ob.getAskVwap(500))
+        allocation = book.getVenueAllocation('ask', 500)
+        self.assertAlmostEqual(sum(allocation.values()), 500 / book.getMid())
+        self.assertTrue(set(allocation) <= set(venues))
+        self.assertEqual(book.getLevels('ask', 1)[0][0], ask_prices.min())
+
+
+class TestOrderBookSnapshotStore(unittest.TestCase):
+
+    def test_appendReplay(self):
+        rng = np.random.default_rng(0)
+        n_snapshots, n_levels = 1000, 10
+        mids = np.round(rng.uniform(60000, 61000, n_snapshots), 1)[:, None]
+        ask_prices = mids + 0.1 * np.cumsum(rng.integers(1, 5, (n_snapshots, n_levels)), axis=1)
+        bid_prices = mids - 0.1 * np.cumsum(rng.integers(1, 5, (n_snapshots, n_levels)), axis=1)
+        ask_sizes = rng.uniform(0.01, 3, (n_snapshots, n_levels)).astype(np.float32)
+        bid_sizes = rng.uniform(0.01, 3, (n_snapshots, n_levels)).astype(np.float32)
+        ask_prices[3, 6:], ask_sizes[3, 6:] = np.nan, np.nan
+        timestamps = pd.date_range('2024-01-01', periods=n_snapshots, freq='100ms')
+
+        path = tempfile.mkdtemp()
+        store = OrderBookSnapshotStore(path, n_levels=12, tick_size=0.1)
+        store.append(timestamps[:400], bid_prices[:400], bid_sizes[:400], ask_prices[:400], ask_sizes[:400])
+        store.append(timestamps[400:], bid_prices[400:], bid_sizes[400:], ask_prices[400:], ask_sizes[400:])
+        with self.assertRaises(ValueError):
+            store.append(timestamps[:1], bid_prices[:1], bid_sizes[:1], ask_prices[:1], ask_sizes[:1])
+
+        store = OrderBookSnapshotStore(path)
+        self.assertEqual(len(store), n_snapshots)
+        expected = computeOrderBookMetrics(bid_prices, bid_sizes, ask_prices, ask_sizes, 1.0, vw_sizes_usd=(10000,))
+        metrics = store.computeMetrics(1.0, vw_sizes_usd=(10000,), chunk_size=300)
+        np.testing.assert_allclose(metrics.to_numpy(), expected.to_numpy(), rtol=1e-9)
+
+        replayed = [(timestamp, ob.mid, len(ob.ask_prices)) for timestamp, ob in
+                    store.replay(OrderBookReconstructor(orderbook_depth_perc=100), '2024-01-01', timestamps[10])]
+        self.assertEqual(len(replayed), 10)
+        self.assertEqual(replayed[3][2], 6)
+        self.assertAlmostEqual(replayed[5][1], expected['mid'].iloc[5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import threading
+import time
+import unittest
+
+from smartpy.ccxt.rate_limiter import TokenBucket, getRateLimiter, resetRateLimiters, getEndpointWeight
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        resetRateLimiters()
+
+    def test_burstThenRate(self):
+        bucket = TokenBucket(rate=100, capacity=10)
+        start = time.monotonic()
+        for _ in range(10):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.05)
+        for _ in range(20):
+            bucket.acquire()
+        self.assertAlmostEqual(time.monotonic() - start, 0.2, delta=0.1)
+        self.assertEqual(bucket.getMetrics()['requests'], 30)
+
+    def test_weightAndPenalty(self):
+        bucket = TokenBucket(rate=100, capacity=10)
+        bucket.acquire(10)
+        start = time.monotonic()
+        bucket.acquire(5)
+        self.assertAlmostEqual(time.monotonic() - start, 0.05, delta=0.04)
+        bucket.penalize(seconds=0.1)
+        start = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(bucket.getMetrics()['penalties'], 1)
+
+    def test_concurrentAcquire(self):
+        bucket = TokenBucket(rate=200, capacity=1)
+        threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(10)]) for _ in range(4)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertAlmostEqual(time.monotonic() - start, 40 / 200, delta=0.1)
+        self.assertEqual(bucket.getMetrics()['queue_length'], 0)
+
+    def test_registry(self):
+        rate_limiter = getRateLimiter('exchange_a', default_rate=5)
+        self.assertEqual(rate_limiter.rate, 5)
+        self.assertIs(getRateLimiter('exchange_a', default_rate=50), rate_limiter)
+        self.assertEqual(rate_limiter.rate, 5)
+        # An explicit rate is applied to the shared bucket
+        self.assertIs(getRateLimiter('exchange_a', 500), rate_limiter)
+        self.assertEqual((rate_limiter.rate, rate_limiter.capacity), (500, 500))
+        resetRateLimiters()
+        self.assertIsNot(getRateLimiter('exchange_a'), rate_limiter)
+        self.assertEqual(getEndpointWeight('binance', 'fetch_tickers'), 40)
+        self.assertEqual(getEndpointWeight('unknown', 'fetch_ohlcv'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
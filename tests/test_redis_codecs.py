@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from smartpy.redis.redis_codecs import JsonCodec, MsgpackCodec, StructCodec, getTradeCodec, getL2Codec, toArrowTable
+
+
+def toStreamFields(fields):
+    # Redis returns field names and values as bytes
+    return {key.encode('utf-8') if isinstance(key, str) else key: value.encode('utf-8') if isinstance(value, str)
+            else value for key, value in fields.items()}
+
+
+class TestRedisCodecs(unittest.TestCase):
+
+    def setUp(self):
+        self.trades = [{'timestamp': 1600000000000 + i, 'price': 100.5 + i, 'amount': 0.25 * i, 'side': 1 - 2 * (i % 2)}
+                       for i in range(10)]
+
+    def test_jsonCodec(self):
+        codec = JsonCodec()
+        message = {'symbol': 'BTC/USDT', 'price': 100.5, 'levels': [[1, 2], [3, 4]]}
+        self.assertEqual(codec.decode(toStreamFields(codec.encode(message))), message)
+        columns = codec.decodeBatch([toStreamFields(codec.encode(trade)) for trade in self.trades])
+        np.testing.assert_array_equal(columns['price'], [trade['price'] for trade in self.trades])
+
+    def test_msgpackCodec(self):
+        codec = MsgpackCodec()
+        message = {'symbol': 'BTC/USDT', 'price': 100.5, 'levels': [[1, 2], [3, 4]]}
+        self.assertEqual(codec.decode(codec.encode(message)), message)
+        columns = codec.decodeBatch([codec.encode(trade) for trade in self.trades])
+        np.testing.assert_array_equal(columns['side'], [trade['side'] for trade in self.trades])
+
+    def test_structCodec(self):
+        codec = getTradeCodec()
+        fields_list = [codec.encode(trade) for trade in self.trades]
+        self.assertEqual(codec.decode(fields_list[3]), self.trades[3])
+        columns = codec.decodeBatch(fields_list)
+        for name in codec.names:
+            np.testing.assert_array_equal(columns[name], [trade[name] for trade in self.trades])
+        self.assertEqual(columns['side'].dtype, np.int8)
+        table = toArrowTable(columns)
+        self.assertEqual(table.num_rows, len(self.trades))
+        self.assertEqual(table.column('amount').to_pylist(), [trade['amount'] for trade in self.trades])
+
+    def test_structCodecBytesAndL2(self):
+        codec = StructCodec([('symbol', 'S8'), ('price', np.float32)])
+        self.assertEqual(codec.struct.size, 12)
+        columns = codec.decodeBatch([codec.encode({'symbol': b'ETH', 'price': 2.5})])
+        self.assertEqual(columns['symbol'][0], b'ETH')
+        l2_codec = getL2Codec(5)
+        snapshot = {name: float(i) for i, name in enumerate(l2_codec.names)}
+        snapshot['timestamp'] = 1600000000000
+        self.assertEqual(len(l2_codec.encode(snapshot)[b'd']), 8 + 5 * 4 * 8)
+        self.assertEqual(l2_codec.decode(l2_codec.encode(snapshot)), snapshot)
+
+
+if __name__ == '__main__':
+    unittest.main()
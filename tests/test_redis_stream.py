@@ -0,0 +1,176 @@
+import time
+import unittest
+
+from redis.exceptions import ConnectionError, ResponseError
+
+from smartpy.redis.redis_codecs import JsonCodec
+from smartpy.redis.redis_stream_consumer import RedisStreamConsumer
+from smartpy.redis.redis_stream_writer import RedisStreamWriter
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class StubPipeline:
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def xadd(self, stream_name, fields, maxlen=None, approximate=True):
+        self.commands.append((stream_name, fields))
+
+    def execute(self, raise_on_error=True):
+        if self.redis_client.n_connection_errors > 0:
+            self.redis_client.n_connection_errors -= 1
+            raise ConnectionError('Connection reset by peer')
+        self.redis_client.n_executes += 1
+        results = []
+        for stream_name, fields in self.commands:
+            if stream_name in self.redis_client.wrong_type_streams:
+                results.append(ResponseError('WRONGTYPE Operation against a key holding the wrong kind of value'))
+            else:
+                self.redis_client.streams.setdefault(stream_name, []).append(fields)
+                results.append(f"{len(self.redis_client.streams[stream_name])}-0".encode('utf-8'))
+        return results
+
+
+class StubRedis:
+    """
+    In memory stand-in of the redis.Redis stream commands used by the writer
+    """
+
+    def __init__(self, n_connection_errors=0, wrong_type_streams=()):
+        self.streams = {}
+        self.n_executes = 0
+        self.n_connection_errors = n_connection_errors
+        self.wrong_type_streams = set(wrong_type_streams)
+
+    def pipeline(self, transaction=False):
+        return StubPipeline(self)
+
+
+class TestRedisStreamWriter(unittest.TestCase):
+
+    def test_batchedWrites(self):
+        redis_client = StubRedis()
+        writer = RedisStreamWriter(redis_client, JsonCodec().encode, batch_size=50, flush_interval=1)
+        for i in range(200):
+            writer.add('trades', {'price': i})
+        writer.flush()
+        writer.close()
+        self.assertEqual([int(i['price']) for i in redis_client.streams['trades']], list(range(200)))
+        self.assertEqual(writer.getMetrics()['written'], 200)
+        self.assertLessEqual(redis_client.n_executes, 5)
+
+    def test_encodingErrorRaisesToCaller(self):
+        redis_client = StubRedis()
+        writer = RedisStreamWriter(redis_client, JsonCodec().encode)
+        for i in range(50):
+            writer.add('trades', {'price': i})
+        with self.assertRaises(TypeError):
+            writer.add('trades', {'price': {1, 2}})
+        for i in range(50):
+            writer.add('trades', {'price': i})
+        writer.close()
+        self.assertEqual(len(redis_client.streams['trades']), 100)
+        self.assertEqual(writer.getMetrics()['failed'], 0)
+
+    def test_retryAndCommandErrors(self):
+        redis_client = StubRedis(n_connection_errors=2, wrong_type_streams=['order_book'])
+        writer = RedisStreamWriter(redis_client, JsonCodec().encode, retry_backoff=0.001)
+        for i in range(10):
+            writer.add('trades', {'price': i})
+        writer.add('order_book', {'bid': 1})
+        writer.close()
+        metrics = writer.getMetrics()
+        self.assertEqual((metrics['written'], metrics['failed'], metrics['retries']), (10, 1, 2))
+        self.assertEqual(len(redis_client.streams['trades']), 10)
+
+    def test_retriesExhausted(self):
+        redis_client = StubRedis(n_connection_errors=10)
+        writer = RedisStreamWriter(redis_client, JsonCodec().encode, max_retries=2, retry_backoff=0.001)
+        writer.add('trades', {'price': 1})
+        writer.close()
+        self.assertEqual(writer.getMetrics()['failed'], 1)
+        self.assertEqual(redis_client.streams, {})
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+class TestRedisStreamConsumer(unittest.TestCase):
+
+    def setUp(self):
+        self.redis_client = fakeredis.FakeRedis()
+        self.codec = JsonCodec()
+
+    def makeConsumer(self, consumer, **kwargs):
+        return RedisStreamConsumer(self.redis_client, 'trades', 'workers', consumer, self.codec.decode,
+                                   start_id='0', block_ms=10, **kwargs)
+
+    def addTrades(self, prices):
+        for price in prices:
+            self.redis_client.xadd('trades', self.codec.encode({'price': price}))
+
+    def runUntil(self, consumer, process, condition, timeout=10):
+        thread = consumer.start(process, claim_interval=0, error_delay=0.01)
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        consumer.stop()
+        thread.join(5)
+        self.assertTrue(condition())
+
+    def test_ackAndClaim(self):
+        self.addTrades(range(10))
+        dead_consumer = self.makeConsumer('worker_1', count=4)
+        self.assertEqual([i[2]['price'] for i in dead_consumer.read()], [0, 1, 2, 3])
+        consumer = self.makeConsumer('worker_2', min_idle_ms=1)
+        messages = consumer.read()
+        self.assertEqual([i[2]['price'] for i in messages], list(range(4, 10)))
+        consumer.ack(messages)
+        time.sleep(0.01)
+        claimed = consumer.claimStale()
+        self.assertEqual([i[2]['price'] for i in claimed], [0, 1, 2, 3])
+        self.assertEqual(self.redis_client.xpending('trades', 'workers')['pending'], 4)
+        consumer.ack(claimed)
+        self.assertEqual(self.redis_client.xpending('trades', 'workers')['pending'], 0)
+
+    def test_pendingRecoveryFailure(self):
+        self.addTrades(range(5))
+        self.makeConsumer('worker_1').read()
+        consumer = self.makeConsumer('worker_1', min_idle_ms=1)
+        processed = []
+        failures = []
+
+        def process(messages):
+            # The first attempt of the recovered entries fails, the worker has to keep running
+            if len(failures) == 0:
+                failures.append(len(messages))
+                raise ValueError('Database unavailable')
+            processed.extend(i[2]['price'] for i in messages)
+
+        self.runUntil(consumer, process, lambda: len(processed) == 5)
+        self.assertEqual(sorted(processed), list(range(5)))
+        self.assertEqual(self.redis_client.xpending('trades', 'workers')['pending'], 0)
+
+    def test_poisonMessage(self):
+        self.addTrades([1, 2, -1, 3])
+        consumer = self.makeConsumer('worker_1', min_idle_ms=1, max_deliveries=3, dead_letter_stream='trades_dlq')
+        processed = []
+
+        def process(messages):
+            if any(i[2]['price'] < 0 for i in messages):
+                raise ValueError('Negative price')
+            processed.extend(i[2]['price'] for i in messages)
+
+        self.runUntil(consumer, process, lambda: consumer.n_dead_letters == 1)
+        self.assertEqual(sorted(processed), [1, 2, 3])
+        self.assertEqual(self.redis_client.xpending('trades', 'workers')['pending'], 0)
+        dead_letters = self.redis_client.xrange('trades_dlq')
+        self.assertEqual([self.codec.decode(fields) for _, fields in dead_letters], [{'price': -1}])
+
+
+if __name__ == '__main__':
+    unittest.main()